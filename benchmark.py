@@ -0,0 +1,380 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import record_store
+import util
+from blob_store import git_blob_id
+
+
+# Runs crawl -> write -> split against a local stand-in for api.github.com and github.com,
+# no network and no token needed:
+#   python benchmark.py --pulls 2000 --latency 0.02 --error-rate 0.01 --json bench.json
+# The stand-in serves a synthetic repository built from a seed, so two runs with the same
+# arguments see exactly the same pulls, diffs, issues and raw files.
+
+
+def _sha(*parts):
+    return hashlib.sha1('/'.join(str(p) for p in parts).encode('UTF-8')).hexdigest()
+
+
+class FakeRepo(object):
+    # num_pulls merged pulls; a defect_ratio share of them say "fixes #n" and, of those,
+    # a go_ratio share change one line inside one function of a go file
+
+    def __init__(self, owner='bench', repo='repo', num_pulls=500, num_files=20, num_functions=30,
+                 defect_ratio=0.5, go_ratio=0.8, seed=0):
+        self.owner = owner
+        self.repo = repo
+        self.num_files = num_files
+        self.num_functions = num_functions
+        rng = random.Random(seed)
+        self.pulls = []
+        for n in range(1, num_pulls + 1):
+            is_defect = rng.random() < defect_ratio
+            self.pulls.append({
+                'number': n,
+                'is_defect': is_defect,
+                'is_go': is_defect and rng.random() < go_ratio,
+                'file': rng.randrange(num_files),
+                'function': rng.randrange(num_functions),
+                'created_at': '2021-01-01T00:00:00Z',
+                'closed_at': '2021-06-01T00:00:00Z',
+            })
+        # (sha, path) -> (pull, fixed) for the raw file urls
+        self._files = {}
+        for pull in self.pulls:
+            if pull['is_go']:
+                base, head = self.shas(pull)
+                self._files[(base, self.path(pull))] = (pull, False)
+                self._files[(head, self.path(pull))] = (pull, True)
+
+    def go_file(self, pull, fixed):
+        lines = ['package bench', '']
+        for m in range(self.num_functions):
+            lines.append('func F{}(x int) int {{'.format(m))
+            lines.append('\ta := x + {}'.format(m))
+            for k in range(1, 9):
+                if k == 5 and m == pull['function']:
+                    lines.append('\tv5 := a * 5 {} {}'.format('+' if fixed else '-', pull['number']))
+                else:
+                    lines.append('\tv{} := a * {}'.format(k, k))
+            lines.append('\treturn a')
+            lines.append('}')
+            lines.append('')
+        return '\n'.join(lines)
+
+    def path(self, pull):
+        if pull['is_go']:
+            return 'pkg/f{}.go'.format(pull['file'])
+        return 'docs/f{}.md'.format(pull['file'])
+
+    def shas(self, pull):
+        return _sha(self.repo, pull['number'], 'base'), _sha(self.repo, pull['number'], 'head')
+
+    def pull_json(self, pull, api, web):
+        base, head = self.shas(pull)
+        n = pull['number']
+        return {
+            'number': n,
+            'state': 'closed',
+            'title': 'fix crash in F{}'.format(pull['function']) if pull['is_defect'] else 'update F{}'.format(pull['function']),
+            'body': 'fixes #{}'.format(n) if pull['is_defect'] else 'refactoring',
+            'labels': [{'name': 'bug'}] if pull['is_defect'] else [],
+            'merged_at': pull['closed_at'],
+            'closed_at': pull['closed_at'],
+            'created_at': pull['created_at'],
+            'updated_at': pull['closed_at'],
+            'issue_url': '{}repos/{}/{}/issues/{}'.format(api, self.owner, self.repo, n),
+            'diff_url': '{}{}/{}/pull/{}.diff'.format(web, self.owner, self.repo, n),
+            'base': {'sha': base},
+            'head': {'sha': head},
+        }
+
+    def issue_json(self, n):
+        return {'number': n, 'title': 'crash {}'.format(n), 'body': 'it crashes', 'labels': [{'name': 'bug'}],
+                'state': 'closed'}
+
+    def diff(self, pull):
+        path = self.path(pull)
+        old = self.go_file(pull, False).split('\n')
+        new = self.go_file(pull, True).split('\n')
+        # the changed line is 6 lines into its function, so git names the function in the hunk header
+        changed = next(i for i, (a, b) in enumerate(zip(old, new)) if a != b)
+        start, end = changed - 3, changed + 4
+        section = old[changed - 6]
+        # real blob ids, the Writer checks the files it rebuilds from the diff against them
+        out = ['diff --git a/{0} b/{0}'.format(path),
+               'index {}..{} 100644'.format(git_blob_id('\n'.join(old).encode('UTF-8'))[:7],
+                                            git_blob_id('\n'.join(new).encode('UTF-8'))[:7]),
+               '--- a/' + path, '+++ b/' + path,
+               '@@ -{0},7 +{0},7 @@ {1}'.format(start + 1, section)]
+        for i in range(start, end):
+            if i == changed:
+                out.append('-' + old[i])
+                out.append('+' + new[i])
+            else:
+                out.append(' ' + old[i])
+        return '\n'.join(out) + '\n'
+
+    def raw_file(self, sha, path):
+        found = self._files.get((sha, path))
+        return self.go_file(*found) if found is not None else None
+
+
+class StandIn(object):
+    # a threaded http server answering the requests Crawler and Writer send to GitHub
+
+    def __init__(self, repos, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=5000,
+                 rate_limit_window=3600, seed=0):
+        self.repos = {(r.owner, r.repo): r for r in repos}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._remaining = rate_limit
+        self._reset = int(time.time()) + rate_limit_window
+        self.num_requests = {}
+        self.num_errors = 0
+        self.num_rate_limited = 0
+        self.bytes_sent = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body go out in one segment, a separate small write waits for a delayed ack
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stand_in._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        host, port = self._server.server_address
+        self.api_url = 'http://{}:{}/api/'.format(host, port)
+        self.web_url = 'http://{}:{}/web/'.format(host, port)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, kind, nbytes):
+        with self._lock:
+            self.num_requests[kind] = self.num_requests.get(kind, 0) + 1
+            self.bytes_sent += nbytes
+
+    def _take_quota(self):
+        # (limit headers, False when the quota is used up)
+        with self._lock:
+            now = time.time()
+            if now >= self._reset:
+                self._remaining = self.rate_limit
+                self._reset = int(now) + self.rate_limit_window
+            ok = self._remaining > 0
+            if ok:
+                self._remaining -= 1
+            else:
+                self.num_rate_limited += 1
+            headers = {'X-RateLimit-Limit': str(self.rate_limit), 'X-RateLimit-Remaining': str(self._remaining),
+                       'X-RateLimit-Reset': str(self._reset), 'X-RateLimit-Resource': 'core'}
+            return headers, ok
+
+    def _route(self, url):
+        # (kind, body, content type), body None for 404
+        parts = url.path.strip('/').split('/')
+        api = parts[0] == 'api'
+        parts = parts[1:]
+        if api and len(parts) >= 4 and parts[0] == 'repos':
+            r = self.repos.get((parts[1], parts[2]))
+            if r is None:
+                return 'api', None, None
+            if parts[3] == 'pulls' and len(parts) == 4:
+                q = parse_qs(url.query)
+                per_page = int(q.get('per_page', ['30'])[0])
+                page = int(q.get('page', ['1'])[0])
+                ordered = r.pulls[::-1] if q.get('direction') == ['desc'] else r.pulls
+                pulls = ordered[(page - 1) * per_page:page * per_page]
+                body = [r.pull_json(p, self.api_url, self.web_url) for p in pulls]
+                return 'pulls_page', json.dumps(body).encode('UTF-8'), 'application/json'
+            if parts[3] == 'issues' and len(parts) == 5:
+                return 'issue', json.dumps(r.issue_json(int(parts[4]))).encode('UTF-8'), 'application/json'
+            return 'api', None, None
+        if not api and len(parts) >= 4:
+            r = self.repos.get((parts[0], parts[1]))
+            if r is None:
+                return 'web', None, None
+            if parts[2] == 'pull' and parts[3].endswith('.diff'):
+                n = int(parts[3][:-len('.diff')])
+                if not 1 <= n <= len(r.pulls):
+                    return 'diff', None, None
+                pull = r.pulls[n - 1]
+                if not pull['is_go']:
+                    return 'diff', 'diff --git a/{0} b/{0}\n'.format(r.path(pull)).encode('UTF-8'), 'text/plain'
+                return 'diff', r.diff(pull).encode('UTF-8'), 'text/plain'
+            if parts[2] == 'raw' and len(parts) >= 5:
+                content = r.raw_file(parts[3], '/'.join(parts[4:]).replace('%2F', '/'))
+                return 'raw_file', content.encode('UTF-8') if content is not None else None, 'text/plain'
+        return 'web', None, None
+
+    def _handle(self, h):
+        delay = self.latency + self._rng.uniform(0, self.jitter) if self.latency or self.jitter else 0
+        if delay:
+            time.sleep(delay)
+        url = urlparse(h.path)
+        kind, body, content_type = self._route(url)
+        headers = {}
+        status = 200
+        if url.path.startswith('/api/'):
+            headers, ok = self._take_quota()
+            if not ok:
+                status, body, content_type = 403, b'{"message": "API rate limit exceeded"}', 'application/json'
+        if status == 200 and self._rng.random() < self.error_rate:
+            status, body, content_type = 502, b'Bad Gateway', 'text/plain'
+            self.num_errors += 1
+        elif status == 200 and body is None:
+            status, body, content_type = 404, b'{"message": "Not Found"}', 'application/json'
+        if status == 200:
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            headers['ETag'] = etag
+            headers['Last-Modified'] = formatdate(0, usegmt=True)
+            if h.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+        h.send_response(status)
+        for k, v in headers.items():
+            h.send_header(k, v)
+        h.send_header('Content-Type', content_type)
+        h.send_header('Content-Length', str(len(body)))
+        h.end_headers()
+        h.wfile.write(body)
+        self._count(kind, len(body))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux; worker processes of the parallel writer count as children
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024.0
+
+
+def run(num_pulls=500, per_page=100, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=5000,
+        rate_limit_window=3600, concurrency=16, processes=1, pipeline_depth=16, seed=0, work_dir=None):
+    # one crawl -> write -> split run, returns the report dict
+    from my_crawler import Crawler
+    from my_writer import Writer
+    from my_devider import Devider
+    from http_cache import HttpCache
+    from request_scheduler import RequestScheduler
+    from metrics import registry as metrics
+
+    repo = FakeRepo(num_pulls=num_pulls, seed=seed)
+    stand_in = StandIn([repo], latency=latency, jitter=jitter, error_rate=error_rate, rate_limit=rate_limit,
+                       rate_limit_window=rate_limit_window, seed=seed).start()
+    util.use_github_host(stand_in.api_url, stand_in.web_url)
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='ghpr-bench-')
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    stages = {}
+    metrics.reset()
+    try:
+        # short retry waits, a benchmark should measure the pipeline and not the backoff defaults
+        scheduler = RequestScheduler(['bench'], HttpCache('.http_cache'), request_retry_wait_secs=0.05,
+                                     max_backoff_secs=1, breaker_cooldown_secs=1, max_breaker_cooldown_secs=5)
+
+        t = time.time()
+        Crawler(dst_dir='repos', per_page=per_page, concurrency=concurrency, scheduler=scheduler).crawl_async(
+            repo.owner, repo.repo, resume=False)
+        stages['crawl'] = time.time() - t
+        crawl_requests = sum(stand_in.num_requests.values())
+
+        t = time.time()
+        writer = Writer(tokens=['bench'], dst_dir='repos', request_retry_wait_secs=0.05,
+                        scheduler=scheduler if processes == 1 else None, pipeline_depth=pipeline_depth)
+        writer.writer('repos', processes=processes)
+        stages['write'] = time.time() - t
+
+        t = time.time()
+        dataset_path = util.ghpr_path_template.format(owner=repo.owner, repo=repo.repo)
+        num_pairs = Devider(file_path=dataset_path).stream_devide()
+        stages['split'] = time.time() - t
+    finally:
+        os.chdir(cwd)
+        stand_in.stop()
+        util.use_github_host('https://api.github.com/', 'https://github.com/')
+
+    total = sum(stages.values())
+    num_requests = sum(stand_in.num_requests.values())
+    store = record_store.open_store('auto', os.path.join(work_dir, 'repos'), repo.owner, repo.repo, readonly=True)
+    num_written = len(store.keys('pull'))
+    store.close()
+    return {
+        'pulls': num_pulls,
+        'defect_go_pulls': num_written,
+        'function_pairs': sum(num_pairs),
+        'stage_secs': {k: round(v, 3) for k, v in stages.items()},
+        'total_secs': round(total, 3),
+        'pulls_per_sec': round(num_pulls / total, 1) if total else None,
+        'crawl_pulls_per_sec': round(num_pulls / stages['crawl'], 1) if stages['crawl'] else None,
+        'requests': num_requests,
+        'requests_by_kind': stand_in.num_requests,
+        'crawl_requests': crawl_requests,
+        'requests_per_sec': round(num_requests / total, 1) if total else None,
+        'bytes_downloaded': stand_in.bytes_sent,
+        'injected_errors': stand_in.num_errors,
+        'rate_limited': stand_in.num_rate_limited,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'work_dir': work_dir,
+        # what the pipeline itself counted, retries and sleeps included
+        'metrics': metrics.summary()['counters'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline crawl -> write -> split benchmark')
+    parser.add_argument('--pulls', type=int, default=500)
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of responses answered with 502')
+    parser.add_argument('--rate-limit', type=int, default=5000, help='api requests per window')
+    parser.add_argument('--rate-limit-window', type=int, default=3600, help='seconds until the quota resets')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--processes', type=int, default=1, help='Writer processes')
+    parser.add_argument('--pipeline-depth', type=int, default=16, help='Writer pipeline depth, 0 for a pull at a time')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help='kept after the run, a temporary directory by default')
+    parser.add_argument('--json', default=None, help='also write the report to this file')
+    args = parser.parse_args()
+    report = run(num_pulls=args.pulls, per_page=args.per_page, latency=args.latency, jitter=args.jitter,
+                 error_rate=args.error_rate, rate_limit=args.rate_limit, rate_limit_window=args.rate_limit_window,
+                 concurrency=args.concurrency, processes=args.processes,
+                 pipeline_depth=args.pipeline_depth, seed=args.seed, work_dir=args.work_dir)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if args.json is not None:
+        util.save_json(report, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import hashlib
+import mmap
+import os
+import re
+import threading
+from array import array
+
+
+newline_re = re.compile(b'\n')
+
+
+def git_blob_id(content):
+    # the id git gives the same content, so diff "index" lines can be looked up directly
+    h = hashlib.sha1()
+    h.update('blob {}\0'.format(len(content)).encode('ascii'))
+    h.update(content)
+    return h.hexdigest()
+
+
+class Blob(object):
+    # a stored blob mapped into memory, read in place instead of copied into strings. The
+    # byte offsets the lines start at are found once and kept in an array; lines are those of
+    # content.split(b'\n'), numbered from 0 like GoFunctionIndex spans
+
+    def __init__(self, data, blob_id=None):
+        self.data = data
+        self.blob_id = blob_id
+        self._view = memoryview(data)
+        self._starts = None
+
+    @classmethod
+    def map(cls, path, blob_id=None):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # an empty file cannot be mapped
+                return cls(b'', blob_id)
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), blob_id)
+
+    def _line_starts(self):
+        if self._starts is None:
+            starts = array('q', [0])
+            starts.extend(m.end() for m in newline_re.finditer(self.data))
+            self._starts = starts
+        return self._starts
+
+    def num_lines(self):
+        return len(self._line_starts())
+
+    def _line_range(self, i):
+        starts = self._line_starts()
+        return starts[i], starts[i + 1] - 1 if i + 1 < len(starts) else len(self.data)
+
+    def line(self, i):
+        # a memoryview of the line, without its newline
+        start, end = self._line_range(i)
+        return self._view[start:end]
+
+    def join_lines(self, start, end, skip=None):
+        # lines start to end, inclusive, decoded one at a time and joined without newlines;
+        # lines containing skip are left out
+        parts = []
+        for i in range(start, min(end + 1, self.num_lines())):
+            a, b = self._line_range(i)
+            if skip is not None and self.data.find(skip, a, b) != -1:
+                continue
+            parts.append(str(self._view[a:b], 'UTF-8', 'replace'))
+        return ''.join(parts)
+
+
+class BlobStore(object):
+    # raw file contents keyed by (commit sha, path) and stored once per distinct content.
+    # index.log holds one "<commit sha>\t<blob id>\t<path>" line per key
+
+    def __init__(self, root='.blob_store'):
+        self.root = root
+        self._index_path = os.path.join(root, 'index.log')
+        self._lock = threading.Lock()
+        self._index = {}
+        self._blob_ids = set()
+        # git abbreviates blob ids in diffs to at least 7 hex digits
+        self._by_prefix = {}
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_deduplicated = 0
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._load()
+        self._index_file = open(self._index_path, 'a', encoding='UTF-8')
+
+    def _load(self):
+        if not os.path.isfile(self._index_path):
+            return
+        with open(self._index_path, 'r', encoding='UTF-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 3:
+                    continue
+                sha, blob_id, path = parts
+                self._index[(sha, path)] = blob_id
+                self._add_blob_id(blob_id)
+
+    def _add_blob_id(self, blob_id):
+        if blob_id not in self._blob_ids:
+            self._blob_ids.add(blob_id)
+            self._by_prefix.setdefault(blob_id[:7], []).append(blob_id)
+
+    def _object_path(self, blob_id):
+        return os.path.join(self.root, 'objects', blob_id[:2], blob_id[2:])
+
+    def _read(self, blob_id):
+        with open(self._object_path(blob_id), 'rb') as f:
+            return f.read()
+
+    def lookup(self, sha, path):
+        return self._index.get((sha, path))
+
+    def find(self, blob_id_prefix):
+        # full blob id for an abbreviated one from a diff, None when unknown or ambiguous
+        if len(blob_id_prefix) < 7:
+            return None
+        matches = [b for b in self._by_prefix.get(blob_id_prefix[:7], ()) if b.startswith(blob_id_prefix)]
+        return matches[0] if len(matches) == 1 else None
+
+    def put(self, sha, path, content):
+        blob_id = git_blob_id(content)
+        object_path = self._object_path(blob_id)
+        with self._lock:
+            if blob_id in self._blob_ids:
+                self.num_deduplicated += 1
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                tmp = '{}.{}.{}.tmp'.format(object_path, os.getpid(), threading.get_ident())
+                with open(tmp, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp, object_path)
+                self._add_blob_id(blob_id)
+            if self._index.get((sha, path)) != blob_id:
+                self._index[(sha, path)] = blob_id
+                self._index_file.write('{}\t{}\t{}\n'.format(sha, blob_id, path))
+                self._index_file.flush()
+        return blob_id
+
+    def _known(self, sha, path, blob_id):
+        known = self._index.get((sha, path))
+        if known is None and blob_id is not None:
+            known = self.find(blob_id)
+        return known
+
+    def get(self, sha, path, fetch, blob_id=None):
+        # fetch() is called on a miss and returns the content, or None for content that
+        # should not be stored (a failed download)
+        known = self._known(sha, path, blob_id)
+        if known is not None:
+            try:
+                content = self._read(known)
+                self.num_hits += 1
+                if (sha, path) not in self._index:
+                    self.put(sha, path, content)
+                return content
+            except OSError:
+                pass
+        self.num_misses += 1
+        content = fetch()
+        if content is not None:
+            self.put(sha, path, content)
+        return content
+
+    def open(self, sha, path, fetch, blob_id=None):
+        # like get, the content as a Blob mapped from its object file; a fetched content is
+        # stored first and only mapped after that, so no copy of it is kept
+        known = self._known(sha, path, blob_id)
+        if known is not None:
+            try:
+                blob = Blob.map(self._object_path(known), known)
+                self.num_hits += 1
+                if (sha, path) not in self._index:
+                    self.put(sha, path, blob.data)
+                return blob
+            except OSError:
+                pass
+        self.num_misses += 1
+        content = fetch()
+        if content is None:
+            return None
+        known = self.put(sha, path, content)
+        del content
+        return Blob.map(self._object_path(known), known)
+
+    def hit_rate(self):
+        total = self.num_hits + self.num_misses
+        return self.num_hits / total if total else 0.0
+
+    def summary(self):
+        return 'hits {:,} misses {:,} hit rate {:.1%} deduplicated {:,} blobs {:,}'.format(
+            self.num_hits, self.num_misses, self.hit_rate(), self.num_deduplicated, len(self._blob_ids))
+
+    def close(self):
+        self._index_file.close()
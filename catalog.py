@@ -0,0 +1,237 @@
+import os
+import sqlite3
+import threading
+import util
+
+
+# SQLite catalog of the crawled pulls and what the Writer made of them, kept up to date by
+# the crawler and the Writer so runs are planned and questions are answered with queries
+# instead of directory scans and JSON reads:
+#   python catalog.py --dst-dir repos rebuild
+#   python catalog.py query --label bug --merged-from 2021-01-01 --merged-to 2022-01-01
+# A catalog belongs to one crawl directory and lives next to it. WAL mode lets readers
+# query while a crawl writes. Writes are batched, put() and record_extraction() commit
+# every batch_size rows and on flush().
+
+schema = '''
+CREATE TABLE IF NOT EXISTS pulls (
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    title TEXT,
+    merged_at TEXT,
+    base_sha TEXT,
+    head_sha TEXT,
+    -- comma separated, as the crawler found them in the pull's body or closing references
+    linked_issues TEXT,
+    num_go_files INTEGER,
+    -- 'crawled' until the Writer wrote the pull from these shas, then 'written'
+    status TEXT NOT NULL DEFAULT 'crawled',
+    num_functions INTEGER,
+    extractor_version INTEGER,
+    PRIMARY KEY (owner, repo, number)
+);
+CREATE INDEX IF NOT EXISTS pulls_merged_at ON pulls (merged_at);
+CREATE INDEX IF NOT EXISTS pulls_status ON pulls (status);
+CREATE TABLE IF NOT EXISTS pull_labels (
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    PRIMARY KEY (owner, repo, number, label)
+);
+CREATE INDEX IF NOT EXISTS pull_labels_label ON pull_labels (label);
+'''
+
+# a pull crawled again from other shas has to be written again
+_upsert_pull = '''
+INSERT INTO pulls (owner, repo, number, title, merged_at, base_sha, head_sha, linked_issues, num_go_files)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (owner, repo, number) DO UPDATE SET
+    title = excluded.title,
+    merged_at = excluded.merged_at,
+    linked_issues = excluded.linked_issues,
+    num_go_files = excluded.num_go_files,
+    status = CASE WHEN pulls.base_sha IS excluded.base_sha AND pulls.head_sha IS excluded.head_sha
+             THEN pulls.status ELSE 'crawled' END,
+    base_sha = excluded.base_sha,
+    head_sha = excluded.head_sha
+'''
+
+
+def catalog_path(dst_dir):
+    return util.catalog_path_template.format(dst_dir=os.path.normpath(dst_dir))
+
+
+def _linked_issues(p):
+    linked = p.get('linked_issue_numbers')
+    if linked is None or linked == '':
+        return None
+    if isinstance(linked, (list, tuple)):
+        return ','.join(str(n) for n in linked)
+    return str(linked)
+
+
+class Catalog(object):
+
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        # the crawler records pulls from several threads, one connection serves them all
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(schema)
+        self._pending = 0
+
+    def _written(self, n=1):
+        # called under the lock, inside the open transaction
+        self._pending += n
+        if self._pending >= self.batch_size:
+            self._db.commit()
+            self._pending = 0
+
+    def put(self, owner, repo, p):
+        # a pull as the crawler stores it
+        labels = [l['name'] for l in p.get('labels') or ()]
+        with self._lock:
+            self._db.execute(_upsert_pull, (owner, repo, p['number'], p.get('title'), p.get('merged_at'),
+                                            p['base']['sha'], p['head']['sha'], _linked_issues(p),
+                                            p.get('num_modi_go')))
+            self._db.execute('DELETE FROM pull_labels WHERE owner = ? AND repo = ? AND number = ?',
+                             (owner, repo, p['number']))
+            self._db.executemany('INSERT OR IGNORE INTO pull_labels VALUES (?, ?, ?, ?)',
+                                 [(owner, repo, p['number'], label) for label in labels])
+            self._written()
+
+    def record_extraction(self, owner, repo, number, num_functions, extractor_version):
+        with self._lock:
+            self._db.execute('UPDATE pulls SET status = ?, num_functions = ?, extractor_version = ? '
+                             'WHERE owner = ? AND repo = ? AND number = ?',
+                             ('written', num_functions, extractor_version, owner, repo, number))
+            self._written()
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def forget_repo(self, owner, repo):
+        # e.g. once a crawl starts the repo over
+        with self._lock:
+            for table in ('pulls', 'pull_labels'):
+                self._db.execute('DELETE FROM {} WHERE owner = ? AND repo = ?'.format(table), (owner, repo))
+            self._db.commit()
+            self._pending = 0
+
+    def sync_repo(self, owner, repo, store):
+        # adds the pulls of a repo's store the catalog does not have, e.g. those of a crawl
+        # that stopped before its last batch was committed; returns how many
+        with self._lock:
+            known = {n for n, in self._db.execute('SELECT number FROM pulls WHERE owner = ? AND repo = ?',
+                                                  (owner, repo))}
+        missing = [n for n in store.keys('pull') if n not in known]
+        for n in missing:
+            self.put(owner, repo, store.get('pull', n))
+        self.flush()
+        return len(missing)
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def repos(self):
+        # [(owner, repo)] in the order sorted_owner_repo_pairs gives
+        return [tuple(r) for r in self._query('SELECT DISTINCT owner, repo FROM pulls ORDER BY owner, repo')]
+
+    def pull_numbers(self, owner, repo):
+        return [n for n, in self._query('SELECT number FROM pulls WHERE owner = ? AND repo = ? ORDER BY number',
+                                        (owner, repo))]
+
+    def pull_shas(self, owner, repo):
+        # {number: (base sha, head sha)} in pull number order
+        rows = self._query('SELECT number, base_sha, head_sha FROM pulls WHERE owner = ? AND repo = ? ORDER BY number',
+                           (owner, repo))
+        return {n: (base, head) for n, base, head in rows}
+
+    def written_repos(self):
+        # repos with at least one function pair written
+        return [tuple(r) for r in self._query(
+            "SELECT DISTINCT owner, repo FROM pulls WHERE status = 'written' AND num_functions > 0 "
+            "ORDER BY owner, repo")]
+
+    def query_pulls(self, owner=None, repo=None, label=None, merged_from=None, merged_to=None, status=None):
+        # rows of pulls as dicts, merged_from inclusive and merged_to exclusive ISO dates;
+        # only merged pulls once either is given
+        where, args = [], []
+        for column, value in (('p.owner', owner), ('p.repo', repo), ('p.status', status)):
+            if value is not None:
+                where.append('{} = ?'.format(column))
+                args.append(value)
+        if label is not None:
+            where.append('EXISTS (SELECT 1 FROM pull_labels l WHERE l.owner = p.owner AND l.repo = p.repo '
+                         'AND l.number = p.number AND l.label = ?)')
+            args.append(label)
+        if merged_from is not None:
+            where.append('p.merged_at >= ?')
+            args.append(merged_from)
+        if merged_to is not None:
+            where.append('p.merged_at < ?')
+            args.append(merged_to)
+        sql = 'SELECT p.* FROM pulls p'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY p.owner, p.repo, p.number'
+        with self._lock:
+            cursor = self._db.execute(sql, args)
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def rebuild(catalog, dst_dir):
+    # indexes every crawled repo under dst_dir, whatever its storage
+    import record_store
+    for owner, repo in util.sorted_owner_repo_pairs(dst_dir):
+        store = record_store.open_store('auto', dst_dir, owner, repo, readonly=True)
+        try:
+            print('{}/{}: {:,} pulls added'.format(owner, repo, catalog.sync_repo(owner, repo, store)))
+        finally:
+            store.close()
+
+
+def main():
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='the SQLite catalog of crawled pulls')
+    parser.add_argument('--dst-dir', default='repos', help='the crawl directory')
+    parser.add_argument('--catalog', default=None, help="the crawl directory's one by default")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help='add the pulls of the crawl directory')
+    p = commands.add_parser('query', help='print the matching pulls as JSON lines')
+    p.add_argument('--owner')
+    p.add_argument('--repo')
+    p.add_argument('--label')
+    p.add_argument('--merged-from')
+    p.add_argument('--merged-to')
+    p.add_argument('--status', choices=('crawled', 'written'))
+    args = parser.parse_args()
+    catalog = Catalog(args.catalog or catalog_path(args.dst_dir))
+    try:
+        if args.command == 'rebuild':
+            rebuild(catalog, args.dst_dir)
+        else:
+            for row in catalog.query_pulls(args.owner, args.repo, args.label, args.merged_from, args.merged_to,
+                                           args.status):
+                print(json.dumps(row))
+    finally:
+        catalog.close()
+
+
+if __name__ == '__main__':
+    main()
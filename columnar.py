@@ -0,0 +1,135 @@
+import os
+
+
+# One row per side of a function pair, the same fields as a <CODESPLIT> line plus where it
+# came from. The fields hold the same strings as in the text format, code lines joined
+# without newlines, but nothing has to be parsed back out of text.
+columns = ['label', 'url', 'function_name', 'title', 'code',
+           'owner', 'repo', 'pull_number', 'base_sha', 'head_sha']
+formats = ('parquet', 'arrow')
+
+
+def _pyarrow():
+    # pyarrow is only needed for columnar output, the text format works without it
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('columnar dataset output needs pyarrow (pip install pyarrow)')
+    return pyarrow
+
+
+def schema():
+    pa = _pyarrow()
+    return pa.schema([
+        ('label', pa.int8()),
+        ('url', pa.string()),
+        ('function_name', pa.string()),
+        ('title', pa.string()),
+        ('code', pa.string()),
+        ('owner', pa.string()),
+        ('repo', pa.string()),
+        ('pull_number', pa.int64()),
+        ('base_sha', pa.string()),
+        ('head_sha', pa.string()),
+    ])
+
+
+def format_of(path):
+    ext = os.path.splitext(path)[1].lstrip('.')
+    if ext not in formats:
+        raise ValueError('unknown columnar format {}'.format(path))
+    return ext
+
+
+class ColumnarWriter(object):
+    # Buffers rows and writes them a row group (parquet) or record batch (arrow IPC file)
+    # at a time, so memory is bounded by row_group_size and readers can stream groups.
+
+    def __init__(self, path, row_group_size=4096):
+        self._pa = _pyarrow()
+        self.path = path
+        self.format = format_of(path)
+        self.row_group_size = row_group_size
+        self.num_rows = 0
+        self._schema = schema()
+        self._buffer = {name: [] for name in columns}
+        if self.format == 'parquet':
+            self._writer = self._pa.parquet.ParquetWriter(path, self._schema, compression='zstd')
+        else:
+            self._sink = self._pa.OSFile(path, 'wb')
+            self._writer = self._pa.ipc.new_file(self._sink, self._schema)
+
+    def write_row(self, **row):
+        for name in columns:
+            self._buffer[name].append(row[name])
+        if len(self._buffer['label']) >= self.row_group_size:
+            self._flush()
+
+    def write_table(self, table):
+        self._flush()
+        for batch in table.to_batches(max_chunksize=self.row_group_size):
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        if self.format == 'parquet':
+            self._writer.write_batch(batch, row_group_size=self.row_group_size)
+        else:
+            self._writer.write_batch(batch)
+        self.num_rows += batch.num_rows
+
+    def _flush(self):
+        if not self._buffer['label']:
+            return
+        self._write_batch(self._pa.RecordBatch.from_pydict(self._buffer, schema=self._schema))
+        self._buffer = {name: [] for name in columns}
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        if self.format == 'arrow':
+            self._sink.close()
+
+
+def read_dataset(path, columns=None):
+    # A pyarrow Table with only the given columns. Both formats are memory-mapped; an arrow
+    # IPC file is not even copied, its columns point into the mapping.
+    pa = _pyarrow()
+    if format_of(path) == 'parquet':
+        return pa.parquet.read_table(path, columns=columns, memory_map=True)
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.select(columns) if columns is not None else table
+
+
+def iter_batches(path, columns=None, batch_size=4096):
+    # record batches one at a time, for datasets larger than memory
+    pa = _pyarrow()
+    if format_of(path) == 'parquet':
+        f = pa.parquet.ParquetFile(path, memory_map=True)
+        for batch in f.iter_batches(batch_size=batch_size, columns=columns):
+            yield batch
+        return
+    reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        yield batch.select(columns) if columns is not None else batch
+
+
+def concat(paths, out_path, row_group_size=4096, keep_pair=None):
+    # the parallel Writer's shards, in order, into one dataset file; keep_pair(defective row,
+    # clean row) can leave pairs out, rows come in pairs, defective first
+    out = ColumnarWriter(out_path, row_group_size)
+    try:
+        for path in paths:
+            if keep_pair is None:
+                out.write_table(read_dataset(path))
+                continue
+            rows = read_dataset(path).to_pylist()
+            for i in range(0, len(rows) - 1, 2):
+                if keep_pair(rows[i], rows[i + 1]):
+                    out.write_row(**rows[i])
+                    out.write_row(**rows[i + 1])
+    finally:
+        out.close()
+    return out.num_rows
@@ -0,0 +1,95 @@
+import os
+import time
+
+
+def utc_now_iso():
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+class CrawlJournal(object):
+    # append-only log of one repo's crawl progress, one event per line:
+    #   start <iso>         a crawl run started
+    #   pull <number>       a pull was fully processed
+    #   page <page> <full> [cursor]
+    #                       a pulls page was finished (full=1 when it had per_page pulls),
+    #                       the GraphQL backend also keeps the end cursor of the page
+    #   finish <iso>        the run started at <iso> went through all pages
+
+    def __init__(self, path):
+        self.path = path
+        self.last_page = 0
+        self.last_page_full = True
+        self.pulls = set()
+        self.cursors = {}
+        self.last_finished_run = None
+        # set for an incremental run, only pulls closed at or after it are crawled
+        self.since = None
+        self.run_started = None
+        self._load()
+        self._f = open(path, 'a')
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                # a crash can leave the last line cut off
+                if len(parts) < 2:
+                    continue
+                try:
+                    if parts[0] == 'pull':
+                        self.pulls.add(int(parts[1]))
+                    elif parts[0] == 'page' and len(parts) >= 3:
+                        self.last_page = int(parts[1])
+                        self.last_page_full = parts[2] == '1'
+                        if len(parts) == 4:
+                            self.cursors[self.last_page] = parts[3]
+                    elif parts[0] == 'finish':
+                        self.last_finished_run = parts[1]
+                except ValueError:
+                    continue
+
+    def _append(self, line):
+        self._f.write(line + '\n')
+        self._f.flush()
+
+    def next_page(self):
+        # a partial last page can still gain pulls, so it is visited again
+        if self.last_page == 0:
+            return 1
+        return self.last_page + 1 if self.last_page_full else self.last_page
+
+    def is_pending(self, p):
+        if p['number'] in self.pulls:
+            return False
+        if self.since is not None and (p.get('closed_at') or '') < self.since:
+            return False
+        return True
+
+    def record_start(self):
+        self.run_started = utc_now_iso()
+        self._append('start ' + self.run_started)
+
+    def record_pull(self, pull_number):
+        self.pulls.add(pull_number)
+        self._append('pull {}'.format(pull_number))
+
+    def record_page(self, page, full):
+        # incremental runs page through a different ordering, so their pages are not resumable
+        if self.since is not None:
+            return
+        self.last_page = page
+        self.last_page_full = full
+        cursor = self.cursors.get(page)
+        if cursor is None:
+            self._append('page {} {}'.format(page, 1 if full else 0))
+        else:
+            self._append('page {} {} {}'.format(page, 1 if full else 0, cursor))
+
+    def record_finish(self):
+        self.last_finished_run = self.run_started
+        self._append('finish ' + self.run_started)
+
+    def close(self):
+        self._f.close()
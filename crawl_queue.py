@@ -0,0 +1,255 @@
+import heapq
+import itertools
+import logging
+import math
+import threading
+import traceback
+import util
+from metrics import registry as metrics
+
+
+# Crawls many repositories at once over one shared, prioritized task queue:
+#   python crawl_queue.py repos.txt --workers 32 --budget 40000
+# repos.txt holds one owner/repo per line, # starts a comment. A repo's work is split into
+# page tasks (fetch a pulls page, queue its defect pulls and the next page) and pull tasks
+# (fetch a pull's diff and issues). All tasks share the Crawler's scheduler, so one token
+# pool and one request budget serve every repo. Pages are recorded in order per repo, with
+# the same journal, store and counters as Crawler.crawl.
+
+PULL_TASK = 0
+PAGE_TASK = 1
+
+
+class _RepoState(object):
+
+    def __init__(self, owner, repo, journal, counts, remaining_pages):
+        self.owner = owner
+        self.repo = repo
+        self.journal = journal
+        self.counts = counts
+        self.lock = threading.Lock()
+        # estimated pages still to fetch, repos with more go first so the largest is not the tail
+        self.remaining_pages = remaining_pages
+        # page -> {'pulls', 'defect_pulls', 'fetched', 'pending'} until it is recorded
+        self.pages = {}
+        self.next_to_finish = None
+        self.status = 'running'
+
+
+class _Task(object):
+
+    def __init__(self, kind, state, page, index=None, pull=None):
+        self.kind = kind
+        self.state = state
+        self.page = page
+        self.index = index
+        self.pull = pull
+        self.attempts = 0
+
+
+class MultiRepoCrawler(object):
+
+    def __init__(self, crawler, workers=16, budget=None, max_task_retries=3, task_retry_wait_secs=30):
+        self.crawler = crawler
+        self.workers = workers
+        # requests this run may send over all repos, None for no limit
+        self.budget = budget
+        self.max_task_retries = max_task_retries
+        self.task_retry_wait_secs = task_retry_wait_secs
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        # queued, running or waiting for a retry
+        self._outstanding = 0
+        self._stopping = False
+        self._retry_timers = []
+
+    def _estimate_remaining_pages(self, owner, repo, page, journal):
+        # pull numbers are shared with issues, so the newest one overestimates the pulls,
+        # it only has to rank repos against each other
+        if journal.since is not None:
+            return 1
+        try:
+            latest = self.crawler._get(util.latest_pull_url_template.format(owner=owner, repo=repo))
+        except Exception as e:
+            logging.error('Queue: no size estimate for {}/{}: {}'.format(owner, repo, e))
+            return 1
+        if not latest:
+            return 1
+        return max(1, math.ceil(latest[0]['number'] / self.crawler.per_page) - page + 1)
+
+    def _put(self, task, new=True):
+        with self._cond:
+            if new:
+                self._outstanding += 1
+            priority = (task.kind, -task.state.remaining_pages, next(self._seq))
+            heapq.heappush(self._heap, (priority, task))
+            self._cond.notify()
+
+    def _done(self):
+        with self._cond:
+            self._outstanding -= 1
+            self._cond.notify_all()
+
+    def _budget_spent(self):
+        return self.budget is not None and self.crawler._scheduler.num_sent >= self.budget
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap and self._outstanding > 0 and not self._stopping:
+                    self._cond.wait()
+                if self._stopping or self._outstanding == 0:
+                    return
+                _, task = heapq.heappop(self._heap)
+            if self.crawler._interrupted or self._budget_spent():
+                with self._cond:
+                    if not self._stopping:
+                        print('Request budget spent or interrupted, stopping; the journals resume the rest')
+                    self._stopping = True
+                    self._cond.notify_all()
+                self._done()
+                return
+            self._run(task)
+
+    def _run(self, task):
+        state = task.state
+        if state.status != 'running':
+            self._done()
+            return
+        try:
+            if task.kind == PAGE_TASK:
+                self._run_page(task)
+            else:
+                self._run_pull(task)
+        except Exception as e:
+            task.attempts += 1
+            logging.error('Queue: task failed ({}) {}/{} page {}: {}'.format(
+                task.attempts, state.owner, state.repo, task.page, e))
+            logging.error(traceback.format_exc())
+            metrics.inc('ghpr_task_failures_total')
+            if task.attempts <= self.max_task_retries:
+                # back on the queue after a while, it still counts as outstanding meanwhile
+                timer = threading.Timer(self.task_retry_wait_secs * task.attempts, self._put, (task, False))
+                timer.daemon = True
+                self._retry_timers.append(timer)
+                timer.start()
+                return
+            print('Giving up on {}/{} after {} failures: {}'.format(state.owner, state.repo, task.attempts, e))
+            with state.lock:
+                self._close_repo(state, 'failed')
+        self._done()
+
+    def _run_page(self, task):
+        state = task.state
+        pulls = self.crawler._fetch_pulls_page(state.owner, state.repo, task.page, state.journal)
+        with state.lock:
+            if state.status != 'running':
+                return
+            self.crawler._save_pulls_page(state.owner, state.repo, task.page, pulls, state.journal)
+            defect_pulls = self.crawler._pending_defect_pulls(pulls, state.counts, state.journal)
+            state.pages[task.page] = {'pulls': pulls, 'defect_pulls': defect_pulls,
+                                      'fetched': [None] * len(defect_pulls), 'pending': len(defect_pulls)}
+            state.remaining_pages = max(1, state.remaining_pages - 1)
+            if not self.crawler._is_last_page(pulls, state.journal):
+                self._put(_Task(PAGE_TASK, state, task.page + 1))
+            for i, p in enumerate(defect_pulls):
+                self._put(_Task(PULL_TASK, state, task.page, i, p))
+            self._finish_ready_pages(state)
+
+    def _run_pull(self, task):
+        state = task.state
+        fetched = self.crawler._fetch_pull(state.owner, state.repo, task.pull)
+        with state.lock:
+            if state.status != 'running':
+                return
+            entry = state.pages[task.page]
+            entry['fetched'][task.index] = fetched
+            entry['pending'] -= 1
+            self._finish_ready_pages(state)
+
+    def _finish_ready_pages(self, state):
+        # record pages in order once all their pulls are fetched, like the serial crawl
+        while True:
+            entry = state.pages.get(state.next_to_finish)
+            if entry is None or entry['pending'] > 0:
+                return
+            page = state.next_to_finish
+            for p, fetched in zip(entry['defect_pulls'], entry['fetched']):
+                self.crawler._record_pull(state.owner, state.repo, p, fetched, state.counts, state.journal)
+            del state.pages[page]
+            state.next_to_finish += 1
+            if self.crawler._finish_page(state.owner, state.repo, page, entry['pulls'], state.counts, state.journal):
+                # _finish_page closed the journal of the finished repo
+                state.status = 'finished'
+                self.crawler._close_store(state.owner, state.repo)
+                return
+
+    def _close_repo(self, state, status):
+        if state.status == 'running':
+            state.status = status
+            state.journal.close()
+            self.crawler._close_store(state.owner, state.repo)
+
+    def run(self, repos, start_page=None, resume=True, incremental=False):
+        # repos: ['owner/repo', ...]; returns {'owner/repo': 'finished' | 'failed' | 'stopped'},
+        # stopped ones ran out of budget or were interrupted and continue on the next run
+        states = []
+        with metrics.stage('crawl'):
+            for r in repos:
+                owner, repo = r.split('/', 1)
+                try:
+                    journal, counts, page = self.crawler._start_crawl(owner, repo, start_page, resume, incremental)
+                except Exception as e:
+                    logging.error('Queue: cannot start {}: {}'.format(r, e))
+                    continue
+                state = _RepoState(owner, repo, journal, counts,
+                                   self._estimate_remaining_pages(owner, repo, page, journal))
+                state.next_to_finish = page
+                states.append(state)
+                self._put(_Task(PAGE_TASK, state, page))
+
+            threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            for timer in self._retry_timers:
+                timer.cancel()
+            for state in states:
+                with state.lock:
+                    # stopped early, the journal keeps what was done
+                    self._close_repo(state, 'stopped')
+        return {'{}/{}'.format(s.owner, s.repo): s.status for s in states}
+
+
+def read_repo_list(path):
+    repos = []
+    with open(path, 'r', encoding='UTF-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                repos.append(line)
+    return repos
+
+
+def main():
+    import argparse
+    from my_crawler import Crawler
+    parser = argparse.ArgumentParser(description='crawl a list of repositories over one shared task queue')
+    parser.add_argument('repos_file')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--budget', type=int, default=None, help='requests to send at most in this run')
+    parser.add_argument('--retries', type=int, default=3, help='retries of a failed page or pull task')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--backend', default='rest', choices=('rest', 'graphql'))
+    args = parser.parse_args()
+    crawler = Crawler(concurrency=args.workers, backend=args.backend)
+    queue = MultiRepoCrawler(crawler, workers=args.workers, budget=args.budget, max_task_retries=args.retries)
+    for repo, status in sorted(queue.run(read_repo_list(args.repos_file), incremental=args.incremental).items()):
+        print('{}: {}'.format(repo, status))
+    metrics.save('./metrics-crawl')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import json
+import re
+import zlib
+
+
+# Near-duplicate function pairs (reverted fixes, cherry-picks to release branches, the same
+# small change made twice) are found with MinHash signatures over token shingles and an LSH
+# index over bands of the signatures. The first pair seen is kept, later pairs whose
+# estimated Jaccard similarity to a kept pair reaches the threshold are dropped.
+
+token_re = re.compile(r'\w+|[^\w\s]')
+
+
+def _numpy():
+    # imported once a deduplicator is made, the Writer imports this module either way
+    import numpy
+    return numpy
+
+
+def shingles(code, size=5, side=''):
+    # hashes of every `size` consecutive tokens, so whitespace and layout do not count;
+    # side tells the defective and the clean code of a pair apart
+    tokens = token_re.findall(code)
+    if len(tokens) < size:
+        grams = [' '.join(tokens)]
+    else:
+        grams = [' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+    return {zlib.crc32((side + g).encode('UTF-8')) for g in grams}
+
+
+def _bands(threshold, num_perm):
+    # b bands of r rows, with (1/b)^(1/r), where the candidate probability curve is
+    # steepest, as close to the threshold as possible
+    best = None
+    for r in range(1, num_perm + 1):
+        b = num_perm // r
+        error = abs((1.0 / b) ** (1.0 / r) - threshold)
+        if best is None or error < best[0]:
+            best = (error, b, r)
+    return best[1], best[2]
+
+
+class PairDeduplicator(object):
+
+    def __init__(self, threshold=0.85, num_perm=128, shingle_size=5, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._np = np = _numpy()
+        self._mersenne_prime = np.uint64((1 << 61) - 1)
+        self._max_hash = np.uint64((1 << 32) - 1)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.num_bands, self.band_rows = _bands(threshold, num_perm)
+        self._buckets = [{} for _ in range(self.num_bands)]
+        # signatures of the kept pairs, by key
+        self._signatures = {}
+        self.num_seen = 0
+        # (dropped key, kept key, estimated similarity)
+        self.dropped = []
+        # dropped pairs already in a report
+        self._num_reported = 0
+
+    def signature(self, defective_code, clean_code):
+        np = self._np
+        hashes = shingles(defective_code, self.shingle_size, 'd') | shingles(clean_code, self.shingle_size, 'c')
+        h = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        # one universal hash per permutation, the minimum over all shingles
+        with np.errstate(over='ignore'):
+            values = ((np.outer(h, self._a) + self._b) % self._mersenne_prime) & self._max_hash
+        return values.min(axis=0)
+
+    def _band_keys(self, sig):
+        r = self.band_rows
+        return [sig[i * r:(i + 1) * r].tobytes() for i in range(self.num_bands)]
+
+    def duplicate_of(self, key, defective_code, clean_code):
+        # the key of a kept near-duplicate, or None after keeping this pair
+        self.num_seen += 1
+        sig = self.signature(defective_code, clean_code)
+        band_keys = self._band_keys(sig)
+        checked = set()
+        for bucket, band_key in zip(self._buckets, band_keys):
+            for candidate in bucket.get(band_key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                similarity = float(self._np.mean(self._signatures[candidate] == sig))
+                if similarity >= self.threshold:
+                    self.dropped.append((key, candidate, similarity))
+                    return candidate
+        self._add(key, sig, band_keys)
+        return None
+
+    def _add(self, key, sig, band_keys):
+        self._signatures[key] = sig
+        for bucket, band_key in zip(self._buckets, band_keys):
+            bucket.setdefault(band_key, []).append(key)
+
+    def remember(self, key, defective_code, clean_code):
+        # a pair kept by an earlier run, later pairs are compared with it
+        sig = self.signature(defective_code, clean_code)
+        self._add(key, sig, self._band_keys(sig))
+
+    def summary(self):
+        return 'pairs {:,} kept {:,} dropped {:,} (threshold {}, {} bands of {})'.format(
+            self.num_seen, len(self._signatures), len(self.dropped), self.threshold,
+            self.num_bands, self.band_rows)
+
+    def write_report(self, path):
+        # one JSON object per dropped pair, appended to the report of earlier runs; a pair is
+        # reported once
+        with open(path, 'a', encoding='UTF-8') as f:
+            for dropped, kept, similarity in self.dropped[self._num_reported:]:
+                f.write(json.dumps({'dropped': dropped, 'kept': kept, 'similarity': round(similarity, 4)}))
+                f.write('\n')
+        self._num_reported = len(self.dropped)
+
+
+def pair_key(url, function_name):
+    # the defective side's raw file url names the repo, the base sha and the file. Neither
+    # field of a dataset row holds a <CODESPLIT>, so two keys are equal only for equal fields
+    return '{}<CODESPLIT>{}'.format(url, function_name)
+
+
+def iter_pairs(lines):
+    # (defective line, clean line, defective fields, clean fields) of <CODESPLIT> lines,
+    # fields are None for lines that do not split into five
+    lines = iter(lines)
+    for defective in lines:
+        clean = next(lines, '')
+        d = defective.rstrip('\n').split('<CODESPLIT>')
+        c = clean.rstrip('\n').split('<CODESPLIT>')
+        if len(d) < 5 or len(c) < 5:
+            yield defective, clean, None, None
+        else:
+            yield defective, clean, d, c
+
+
+def filter_pairs(lines, deduplicator):
+    # the lines of the pairs that are not near-duplicates of an earlier pair
+    for defective, clean, d, c in iter_pairs(lines):
+        if d is not None and deduplicator.duplicate_of(pair_key(d[1], d[2]), d[-1], c[-1]) is not None:
+            continue
+        yield defective
+        yield clean
+
+
+def remember_file(path, deduplicator):
+    # the pairs of an existing dataset, e.g. before appending to it
+    with open(path, 'r', newline='\n', encoding='UTF-8') as f:
+        for _, _, d, c in iter_pairs(f):
+            if d is not None:
+                deduplicator.remember(pair_key(d[1], d[2]), d[-1], c[-1])
+
+
+def dedup_file(src_path, dst_path, deduplicator):
+    # copies a _GHPR.txt file without the near-duplicate pairs, reading it one pair at a time;
+    # returns (pairs kept, pairs dropped). Lines end at \n only, code can hold a \r
+    num_dropped = len(deduplicator.dropped)
+    kept = 0
+    with open(src_path, 'r', newline='\n', encoding='UTF-8') as src, \
+            open(dst_path, 'w', newline='', encoding='UTF-8') as dst:
+        for line in filter_pairs(src, deduplicator):
+            dst.write(line)
+            kept += 1
+    return kept // 2, len(deduplicator.dropped) - num_dropped
+
+
+def main():
+    import argparse
+    import os
+    parser = argparse.ArgumentParser(description='drop near-duplicate function pairs from _GHPR.txt files')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--threshold', type=float, default=0.85)
+    parser.add_argument('--num-perm', type=int, default=128)
+    parser.add_argument('--report', default='./result/dedup-report.jsonl')
+    args = parser.parse_args()
+    # one deduplicator over all files, a pair is also dropped when it repeats one of another repo
+    deduplicator = PairDeduplicator(args.threshold, args.num_perm)
+    for path in args.paths:
+        tmp = path + '.dedup'
+        print(path, dedup_file(path, tmp, deduplicator))
+        os.replace(tmp, path)
+    deduplicator.write_report(args.report)
+    print(deduplicator.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import re
+import util
+
+
+# compiled once, the scanners used to build them for every line
+file_header_re = re.compile(util.modify_file_template)
+index_re = re.compile(r'^index ([0-9a-f]+)\.\.([0-9a-f]+)')
+hunk_re = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)')
+function_re = re.compile(util.get_function_name_template)
+
+
+def is_go_path(path):
+    return (path.split('/')[-1]).split('.')[-1] == 'go'
+
+
+class DiffFile(object):
+
+    def __init__(self, path, new_path=None):
+        self.path = path
+        # the path after the change, another one for a renamed file
+        self.new_path = new_path if new_path is not None else path
+        # abbreviated git blob ids from the "index" line, None for binary or mode-only changes
+        self.old_blob = None
+        self.new_blob = None
+
+    @property
+    def is_go(self):
+        return is_go_path(self.path)
+
+    def changed_in_place(self):
+        # the file exists before and after the change, under the same path
+        return self.new_path == self.path and self.old_blob is not None and self.new_blob is not None \
+            and self.old_blob.strip('0') != '' and self.new_blob.strip('0') != ''
+
+
+class DiffHunk(object):
+
+    def __init__(self, file, old_start, old_count, new_start, new_count, section):
+        self.file = file
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        # the enclosing declaration git puts after the second @@, e.g. "func (s *S) Bar() string {"
+        self.section = section
+        self.function = section[1:] if function_re.match(section) else None
+        # the ' ', '-' and '+' lines, only kept when asked for
+        self.lines = []
+
+
+def _header_paths(line):
+    # (a path, b path) of a "diff --git a/X b/Y" line; paths can hold spaces, so the line is
+    # split at the " b/" that leaves two equal halves, or the first one for a renamed file.
+    # The ---, +++ and rename lines that follow settle what this cannot
+    rest = line[len('diff --git '):] if line.startswith('diff --git ') else line[len('diff '):]
+    if not rest.startswith('a/'):
+        parts = rest.split()
+        return (parts[0], parts[1] if len(parts) > 1 else None) if parts else (None, None)
+    n = (len(rest) - len('a/ b/')) // 2
+    if rest[2 + n:5 + n] == ' b/' and rest[2:2 + n] == rest[5 + n:]:
+        return rest[2:2 + n], rest[5 + n:]
+    old, sep, new = rest[2:].partition(' b/')
+    return old, new if sep else None
+
+
+def _line_path(line, prefix):
+    # the path of a "--- a/X" or "+++ b/X" line, git ends it with a tab when it holds a space
+    path = line[4:].rstrip('\t')
+    if path == '/dev/null' or not path.startswith(prefix):
+        return None
+    return path[len(prefix):]
+
+
+def iter_diff(lines, keep_lines=False):
+    # Single pass over a unified diff, yielding a DiffFile once its header is read and a
+    # DiffHunk once all of its lines are read. `lines` can be any iterable (an open file,
+    # a streamed response), only the current hunk is held in memory.
+    current_file = None
+    file_pending = False
+    hunk = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('diff'):
+            if hunk is not None:
+                yield hunk
+                hunk = None
+            if file_pending:
+                yield current_file
+            current_file = None
+            file_pending = False
+            if file_header_re.match(line):
+                old, new = _header_paths(line)
+                if old:
+                    current_file = DiffFile(old, new)
+                    file_pending = True
+            continue
+        if current_file is None:
+            continue
+        if hunk is not None and line[:1] in (' ', '-', '+', '\\') and not line.startswith('@@'):
+            if keep_lines:
+                hunk.lines.append(line)
+            continue
+        if line.startswith('@@'):
+            m = hunk_re.match(line)
+            if m is None:
+                continue
+            if hunk is not None:
+                yield hunk
+            if file_pending:
+                yield current_file
+                file_pending = False
+            hunk = DiffHunk(current_file,
+                            int(m.group(1)), int(m.group(2)) if m.group(2) is not None else 1,
+                            int(m.group(3)), int(m.group(4)) if m.group(4) is not None else 1,
+                            m.group(5))
+            continue
+        if hunk is None:
+            m = index_re.match(line)
+            if m is not None:
+                current_file.old_blob = m.group(1)
+                current_file.new_blob = m.group(2)
+            elif line.startswith('--- ') and _line_path(line, 'a/'):
+                current_file.path = _line_path(line, 'a/')
+            elif line.startswith('+++ ') and _line_path(line, 'b/'):
+                current_file.new_path = _line_path(line, 'b/')
+            elif line.startswith('rename from '):
+                current_file.path = line[len('rename from '):]
+            elif line.startswith('rename to '):
+                current_file.new_path = line[len('rename to '):]
+    if hunk is not None:
+        yield hunk
+    if file_pending:
+        yield current_file
+
+
+def count_go_files(lines):
+    num_go = 0
+    for event in iter_diff(lines):
+        if isinstance(event, DiffFile) and event.is_go:
+            num_go += 1
+    return num_go
+
+
+def modified_functions(events):
+    # [filename, function name1, function name2, filename, ...] for the go files whose
+    # hunks sit inside a function, each name once in a row
+    result_list = []
+    listed_file = None
+    for event in events:
+        if not isinstance(event, DiffHunk) or not event.file.is_go or event.function is None:
+            continue
+        if event.file is not listed_file:
+            result_list.append(event.file.path)
+            listed_file = event.file
+        if result_list[-1].strip() != event.function.strip():
+            result_list.append(event.function)
+    return result_list
+
+
+def go_file_hunks(events, hunks):
+    # passes the events on and puts the hunks of the go files changed in place in
+    # hunks[path], to rebuild the files with apply_hunks (read the diff with keep_lines=True)
+    for event in events:
+        if isinstance(event, DiffHunk) and event.file.is_go and event.file.changed_in_place():
+            hunks.setdefault(event.file.path, []).append(event)
+        yield event
+
+
+class PatchError(ValueError):
+    pass
+
+
+def apply_hunks(content, hunks):
+    # the file after the change, rebuilt from its content before the change and all hunks
+    # of the file. Every context and removed line has to match the content and every hunk
+    # has to start at the lines its header gives, PatchError otherwise
+    try:
+        # str() takes any bytes-like content, a mapped blob too
+        text = str(content, 'UTF-8')
+    except UnicodeDecodeError:
+        raise PatchError('not UTF-8')
+    if '\r' in text:
+        # diffs are read with universal newlines, a \r does not survive the round trip
+        raise PatchError('carriage return')
+    old = text.split('\n')
+    # a newline at the end leaves an empty last item
+    old_eol = old[-1] == ''
+    if old_eol:
+        old.pop()
+    new_eol = old_eol
+    new = []
+    pos = 0
+    for hunk in hunks:
+        # a hunk without old (new) lines gives the line after which it goes
+        start = hunk.old_start - 1 if hunk.old_count else hunk.old_start
+        if start < pos or start > len(old):
+            raise PatchError('hunk -{} out of order or past the end'.format(hunk.old_start))
+        new.extend(old[pos:start])
+        pos = start
+        new_start = hunk.new_start - 1 if hunk.new_count else hunk.new_start
+        if len(new) != new_start:
+            raise PatchError('hunk +{} starts at line {}'.format(hunk.new_start, len(new) + 1))
+        num_old = num_new = 0
+        old_no_eol = new_no_eol = False
+        last = None
+        for line in hunk.lines:
+            tag, body = line[:1], line[1:]
+            if tag == '\\':
+                # "\ No newline at end of file" after the last line of a side
+                old_no_eol = old_no_eol or last in (' ', '-')
+                new_no_eol = new_no_eol or last in (' ', '+')
+                continue
+            if tag in (' ', '-'):
+                if pos >= len(old) or old[pos] != body:
+                    raise PatchError('line {} does not match'.format(pos + 1))
+                pos += 1
+                num_old += 1
+            if tag in (' ', '+'):
+                new.append(body)
+                num_new += 1
+            last = tag
+        if (num_old, num_new) != (hunk.old_count, hunk.new_count):
+            raise PatchError('hunk -{} has {} old and {} new lines'.format(hunk.old_start, num_old, num_new))
+        if pos == len(old):
+            if num_old and old_no_eol == old_eol:
+                raise PatchError('newline at the end does not match')
+            new_eol = not new_no_eol
+        elif old_no_eol:
+            raise PatchError('no newline before the end')
+    new.extend(old[pos:])
+    return ('\n'.join(new) + ('\n' if new_eol and new else '')).encode('UTF-8')
@@ -0,0 +1,278 @@
+import argparse
+import logging
+import os
+import queue
+import signal
+import threading
+import traceback
+import util
+from metrics import registry as metrics
+
+
+# One entry point for the stages, each of which still runs on its own:
+#   python ghpr.py crawl yomorun/yomo
+#   python ghpr.py write --processes 4
+#   python ghpr.py split ./result/yomorun_yomo_GHPR.txt
+#   python ghpr.py pipeline yomorun/yomo --vocab vocab.txt
+# pipeline runs the three side by side: every defect pull the crawler stores goes to the
+# Writer over a bounded queue, and every pair the Writer writes goes on to the splitter, so
+# the first pairs of a new repo are split seconds after its crawl started instead of after
+# whole-directory passes. Given a vocabulary, split and pipeline also export the splits as
+# token shards (see token_shards.py). A command only imports the stages it runs.
+
+_END = object()
+
+
+class _Stopped(Exception):
+    # the consumer of the crawled pulls is gone
+    pass
+
+
+def _split_stage(pro_name, seed, ratio, maxsize):
+    # (sink, close) for Writer.write_stream: the sink hands the pairs to a PairSplitter
+    # running in a thread of its own, close() waits for it and returns its (train, val, test)
+    from my_devider import PairSplitter
+    splitter = PairSplitter(pro_name, seed, ratio)
+    pairs = queue.Queue(maxsize)
+    errors = []
+
+    def run():
+        try:
+            while True:
+                pair = pairs.get()
+                if pair is None:
+                    return
+                # after an error the queue is still drained, the sink would block otherwise
+                if not errors:
+                    try:
+                        splitter.add(*pair)
+                    except BaseException as e:
+                        errors.append(e)
+        finally:
+            splitter.close()
+
+    def sink(defective, clean):
+        if errors:
+            raise errors[0]
+        pairs.put((defective, clean))
+
+    def close():
+        pairs.put(None)
+        thread.join()
+        if errors:
+            raise errors[0]
+        return tuple(splitter.counts)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return sink, close
+
+
+def run_pipeline(crawler, writer, repos, seed=0, ratio=(8, 1, 1), depth=64, incremental=False, tokenizer=None,
+                 max_length=None):
+    # crawls the repos one after the other in a thread while the Writer writes the pulls the
+    # crawler stores and the splitter splits the pairs the Writer writes; returns
+    # {'owner/repo': (pairs written, (train, val, test))}. The crawler and the Writer should
+    # share the catalog, the Writer reads the diffs the crawler saved under its dst_dir.
+    # Given a tokenizer, a repo's splits are exported as token shards once they are written
+    found = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item):
+        # gives up once the Writer is gone, raising in the crawler ends its crawl
+        while not stop.is_set():
+            try:
+                found.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped()
+
+    def crawl():
+        try:
+            for owner, repo in repos:
+                try:
+                    crawler.crawl_async(owner, repo, incremental=incremental)
+                except _Stopped:
+                    return
+                except Exception as e:
+                    logging.error('Pipeline: exception: {}/{} {}'.format(owner, repo, e))
+                    print('Terminated with error: {} ({}/{})'.format(e, owner, repo))
+                    logging.error(traceback.format_exc())
+                # the Writer finishes the repo's dataset on its end marker
+                put((owner, repo, None))
+                if crawler._interrupted:
+                    break
+            put(_END)
+        except _Stopped:
+            pass
+
+    def pulls_of(item):
+        # the pulls of the item's repo from the queue, up to its end marker
+        while item[2] is not None:
+            yield item[2]
+            item = found.get()
+
+    # the splitter opens its files before the Writer made the directory
+    util.make_dir('./result')
+    crawler.on_pull = lambda owner, repo, pull: put((owner, repo, pull))
+    thread = threading.Thread(target=crawl, daemon=True)
+    thread.start()
+    results = {}
+    try:
+        while True:
+            item = found.get()
+            if item is _END:
+                break
+            owner, repo, _ = item
+            sink, close = _split_stage(repo, seed, ratio, depth)
+            try:
+                num_pairs = writer.write_stream(owner, repo, pulls_of(item), sink)
+            finally:
+                split = close()
+            results['{}/{}'.format(owner, repo)] = (num_pairs, split)
+            print('{}/{}: {:,} pairs written, split {}'.format(owner, repo, num_pairs, split))
+            if tokenizer is not None:
+                import token_shards
+                token_shards.export_splits(repo, tokenizer, max_length)
+    except BaseException:
+        # the crawl finishes its page and stops
+        crawler._interrupted = True
+        raise
+    finally:
+        stop.set()
+        thread.join()
+        crawler.on_pull = None
+    return results
+
+
+def _owner_repo(name):
+    owner, sep, repo = name.partition('/')
+    if not sep or not owner or not repo:
+        raise argparse.ArgumentTypeError('expected owner/repo, got {!r}'.format(name))
+    return owner, repo
+
+
+def crawl(args):
+    from my_crawler import Crawler
+    crawler = Crawler(dst_dir=args.dst_dir, concurrency=args.concurrency, backend=args.backend,
+                      storage=args.storage, catalog_path=args.catalog or 'auto')
+    for owner, repo in args.repos:
+        try:
+            crawler.crawl_async(owner, repo, incremental=args.incremental)
+        except Exception as e:
+            logging.error('Main: exception: {}/{} {}'.format(owner, repo, e))
+            print('Terminated with error: {} ({}/{})'.format(e, owner, repo))
+            logging.error(traceback.format_exc())
+    # not in dst_dir, the Writer takes every entry in there for an owner
+    metrics.save('./metrics-crawl')
+
+
+def write(args):
+    from my_writer import Writer
+    writer = Writer(dst_dir=args.src_dir, output_format=args.format, dedup_threshold=args.dedup_threshold,
+                    catalog_path=args.catalog or 'auto')
+    print(writer.writer(src_dir=args.src_dir, processes=args.processes, incremental=not args.full))
+    metrics.save('./result/metrics-write')
+
+
+def _tokenizer(args):
+    if args.vocab is None:
+        return None
+    import token_shards
+    return token_shards.load_tokenizer(args.vocab, args.lowercase)
+
+
+def _catalog_path(args):
+    from catalog import catalog_path
+    return args.catalog or catalog_path(args.src_dir)
+
+
+def split(args):
+    from my_devider import Devider, devide_written
+    tokenizer = _tokenizer(args)
+    if args.paths:
+        names = []
+        for path in args.paths:
+            devider = Devider(file_path=path)
+            print(path, devider.stream_devide(seed=args.seed))
+            names.append(devider.repo)
+    elif os.path.isfile(_catalog_path(args)):
+        from catalog import Catalog
+        results = devide_written(Catalog(_catalog_path(args)), seed=args.seed)
+        print(results)
+        names = [name.split('/')[1] for name in results]
+    else:
+        raise SystemExit('no dataset paths given and no catalog at {}'.format(_catalog_path(args)))
+    if tokenizer is not None:
+        import token_shards
+        for name in names:
+            print(name, token_shards.export_splits(name, tokenizer, args.max_length))
+
+
+def pipeline(args):
+    from my_crawler import Crawler
+    from my_writer import Writer
+    crawler = Crawler(dst_dir=args.dst_dir, concurrency=args.concurrency, backend=args.backend,
+                      storage=args.storage, catalog_path=args.catalog or 'auto')
+    # the Writer installs its own interrupt handler, the crawler's one stops the crawl after
+    # its current page and lets the Writer and the splitter finish what it found
+    crawler_handler = signal.getsignal(signal.SIGINT)
+    writer = Writer(dst_dir=args.dst_dir, dedup_threshold=args.dedup_threshold, pipeline_depth=args.depth,
+                    catalog=crawler._catalog)
+    signal.signal(signal.SIGINT, crawler_handler)
+    util.make_dir('./result')
+    try:
+        run_pipeline(crawler, writer, args.repos, seed=args.seed, depth=args.depth, incremental=args.incremental,
+                     tokenizer=_tokenizer(args), max_length=args.max_length)
+    finally:
+        metrics.save('./result/metrics-pipeline')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='crawl defect pulls, write function pairs and split them')
+    parser.add_argument('--catalog', default=None, help='the catalog next to the crawl directory by default')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def crawl_options(p):
+        p.add_argument('repos', nargs='+', type=_owner_repo, metavar='owner/repo')
+        p.add_argument('--dst-dir', default='repos')
+        p.add_argument('--concurrency', type=int, default=16)
+        p.add_argument('--backend', choices=('rest', 'graphql'), default='rest')
+        p.add_argument('--storage', choices=('jsonl', 'files'), default='jsonl')
+        p.add_argument('--incremental', action='store_true', help='only pulls closed since the last finished crawl')
+
+    def export_options(p):
+        p.add_argument('--vocab', default=None, help='a vocab.txt or tokenizer.json, exports the splits as token shards')
+        p.add_argument('--lowercase', action='store_true', help='for uncased vocab.txt vocabularies')
+        p.add_argument('--max-length', type=int, default=None, help='tokens kept of a title or code')
+
+    p = commands.add_parser('crawl', help='crawl the defect pulls of repositories')
+    crawl_options(p)
+    p.set_defaults(run=crawl)
+    p = commands.add_parser('write', help='write the function pairs of every crawled repo')
+    p.add_argument('--src-dir', default='repos')
+    p.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    p.add_argument('--format', choices=('text', 'parquet', 'arrow'), default='text')
+    p.add_argument('--dedup-threshold', type=float, default=None)
+    p.add_argument('--full', action='store_true', help='write every pull again, not only new or changed ones')
+    p.set_defaults(run=write)
+    p = commands.add_parser('split', help='split datasets into train, val and test')
+    p.add_argument('paths', nargs='*', help='_GHPR.txt files, every written repo of the catalog by default')
+    p.add_argument('--src-dir', default='repos', help='the crawl directory whose catalog is read')
+    p.add_argument('--seed', type=int, default=0)
+    export_options(p)
+    p.set_defaults(run=split)
+    p = commands.add_parser('pipeline', help='crawl, write and split side by side')
+    crawl_options(p)
+    p.add_argument('--depth', type=int, default=64, help='pulls and pairs queued between the stages')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--dedup-threshold', type=float, default=None)
+    export_options(p)
+    p.set_defaults(run=pipeline)
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
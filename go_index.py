@@ -0,0 +1,129 @@
+import re
+
+
+# everything the indexer has to look at; strings, runes, raw strings and comments are matched
+# whole so braces inside them are never counted
+token_re = re.compile(rb'''
+    (?P<nl>\n)
+  | (?P<skip>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|//[^\n]*)
+  | (?P<multi>`[^`]*`|/\*.*?\*/)
+  | (?P<open>[{(\[])
+  | (?P<close>[})\]])
+  | (?P<kw>\b(?:func|interface|struct)\b)
+''', re.S | re.X)
+# func [(receiver)] name followed by its parameters or type parameters
+declaration_re = re.compile(rb'func\s*(?:\(([^()]*)\)\s*)?([A-Za-z_][A-Za-z0-9_]*)\s*[(\[]')
+signature_re = re.compile(rb'func\s*(?:\(([^()]*)\)\s*)?([A-Za-z_][A-Za-z0-9_]*)')
+ident_re = re.compile(rb'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def _receiver_type(receiver):
+    # "s *Server[T]" -> "Server"
+    if receiver is None:
+        return None
+    names = ident_re.findall(receiver.split(b'[')[0])
+    return names[-1].decode('ascii') if names else None
+
+
+def parse_signature(header):
+    # (receiver type, name) from a hunk header like "func (s *S) Bar() string {"
+    src = header.encode('UTF-8') if isinstance(header, str) else header
+    m = signature_re.search(src)
+    if m is None:
+        return None, None
+    return _receiver_type(m.group(1)), m.group(2).decode('ascii')
+
+
+class _Declaration(object):
+
+    def __init__(self, m, line):
+        self.name = m.group(2).decode('ascii')
+        self.receiver = _receiver_type(m.group(1))
+        self.start_line = line
+        # ( and [ depth, and braces of interface{} / struct{} types inside the signature
+        self.parens = 0
+        self.type_braces = 0
+        self.last_kw = None
+        self.body_depth = None
+
+
+class GoFunctionIndex(object):
+    # Top level func declarations of one Go source blob, found in a single tokenizing pass.
+    # Spans are 0-based (start line, end line), inclusive, over the lines of content.split('\n').
+    # content can be any bytes-like object, e.g. a blob_store.Blob's mmap.
+
+    def __init__(self, content):
+        if isinstance(content, str):
+            content = content.encode('UTF-8')
+        self._spans = {}
+        self._scan(content)
+
+    def find(self, name, receiver=None):
+        # "Recv.Name" first for methods, then the first declaration called name
+        if receiver is not None:
+            spans = self._spans.get(receiver + '.' + name)
+            if spans:
+                return spans[0]
+        spans = self._spans.get(name)
+        return spans[0] if spans else None
+
+    def names(self):
+        return list(self._spans)
+
+    def _add(self, decl, end_line):
+        span = (decl.start_line, end_line)
+        self._spans.setdefault(decl.name, []).append(span)
+        if decl.receiver is not None:
+            self._spans.setdefault(decl.receiver + '.' + decl.name, []).append(span)
+
+    def _scan(self, src):
+        line = 0
+        depth = 0
+        decl = None
+        for m in token_re.finditer(src):
+            kind = m.lastgroup
+            if kind == 'nl':
+                line += 1
+                if decl is not None and decl.body_depth is None and decl.parens == 0 and decl.type_braces == 0:
+                    # semicolon insertion ends a declaration without body (implemented in assembly)
+                    decl = None
+                continue
+            if kind == 'skip':
+                continue
+            if kind == 'multi':
+                # src can be an mmap, which has no count
+                line += m.group().count(b'\n')
+                continue
+            tok = m.group()
+
+            if decl is None or decl.body_depth is not None:
+                if tok == b'{':
+                    depth += 1
+                elif tok == b'}':
+                    depth -= 1
+                    if decl is not None and depth == decl.body_depth:
+                        self._add(decl, line)
+                        decl = None
+                elif tok == b'func' and depth == 0 and decl is None:
+                    d = declaration_re.match(src, m.start())
+                    if d is not None:
+                        decl = _Declaration(d, line)
+                continue
+
+            # inside the signature
+            if kind == 'kw':
+                decl.last_kw = tok
+                continue
+            if tok in (b'(', b'['):
+                decl.parens += 1
+            elif tok in (b')', b']'):
+                decl.parens -= 1
+            elif tok == b'{':
+                if decl.parens > 0 or decl.type_braces > 0 or decl.last_kw in (b'interface', b'struct'):
+                    decl.type_braces += 1
+                else:
+                    decl.body_depth = depth
+                    depth += 1
+            elif tok == b'}':
+                decl.type_braces -= 1
+            decl.last_kw = None
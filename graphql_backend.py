@@ -0,0 +1,116 @@
+import logging
+import util
+
+
+pulls_query = '''
+query($owner: String!, $repo: String!, $per_page: Int!, $cursor: String, $order: IssueOrderField!, $direction: OrderDirection!) {
+  repository(owner: $owner, name: $repo) {
+    databaseId
+    pullRequests(states: MERGED, first: $per_page, after: $cursor, orderBy: {field: $order, direction: $direction}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number
+        title
+        body
+        url
+        createdAt
+        updatedAt
+        closedAt
+        mergedAt
+        baseRefName
+        baseRefOid
+        headRefName
+        headRefOid
+        labels(first: 20) { nodes { databaseId name } }
+        closingIssuesReferences(first: 10) {
+          nodes {
+            number
+            databaseId
+            title
+            body
+            url
+            state
+            createdAt
+            closedAt
+            authorAssociation
+            author { login }
+            labels(first: 20) { nodes { databaseId name } }
+          }
+        }
+      }
+    }
+  }
+}
+'''
+
+
+def _labels(node):
+    return [{'id': l['databaseId'], 'name': l['name']} for l in node['labels']['nodes']]
+
+
+def _issue_from_node(owner, repo, node):
+    # the REST issue fields the rest of the pipeline reads
+    return {
+        'number': node['number'],
+        'id': node['databaseId'],
+        'title': node['title'],
+        'body': node['body'],
+        'html_url': node['url'],
+        'url': util.issue_url_template.format(owner=owner, repo=repo, issue_number=node['number']),
+        'state': node['state'].lower(),
+        'created_at': node['createdAt'],
+        'closed_at': node['closedAt'],
+        'author_association': node['authorAssociation'],
+        'user': {'login': node['author']['login'] if node['author'] else None},
+        'labels': _labels(node),
+    }
+
+
+def _pull_from_node(owner, repo, repo_id, node):
+    # shaped like a REST pull so is_related_with_defect and the Writer read it unchanged
+    return {
+        'number': node['number'],
+        'title': node['title'],
+        'body': node['body'],
+        'html_url': node['url'],
+        'diff_url': node['url'] + '.diff',
+        'issue_url': util.issue_url_template.format(owner=owner, repo=repo, issue_number=node['number']),
+        'url': util.pull_url_template.format(owner=owner, repo=repo, pull_number=node['number']),
+        # only merged pulls are queried
+        'state': 'closed',
+        'created_at': node['createdAt'],
+        'updated_at': node['updatedAt'],
+        'closed_at': node['closedAt'],
+        'merged_at': node['mergedAt'],
+        'labels': _labels(node),
+        'base': {'ref': node['baseRefName'], 'sha': node['baseRefOid'], 'repo': {'id': repo_id}},
+        'head': {'ref': node['headRefName'], 'sha': node['headRefOid']},
+        'closing_issues': [_issue_from_node(owner, repo, i) for i in node['closingIssuesReferences']['nodes']],
+    }
+
+
+class GraphQLPulls(object):
+    # one query per page returns the merged pulls with their labels, shas and closing issues
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+
+    def fetch_page(self, owner, repo, per_page, cursor=None, by_update=False):
+        variables = {
+            'owner': owner,
+            'repo': repo,
+            'per_page': per_page,
+            'cursor': cursor,
+            'order': 'UPDATED_AT' if by_update else 'CREATED_AT',
+            'direction': 'DESC' if by_update else 'ASC',
+        }
+        rj = self._scheduler.post_json(util.graphql_url, {'query': pulls_query, 'variables': variables},
+                                       resource='graphql')
+        if rj.get('errors'):
+            logging.error('GraphQL: errors: {}/{} {}'.format(owner, repo, rj['errors']))
+            raise util.RequestFailed('GraphQL errors for {}/{}: {}'.format(owner, repo, rj['errors'][0].get('message')))
+        r = rj['data']['repository']
+        prs = r['pullRequests']
+        pulls = [_pull_from_node(owner, repo, r['databaseId'], n) for n in prs['nodes']]
+        # like REST paging, a full last page is followed by one empty page
+        return pulls, prs['pageInfo']['endCursor']
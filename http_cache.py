@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import requests
+
+
+# raw files addressed by a full commit sha never change
+immutable_url_pattern = re.compile(r'^https?://[^/]+/[^/]+/[^/]+/raw/[0-9a-f]{40}/')
+# response headers kept next to a cached body
+kept_headers = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def is_immutable_url(url):
+    return immutable_url_pattern.match(url) is not None
+
+
+class CachedResponse(object):
+    # the part of requests.Response the crawler and writer use
+
+    def __init__(self, url, status_code, headers, content, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 400
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get('Content-Type', '')
+        m = re.search(r'charset=([\w-]+)', content_type)
+        return m.group(1) if m else 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpCache(object):
+
+    def __init__(self,
+                 cache_dir='.http_cache',
+                 max_bytes=4 * 1024 ** 3,
+                 session=None,
+                 pool_size=64):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if session is None:
+            # requests keeps 10 connections per host by default, fewer than the crawler's workers
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> [size, last_used]
+        self._total_bytes = 0
+        # updated under _lock, the crawler's workers share a cache
+        self.num_hits = 0
+        self.num_revalidated = 0
+        self.num_misses = 0
+        self._load_entries()
+
+    def _load_entries(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            return
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                if not e.name.endswith('.body'):
+                    continue
+                st = e.stat()
+                self._entries[e.name[:-5]] = [st.st_size, st.st_mtime]
+                self._total_bytes += st.st_size
+
+    def _paths(self, key):
+        d = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(d, key + '.body'), os.path.join(d, key + '.meta')
+
+    def _lookup(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        body_path, meta_path = self._paths(key)
+        if key not in self._entries:
+            return key, None, None
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return key, None, None
+        return key, meta, body
+
+    def _touch(self, key):
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._entries[key][1] = now
+        try:
+            os.utime(self._paths(key)[0], (now, now))
+        except OSError:
+            pass
+
+    def _store(self, key, url, r, immutable):
+        body_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        meta = {
+            'url': url,
+            'immutable': immutable,
+            'stored_at': int(time.time()),
+            'headers': {h: r.headers[h] for h in kept_headers if h in r.headers},
+        }
+        # write the body first so a crash never leaves meta pointing to a partial body
+        # temporary names are unique per process and thread, several writers can share a cache
+        suffix = '.{}.{}.tmp'.format(os.getpid(), threading.get_ident())
+        with open(body_path + suffix, 'wb') as f:
+            f.write(r.content)
+        os.replace(body_path + suffix, body_path)
+        with open(meta_path + suffix, 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+        size = len(r.content)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._total_bytes -= old[0]
+            self._entries[key] = [size, time.time()]
+            self._total_bytes += size
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        # least recently used first, down to 90% of the cap
+        with self._lock:
+            order = sorted(self._entries.items(), key=lambda kv: kv[1][1])
+            target = self.max_bytes * 0.9
+            victims = []
+            for key, (size, _) in order:
+                if self._total_bytes <= target:
+                    break
+                victims.append(key)
+                self._total_bytes -= size
+                del self._entries[key]
+        for key in victims:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        logging.info('HttpCache: evicted {} entries'.format(len(victims)))
+
+    def _hit(self, url, key, meta, body, immutable):
+        if meta is not None and (immutable or meta.get('immutable')):
+            with self._lock:
+                self.num_hits += 1
+            self._touch(key)
+            return CachedResponse(url, 200, meta['headers'], body, from_cache=True)
+        return None
+
+    def cached(self, url, immutable=None):
+        # the stored response when it can be used without revalidation
+        if immutable is None:
+            immutable = is_immutable_url(url)
+        key, meta, body = self._lookup(url)
+        return self._hit(url, key, meta, body, immutable)
+
+    def get(self, url, headers=None, immutable=None):
+        if immutable is None:
+            immutable = is_immutable_url(url)
+        key, meta, body = self._lookup(url)
+        r = self._hit(url, key, meta, body, immutable)
+        if r is not None:
+            return r
+
+        request_headers = dict(headers or {})
+        if meta is not None:
+            if 'ETag' in meta['headers']:
+                request_headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']:
+                request_headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+        r = self.session.get(url, headers=request_headers)
+        if r.status_code == 304 and meta is not None:
+            # unchanged, GitHub does not count this against the rate limit
+            with self._lock:
+                self.num_revalidated += 1
+            self._touch(key)
+            merged = dict(meta['headers'])
+            merged.update(r.headers)
+            return CachedResponse(url, 200, merged, body, from_cache=True)
+
+        with self._lock:
+            self.num_misses += 1
+        response = CachedResponse(url, r.status_code, r.headers, r.content)
+        if r.status_code == 200:
+            self._store(key, url, response, immutable)
+        return response
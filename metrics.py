@@ -0,0 +1,189 @@
+import bisect
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Process wide counters and histograms for the crawler, the scheduler and the writer.
+#   metrics.registry.inc('ghpr_rows_written_total', 2, stage='write')
+#   metrics.registry.observe('ghpr_request_seconds', 0.12, kind='diff')
+#   with metrics.registry.stage('write'): ...
+# Exported as a JSON summary (save_json) and in the Prometheus text format (save_prometheus).
+# GHPR_PROFILE=crawl,write runs those stages under cProfile, see enable_profiling.
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _label_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        # counts per bucket, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        # stages run under cProfile, see enable_profiling
+        self._profile_stages = set()
+        self._profile_dir = None
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = Histogram()
+                self._histograms[key] = h
+            h.observe(value)
+
+    def counter(self, name, **labels):
+        return self._counters.get(_key(name, labels), 0)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # observes the seconds the block took
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def enable_profiling(self, stages, profile_dir='./profiles'):
+        # stage() blocks of these stages run under cProfile, the stats go to
+        # {profile_dir}/{stage}-{pid}.prof (read them with pstats or snakeviz).
+        # cProfile only sees the thread that entered the stage.
+        self._profile_stages = set(stages)
+        self._profile_dir = profile_dir
+
+    @contextmanager
+    def stage(self, name):
+        # wall time of a pipeline stage, profiled when enabled for it
+        profiler = None
+        if name in self._profile_stages:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc('ghpr_stage_seconds_total', time.perf_counter() - start, stage=name)
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(self._profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self._profile_dir, '{}-{}.prof'.format(name, os.getpid())))
+
+    def snapshot(self):
+        # a picklable copy, e.g. to send the counts of a worker process to its parent
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in self._histograms.items()},
+            }
+
+    def merge(self, snapshot):
+        with self._lock:
+            for k, v in snapshot['counters'].items():
+                self._counters[k] = self._counters.get(k, 0) + v
+            for k, (buckets, counts, total, count) in snapshot['histograms'].items():
+                h = self._histograms.get(k)
+                if h is None:
+                    h = Histogram(buckets)
+                    self._histograms[k] = h
+                h.counts = [a + b for a, b in zip(h.counts, counts)]
+                h.sum += total
+                h.count += count
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def summary(self):
+        # {name: [{labels..., value}]} for counters and {name: [{labels..., count, sum, mean, buckets}]}
+        snap = self.snapshot()
+        counters = {}
+        for (name, labels), value in sorted(snap['counters'].items()):
+            counters.setdefault(name, []).append(dict(labels, value=value))
+        histograms = {}
+        for (name, labels), (buckets, counts, total, count) in sorted(snap['histograms'].items()):
+            cumulative = []
+            running = 0
+            for le, c in zip(list(buckets) + ['+Inf'], counts):
+                running += c
+                cumulative.append([le, running])
+            histograms.setdefault(name, []).append(dict(labels, count=count, sum=total,
+                                                        mean=total / count if count else 0.0,
+                                                        buckets=cumulative))
+        return {'counters': counters, 'histograms': histograms}
+
+    def prometheus(self):
+        snap = self.snapshot()
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(snap['counters'].items()):
+            if name not in typed:
+                lines.append('# TYPE {} counter'.format(name))
+                typed.add(name)
+            lines.append('{}{} {}'.format(name, _label_text(labels), value))
+        for (name, labels), (buckets, counts, total, count) in sorted(snap['histograms'].items()):
+            if name not in typed:
+                lines.append('# TYPE {} histogram'.format(name))
+                typed.add(name)
+            running = 0
+            for le, c in zip(list(buckets) + ['+Inf'], counts):
+                running += c
+                lines.append('{}_bucket{} {}'.format(name, _label_text(labels, [('le', le)]), running))
+            lines.append('{}_sum{} {}'.format(name, _label_text(labels), total))
+            lines.append('{}_count{} {}'.format(name, _label_text(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+    def save_prometheus(self, path):
+        # for the node exporter textfile collector, or any scraper reading the file
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.prometheus())
+        os.replace(path + '.tmp', path)
+
+    def save(self, prefix):
+        # {prefix}.json and {prefix}.prom
+        self.save_json(prefix + '.json')
+        self.save_prometheus(prefix + '.prom')
+
+
+registry = Metrics()
+if os.environ.get('GHPR_PROFILE'):
+    registry.enable_profiling(os.environ['GHPR_PROFILE'].split(','), os.environ.get('GHPR_PROFILE_DIR', './profiles'))
@@ -1,34 +1,72 @@
-import inspect
+import asyncio
 import logging
+import os
 import traceback
-import requests
 import signal
 import sys
-import time
 import util
+from http_cache import HttpCache
+from request_scheduler import RequestScheduler
+from graphql_backend import GraphQLPulls
+import diff_parser
+from crawl_journal import CrawlJournal
+import record_store
+from catalog import Catalog, catalog_path as default_catalog_path
+from concurrent.futures import ThreadPoolExecutor
+from metrics import registry as metrics
 
 
 class Crawler(object):
 
     def __init__(self,
                  token= util.token,
+                 tokens=None,
                  dst_dir='repos',
                  per_page=100,
                  save_pull_pages=True,
                  max_request_tries=5000,
-                 request_retry_wait_secs=10):
+                 request_retry_wait_secs=10,
+                 concurrency=16,
+                 cache=None,
+                 cache_dir='.http_cache',
+                 scheduler=None,
+                 backend='rest',
+                 storage='jsonl',
+                 catalog=None,
+                 catalog_path='auto',
+                 on_pull=None):
 
         self.dst_dir = dst_dir
         self.per_page = per_page
         self.save_pull_pages = save_pull_pages
         self.max_request_tries = max_request_tries
         self.request_retry_wait_secs = request_retry_wait_secs
-        self._headers = {
-            'Accept': 'application/vnd.github.v3+json',
-        }
-
-        if token is not None:
-            self._headers['Authorization'] = 'token ' + token
+        self.concurrency = concurrency
+        # pass one scheduler to Crawler and Writer so they share the token pool and cache
+        if scheduler is None:
+            if tokens is None:
+                tokens = [token] if token is not None else []
+            if cache is None:
+                cache = HttpCache(cache_dir)
+            scheduler = RequestScheduler(tokens, cache, max_request_tries=max_request_tries,
+                                         request_retry_wait_secs=request_retry_wait_secs)
+        self._scheduler = scheduler
+        # 'graphql' fetches a page of merged pulls with labels, shas and closing issues in one query
+        self._graphql = GraphQLPulls(scheduler) if backend == 'graphql' else None
+        # 'jsonl' appends pages, pulls and issues to a compressed record store per repo,
+        # 'files' writes one JSON file each (see record_store.py)
+        self.storage = storage
+        self._stores = {}
+        # every stored pull is also indexed in the SQLite catalog (see catalog.py), 'auto'
+        # for the one next to dst_dir, None for none
+        if catalog_path == 'auto':
+            catalog_path = default_catalog_path(dst_dir)
+        if catalog is None and catalog_path is not None:
+            catalog = Catalog(catalog_path)
+        self._catalog = catalog
+        # called with (owner, repo, pull) for every stored pull once it is on disk, e.g. to
+        # hand it to the Writer while the crawl goes on (see ghpr.py pipeline)
+        self.on_pull = on_pull
         self._interrupted = False
 
         def sigint_handler(signal, frame):
@@ -39,104 +77,258 @@ class Crawler(object):
             print('\nInterrupted, finishing current page\nPress interrupt key again to force exit')
         signal.signal(signal.SIGINT, sigint_handler)
 
-    def _try_to_get(self, url):
-        try:
-            r = requests.get(url, headers=self._headers)
+    def _get(self, url):
+        return self._scheduler.get_json(url)
+
+    def _fetch_diff(self, owner, repo, p):
+        # the diff is streamed to disk, scanned from there and kept for the Writer when it changes go files
+        diff_path = util.diff_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, pull_number=p['number'])
+        # the diff of a merged pull never changes
+        if not (p.get('merged_at') and os.path.isfile(diff_path)):
+            r = self._scheduler.download(p['diff_url'], diff_path)
             if not r.ok:
-                logging.error('Get: not ok: {} {} {} {}'.format(url, r.status_code, r.headers, r.text))
-                print(r.text)
-                if 'X-Ratelimit-Remaining' in r.headers and int(
-                        r.headers['X-Ratelimit-Remaining']) < 1 and 'X-Ratelimit-Reset' in r.headers:
-                    ratelimit_wait_secs = int(r.headers['X-Ratelimit-Reset']) - int(time.time()) + 1
-                    logging.info('Get: waiting {} secs for rate limit reset'.format(ratelimit_wait_secs))
-                    print('Rate limit reached, waiting {} secs for reset'.format(ratelimit_wait_secs))
-                    time.sleep(ratelimit_wait_secs)
-                    return self._try_to_get(url)
-                return None
-            rj = r.json()
-        except Exception as e:
-            logging.error('Get: exception: {} {}'.format(url, e))
-            return None
-        if isinstance(rj, dict) and 'message' in rj:
-            logging.error('Get: error: {} {}'.format(url, rj))
-            return None
-        return rj
+                return 0
+        with open(diff_path, 'r', encoding='UTF-8', errors='replace') as f, \
+                metrics.timer('ghpr_diff_parse_seconds', stage='crawl'):
+            num_modi_go = diff_parser.count_go_files(f)
+        if num_modi_go == 0:
+            os.remove(diff_path)
+        return num_modi_go
 
-    def _get(self, url):
-        tries = 0
-        while True:
-            r = self._try_to_get(url)
-            if r is not None:
-                return r
-            tries += 1
-            if tries >= self.max_request_tries:
-                print('Request failed {} times, aborting'.format(tries))
-                raise util.TooManyRequestFailures('{} request failures for {}'.format(tries, url))
-            print('Request failed {} times, retrying in {} seconds'.format(tries, self.request_retry_wait_secs))
-            time.sleep(self.request_retry_wait_secs)
-
-
-    def crawl(self, owner, repo, start_page=1):
-
-        logging.info('Crawl: starting {} {}/{}'.format(start_page, owner, repo))
-        print('Starting from page {} ({}/{})'.format(start_page, owner, repo))
-        util.ensure_dir_exists(util.repo_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo))
-        # linked_issues_regex = util.make_linked_issues_regex(owner, repo)
+    def _fetch_pull(self, owner, repo, p):
+        # network part of a defect related pull: its diff and, for go changes, the linked issues
+        num_modi_go = self._fetch_diff(owner, repo, p)
+        is_modi_go = num_modi_go > 0
+        issues = []
+        if is_modi_go:
+            if 'closing_issues' in p:
+                # the GraphQL backend already returned them with the pull
+                issues = [(i['number'], i) for i in p['closing_issues']]
+            else:
+                linked_issue_number = util.extract_linked_issue_numbers(p.get('issue_url'))
+                if linked_issue_number:
+                    issues = [(linked_issue_number, self._get(p.get('issue_url')))]
+        return is_modi_go, num_modi_go, issues
 
-        page = start_page
+    def _record_pull(self, owner, repo, p, fetched, counts, journal):
+        is_modi_go, num_modi_go, issues = fetched
+        counts['total_modi_go_file'] += num_modi_go
+        if is_modi_go:
+            counts['num_modi_go_pulls'] += 1
+            metrics.inc('ghpr_go_defect_pulls_total')
+            p['num_modi_go'] = num_modi_go
+            if 'closing_issues' in p:
+                linked_issue_numbers = [i['number'] for i in p.pop('closing_issues')]
+            else:
+                linked_issue_numbers = util.extract_linked_issue_numbers(p.get('issue_url'))
+            logging.debug('Linked issues of {}: {}'.format(p.get('issue_url'), linked_issue_numbers))
+            if linked_issue_numbers:
+                pull_number = p['number']
+                p['linked_issue_numbers'] = linked_issue_numbers
+                store = self._stores[(owner, repo)]
+                store.put('pull', pull_number, p)
+                if self._catalog is not None:
+                    self._catalog.put(owner, repo, p)
+                counts['num_pulls'] += 1
+                for issue_number, issue in issues:
+                    # print('issue label :', '' if len(issue.get('labels')) == 0 else issue.get('labels')[0]['name'])
+                    store.put('issue', issue_number, issue)
+                    counts['num_issues'] += 1
+                # on disk before the journal calls the pull done
+                store.flush()
+                if self.on_pull is not None:
+                    self.on_pull(owner, repo, p)
+        journal.record_pull(p['number'])
 
-        num_issues = 0
-        num_pulls = 0
-        num_defect_relate_pulls = 0
-        num_modi_go_pulls = 0
-        total_modi_go_file = 0
+    def _start_crawl(self, owner, repo, start_page, resume, incremental):
+        repo_dir = util.repo_path_template.format(src_dir=self.dst_dir, owner=owner, repo=repo)
+        if resume:
+            util.make_dir(repo_dir)
+        else:
+            util.ensure_dir_exists(repo_dir)
+        # linked_issues_regex = util.make_linked_issues_regex(owner, repo)
+        journal = CrawlJournal(util.journal_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo))
+        store = record_store.open_store(self.storage, self.dst_dir, owner, repo)
+        self._stores[(owner, repo)] = store
+        if self._catalog is not None:
+            if not resume:
+                self._catalog.forget_repo(owner, repo)
+            # pulls stored by a run that stopped before the catalog committed them
+            self._catalog.sync_repo(owner, repo, store)
+        if incremental and journal.last_finished_run is not None:
+            # newest updates first, back to the start of the last finished run
+            journal.since = journal.last_finished_run
+            start_page = 1
+        elif start_page is None:
+            start_page = journal.next_page()
+        journal.record_start()
 
+        if journal.since is not None:
+            logging.info('Crawl: starting incremental since {} {}/{}'.format(journal.since, owner, repo))
+            print('Starting incremental crawl of pulls closed since {} ({}/{})'.format(journal.since, owner, repo))
+        else:
+            logging.info('Crawl: starting {} {}/{}'.format(start_page, owner, repo))
+            print('Starting from page {} ({}/{})'.format(start_page, owner, repo))
         self._interrupted = False
+        counts = {
+            'num_issues': 0,
+            'num_pulls': 0,
+            'num_defect_relate_pulls': 0,
+            'num_modi_go_pulls': 0,
+            'total_modi_go_file': 0,
+        }
+        return journal, counts, start_page
+
+    def _pulls_url(self, owner, repo, page, journal):
+        if journal.since is not None:
+            return util.pulls_updated_url_template.format(per_page=self.per_page, owner=owner, repo=repo, page=page)
+        return util.pulls_url_template.format(per_page=self.per_page, owner=owner, repo=repo, page=page)
+
+    def _fetch_pulls_page(self, owner, repo, page, journal):
+        if self._graphql is None:
+            return self._get(self._pulls_url(owner, repo, page, journal))
+        # GraphQL pages are chained by cursor, page n needs the end cursor of page n-1
+        pulls, end_cursor = self._graphql.fetch_page(owner, repo, self.per_page, journal.cursors.get(page - 1),
+                                                     by_update=journal.since is not None)
+        journal.cursors[page] = end_cursor
+        return pulls
+
+    def _is_last_page(self, pulls, journal):
+        if len(pulls) < self.per_page:
+            return True
+        # pages are ordered by update time in incremental mode, nothing older is of interest
+        return journal.since is not None and pulls[-1]['updated_at'] < journal.since
+
+    def _save_pulls_page(self, owner, repo, page, pulls, journal):
+        #save all pull into json
+        if not self.save_pull_pages:
+            return
+        if journal.since is not None:
+            since = journal.since.replace(':', '')
+            self._stores[(owner, repo)].put('pulls_since_page', '{}-{}'.format(since, page), pulls)
+        else:
+            self._stores[(owner, repo)].put('pulls_page', page, pulls)
+
+    def _finish_page(self, owner, repo, page, pulls, counts, journal):
+        logging.info('Crawl: finished {} {}/{}'.format(page, owner, repo))
+        print('Page {} finished ({}/{})'.format(page, owner, repo))
+        journal.record_page(page, len(pulls) >= self.per_page)
+        metrics.inc('ghpr_pages_total')
+        if self._catalog is not None:
+            self._catalog.flush()
+        if self._is_last_page(pulls, journal):
+            journal.record_finish()
+            journal.close()
+            logging.info('Crawl: finished all, {} issues {} pulls {}/{}'.format(counts['num_issues'], counts['num_pulls'], owner, repo))
+            print('All pages finished, saved {} issues and {} pull requests ({}/{})'.format(counts['num_issues'], counts['num_pulls'], owner, repo))
+            print('Total_PR : {} , Defect_PR : {}, Modi_go_PR : {} , Total_modi_go_file : {}'.format(
+                counts['num_pulls'], counts['num_defect_relate_pulls'], counts['num_modi_go_pulls'], counts['total_modi_go_file']))
+            return True
+        return False
+
+    def _pending_defect_pulls(self, pulls, counts, journal):
+        defect_pulls = []
+        for p in pulls:
+            # already processed by an earlier run, or closed before an incremental window
+            if not journal.is_pending(p):
+                continue
+            counts['num_pulls'] += 1
+            metrics.inc('ghpr_pulls_seen_total')
+            if util.is_related_with_defect(p):
+                counts['num_defect_relate_pulls'] += 1
+                metrics.inc('ghpr_defect_pulls_total')
+                defect_pulls.append(p)
+            else:
+                journal.record_pull(p['number'])
+        return defect_pulls
+
+    def crawl(self, owner, repo, start_page=None, resume=True, incremental=False):
+        # start_page=None continues after the last page in the crawl journal.
+        # resume=False wipes the repo directory and journal first.
+        # incremental=True only crawls pulls closed since the last finished run.
+        with metrics.stage('crawl'):
+            try:
+                self._crawl(owner, repo, start_page, resume, incremental)
+            finally:
+                self._close_store(owner, repo)
+
+    def _close_store(self, owner, repo):
+        store = self._stores.pop((owner, repo), None)
+        if store is not None:
+            store.close()
+        if self._catalog is not None:
+            self._catalog.flush()
+
+    def _crawl(self, owner, repo, start_page, resume, incremental):
+        journal, counts, page = self._start_crawl(owner, repo, start_page, resume, incremental)
+
         while not self._interrupted:
-            pulls = self._get(util.pulls_url_template.format(per_page=self.per_page, owner=owner, repo=repo, page=page))
-
-            #save all pull into json
-            if self.save_pull_pages:
-                util.save_json(pulls, util.pulls_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, page=page))
-
-            for p in pulls:
-                num_pulls += 1
-                if util.is_related_with_defect(p):
-                    num_defect_relate_pulls += 1
-
-                    diff_result = requests.get(p['diff_url'], headers=self._headers)
-                    is_modi_go, num_modi_go = util.is_modify_go(diff_result)
-                    total_modi_go_file += total_modi_go_file
-                    if is_modi_go:
-                        num_modi_go_pulls += 1
-                        p['num_modi_go'] = num_modi_go
-                        linked_issue_numbers = util.extract_linked_issue_numbers(p.get('issue_url'))
-                        print(p.get('issue_url'))
-                        print(linked_issue_numbers)
-                        if linked_issue_numbers:
-                            pull_number = p['number']
-                            p['linked_issue_numbers'] = linked_issue_numbers
-                            util.save_json(p, util.pull_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, pull_number=pull_number))
-                            num_pulls += 1
-                            # for issue_number in linked_issue_numbers:
-                            issue = self._get(p.get('issue_url'))
-                            # print('issue label :', '' if len(issue.get('labels')) == 0 else issue.get('labels')[0]['name'])
-                            util.save_json(issue, util.issue_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, issue_number=linked_issue_numbers))
-                            num_issues += 1
-            logging.info('Crawl: finished {} {}/{}'.format(page, owner, repo))
-            print('Page {} finished ({}/{})'.format(page, owner, repo))
-            if len(pulls) < self.per_page:
-                logging.info('Crawl: finished all, {} issues {} pulls {}/{}'.format(num_issues, num_pulls, owner, repo))
-                print('All pages finished, saved {} issues and {} pull requests ({}/{})'.format(num_issues, num_pulls, owner, repo))
-                print('Total_PR : {} , Defect_PR : {}, Modi_go_PR : {} , Total_modi_go_file : {}'.format(num_pulls,num_defect_relate_pulls,num_modi_go_pulls,total_modi_go_file))
+            pulls = self._fetch_pulls_page(owner, repo, page, journal)
+            self._save_pulls_page(owner, repo, page, pulls, journal)
+
+            for p in self._pending_defect_pulls(pulls, counts, journal):
+                self._record_pull(owner, repo, p, self._fetch_pull(owner, repo, p), counts, journal)
+            if self._finish_page(owner, repo, page, pulls, counts, journal):
                 return
             page += 1
+        journal.close()
+
+    def crawl_async(self, owner, repo, start_page=None, resume=True, incremental=False, concurrency=None):
+        # same output and counters as crawl(), but the diffs and issues of a page are fetched
+        # concurrently and the next pulls page is requested while the current one is processed
+        if concurrency is None:
+            concurrency = self.concurrency
+        with metrics.stage('crawl'):
+            try:
+                return asyncio.run(self._crawl_async(owner, repo, start_page, resume, incremental, concurrency))
+            finally:
+                self._close_store(owner, repo)
+
+    async def _crawl_async(self, owner, repo, start_page, resume, incremental, concurrency):
+        journal, counts, page = self._start_crawl(owner, repo, start_page, resume, incremental)
+        loop = asyncio.get_running_loop()
+        # one extra worker so the page prefetch never waits behind pull requests
+        executor = ThreadPoolExecutor(max_workers=concurrency + 1)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        def fetch_page(page):
+            return loop.run_in_executor(executor, self._fetch_pulls_page, owner, repo, page, journal)
+
+        async def fetch_pull(p):
+            async with semaphore:
+                return await loop.run_in_executor(executor, self._fetch_pull, owner, repo, p)
+
+        next_pulls = fetch_page(page)
+        try:
+            while not self._interrupted:
+                pulls = await next_pulls
+                next_pulls = None
+                if not self._is_last_page(pulls, journal):
+                    next_pulls = fetch_page(page + 1)
+                self._save_pulls_page(owner, repo, page, pulls, journal)
+
+                defect_pulls = self._pending_defect_pulls(pulls, counts, journal)
+                fetched = await asyncio.gather(*[fetch_pull(p) for p in defect_pulls])
+                # record in page order so files and counters match the serial path
+                for p, f in zip(defect_pulls, fetched):
+                    self._record_pull(owner, repo, p, f, counts, journal)
+                if self._finish_page(owner, repo, page, pulls, counts, journal):
+                    return
+                page += 1
+            journal.close()
+        finally:
+            if next_pulls is not None:
+                next_pulls.cancel()
+            executor.shutdown(wait=False)
 
 
 def main():
     repos = ['yomorun/yomo']
-    start_page = 1
-    crawler = Crawler()
+    # None continues from the crawl journal
+    start_page = None
+    incremental = False
+    use_async = True
+    crawler = Crawler(concurrency=16)
 
     for r in repos:
         n = r.find('/')
@@ -144,12 +336,17 @@ def main():
         repo = r[n+1:]
 
         try:
-            crawler.crawl(owner, repo, start_page=start_page)
+            if use_async:
+                crawler.crawl_async(owner, repo, start_page=start_page, incremental=incremental)
+            else:
+                crawler.crawl(owner, repo, start_page=start_page, incremental=incremental)
 
         except Exception as e:
             logging.error('Main: exception: {}/{} {}'.format(owner, repo, e))
             print('Terminated with error: {} ({}/{})'.format(e, owner, repo))
             logging.error(traceback.format_exc())
+    # not in repos/, the Writer takes every entry in there for an owner
+    metrics.save('./metrics-crawl')
 
 
 if __name__ == '__main__':
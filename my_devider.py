@@ -1,12 +1,13 @@
-from sklearn.model_selection import train_test_split
+import random
 import util
+from metrics import registry as metrics
 
 
 
 class Devider(object):
     def __init__(self,
-                 num_inst,
-                 file_path):
+                 num_inst=None,
+                 file_path=None):
         self.num_inst= num_inst
         self.file_path = file_path
         self.owner = file_path.split('_')[0]
@@ -22,6 +23,8 @@ class Devider(object):
         return class_list
 
     def devide(self):
+        # only this index based split needs scikit-learn
+        from sklearn.model_selection import train_test_split
         class_list = self._gen_class(self.num_inst)
         total_list = list(range(self.num_inst))
         # print(len(class_list))
@@ -40,9 +43,10 @@ class Devider(object):
         f_test = open(test_path, 'w', newline='', encoding='UTF-8')
         f_val = open(val_path, 'w', newline='', encoding='UTF-8')
 
+        train_idx = set(train_idx)
+        val_idx = set(val_idx)
         with open(self.file_path, 'r',encoding='UTF-8') as f:
-            lines = f.readlines()
-            for idx, line in enumerate(lines):
+            for idx, line in enumerate(f):
                 if idx in train_idx:
                     f_train.write(line)
                 elif idx in val_idx:
@@ -54,9 +58,71 @@ class Devider(object):
         f_test.close()
         f_val.close()
 
+    def stream_devide(self, seed=0, ratio=(8, 1, 1)):
+        # Single pass split that needs neither num_inst nor the whole file in memory.
+        # The Writer puts every defective line right before its clean line, so the file is
+        # read two lines at a time and a pair always lands in one split (see PairSplitter).
+        # Lines end at \n only, code can hold a \r
+        splitter = PairSplitter(self.repo, seed, ratio)
+        with metrics.stage('split'), open(self.file_path, 'r', newline='\n', encoding='UTF-8') as f:
+            try:
+                while True:
+                    defective = f.readline()
+                    if not defective:
+                        break
+                    splitter.add(defective, f.readline())
+            finally:
+                splitter.close()
+        # number of pairs in train, val and test
+        return tuple(splitter.counts)
 
-if __name__ == '__main__':
 
-    devider= Devider(num_inst=196, file_path='./result/yomorun_yomo_GHPR.txt')
-    train_idx, val_idx, test_idx= devider.devide()
-    devider.write(train_idx,test_idx,val_idx)
\ No newline at end of file
+class PairSplitter(object):
+    # Splits pairs as they come, from a file or straight from the Writer (ghpr.py pipeline).
+    # A pair always lands in one split, which also keeps the labels balanced in each of them.
+    # Pairs are dealt in blocks of sum(ratio): each block is a seeded shuffle of ratio[0]
+    # train, ratio[1] val and ratio[2] test slots, so the proportions hold for any prefix of
+    # the pairs and a seed always gives the same split.
+
+    def __init__(self, pro_name, seed=0, ratio=(8, 1, 1)):
+        self._rng = random.Random(seed)
+        self._block = [0] * ratio[0] + [1] * ratio[1] + [2] * ratio[2]
+        self._slots = []
+        self.counts = [0, 0, 0]
+        self._outputs = tuple(open(util.devided_file_template.format(pro_name=pro_name, type=name), 'w',
+                                   newline='', encoding='UTF-8') for name in ('train', 'val', 'test'))
+
+    def add(self, defective, clean):
+        if not self._slots:
+            self._slots = self._block[:]
+            self._rng.shuffle(self._slots)
+        split = self._slots.pop()
+        self._outputs[split].write(defective)
+        self._outputs[split].write(clean)
+        self.counts[split] += 1
+
+    def close(self):
+        for f in self._outputs:
+            f.close()
+        for split, name in enumerate(('train', 'val', 'test')):
+            metrics.inc('ghpr_split_pairs_total', self.counts[split], split=name)
+
+
+def devide_written(catalog, seed=0, ratio=(8, 1, 1)):
+    # splits the dataset of every repo the catalog has function pairs written for;
+    # returns {'owner/repo': (train, val, test)}
+    results = {}
+    for owner, repo in catalog.written_repos():
+        devider = Devider(file_path=util.ghpr_path_template.format(owner=owner, repo=repo))
+        results['{}/{}'.format(owner, repo)] = devider.stream_devide(seed, ratio)
+    return results
+
+
+if __name__ == '__main__':
+    import os
+    from catalog import Catalog, catalog_path
+    if os.path.isfile(catalog_path('repos')):
+        print(devide_written(Catalog(catalog_path('repos')), seed=0))
+    else:
+        devider= Devider(file_path='./result/yomorun_yomo_GHPR.txt')
+        print(devider.stream_devide(seed=0))
\ No newline at end of file
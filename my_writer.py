@@ -1,33 +1,123 @@
-import pandas as pd
-import requests
-import re
-from tqdm import tqdm
-import time
+import multiprocessing
+import os
 import util
+from http_cache import HttpCache
+from request_scheduler import RequestScheduler
+from blob_store import BlobStore, git_blob_id
+import repo_backend
+import diff_parser
+import go_index
+import columnar
+import dedup
+import pipeline
+import record_store
+from write_manifest import WriteManifest
+from catalog import Catalog, catalog_path as default_catalog_path
+from go_index import GoFunctionIndex
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import registry as metrics
+import time
 import signal
 import sys
+import io
 import json
 import logging
 
 
+# bumped when a change to the extraction gives other rows for the same pull, so that
+# incremental runs write every pull again
+EXTRACTOR_VERSION = 1
+
 
 class Writer(object):
 
     def __init__(self,
                  token = util.token,
+                 tokens=None,
                  dst_dir='repos',
                  max_request_tries=5000,
-                 request_retry_wait_secs=10):
+                 request_retry_wait_secs=10,
+                 cache=None,
+                 cache_dir='.http_cache',
+                 scheduler=None,
+                 blob_store=None,
+                 blob_dir='.blob_store',
+                 backend='http',
+                 git_repos_dir='./clones',
+                 offline=False,
+                 func_index_cache_size=256,
+                 output_format='text',
+                 row_group_size=4096,
+                 dedup_threshold=None,
+                 dedup_report='./result/dedup-report.jsonl',
+                 storage='auto',
+                 fetch_workers=8,
+                 pipeline_depth=16,
+                 patch_clean=True,
+                 catalog=None,
+                 catalog_path='auto'):
+        # what a worker process needs to build the same Writer, the objects themselves do not pickle
+        self._worker_kwargs = dict(
+            token=token, tokens=tokens, dst_dir=dst_dir,
+            max_request_tries=max_request_tries, request_retry_wait_secs=request_retry_wait_secs,
+            cache_dir=cache.cache_dir if cache is not None else cache_dir,
+            blob_dir=blob_store.root if blob_store is not None else blob_dir,
+            backend=backend, git_repos_dir=git_repos_dir, offline=offline,
+            func_index_cache_size=func_index_cache_size,
+            output_format=output_format, row_group_size=row_group_size,
+            storage=storage, fetch_workers=fetch_workers, pipeline_depth=pipeline_depth,
+            patch_clean=patch_clean, catalog_path=None)
         self.dst_dir = dst_dir
         self.max_request_tries = max_request_tries
         self.request_retry_wait_secs = request_retry_wait_secs
-        self._headers = {
-            'Accept': 'application/vnd.github.v3+json',
-        }
-
-
-        if token is not None:
-            self._headers['Authorization'] = 'token ' + token
+        if scheduler is None:
+            if tokens is None:
+                tokens = [token] if token is not None else []
+            if cache is None:
+                cache = HttpCache(cache_dir)
+            scheduler = RequestScheduler(tokens, cache, max_request_tries=max_request_tries,
+                                         request_retry_wait_secs=request_retry_wait_secs)
+        self._scheduler = scheduler
+        # every raw file read goes through the blob store
+        self._blobs = blob_store if blob_store is not None else BlobStore(blob_dir)
+        # 'http' reads GitHub, 'git' reads bare clones under git_repos_dir (see repo_backend.GitBackend),
+        # offline=True keeps the git backend from falling back to GitHub for missing objects
+        self.backend = backend
+        self.git_repos_dir = git_repos_dir
+        self.offline = offline
+        self._backends = {}
+        # blob id -> (mapped Blob, GoFunctionIndex), least recently used dropped first
+        self.func_index_cache_size = func_index_cache_size
+        self._func_indexes = OrderedDict()
+        # 'text' writes <CODESPLIT> lines, 'parquet' or 'arrow' typed columns (see columnar.py)
+        if output_format != 'text' and output_format not in columnar.formats:
+            raise ValueError('unknown output format {}'.format(output_format))
+        self.output_format = output_format
+        self.row_group_size = row_group_size
+        # pairs whose MinHash similarity to an already written pair reaches dedup_threshold are
+        # dropped and listed in dedup_report, None writes every pair
+        self._dedup = dedup.PairDeduplicator(dedup_threshold) if dedup_threshold is not None else None
+        self.dedup_report = dedup_report
+        # where the crawler put the pulls, 'auto' uses a repo's record store when it has one
+        self.storage = storage
+        self._stores = {}
+        # diffs are fetched up to pipeline_depth pulls ahead and raw files on fetch_workers
+        # threads while functions are extracted and written, 0 does one pull at a time
+        self.fetch_workers = fetch_workers
+        self.pipeline_depth = pipeline_depth
+        # the file at a pull's head is rebuilt from the base file and the diff, and only
+        # downloaded when the diff does not apply; False downloads both sides
+        self.patch_clean = patch_clean
+        # with a catalog (see catalog.py) the repos and pulls to write come from it and every
+        # written pull is marked there; without one they are found in the src_dir tree.
+        # Worker processes leave the catalog to the parent. 'auto' is the catalog next to dst_dir,
+        # used once a crawl made one
+        if catalog_path == 'auto':
+            catalog_path = default_catalog_path(dst_dir)
+        if catalog is None and catalog_path is not None and os.path.isfile(catalog_path):
+            catalog = Catalog(catalog_path)
+        self._catalog = catalog
         self._interrupted = False
 
         def sigint_handler(signal, frame):
@@ -40,125 +130,128 @@ class Writer(object):
         signal.signal(signal.SIGINT, sigint_handler)
 
 
-    def _get(self, url):
-        tries = 0
-        while True:
-            r = self._load_from_url(url)
-            if r is not None:
-                full_text = r.text
-                lines = full_text.split('\n')
-                return lines
-            tries += 1
-            if tries >= self.max_request_tries:
-                print('Request failed {} times, aborting'.format(tries))
-                raise util.TooManyRequestFailures('{} request failures for {}'.format(tries, url))
-            print('Request failed {} times, retrying in {} seconds'.format(tries, self.request_retry_wait_secs))
-            time.sleep(self.request_retry_wait_secs)
-
-    def _load_from_url(self, url):
-        try :
-            get_result = requests.get(url, headers=self._headers)
-            if not get_result.ok:
-                # print('Get: not ok: {} {} {} {}'.format(url, get_result.status_code, get_result.headers, get_result.text))
-                if 'X-Ratelimit-Remaining' in get_result.headers and int(get_result.headers['X-Ratelimit-Remaining']) < 1 and 'X-Ratelimit-Reset' in get_result.headers:
-                    ratelimit_wait_secs = int(get_result.headers['X-Ratelimit-Reset']) - int(time.time()) + 1
-                    print('Rate limit reached, waiting {} secs for reset'.format(ratelimit_wait_secs))
-                    time.sleep(ratelimit_wait_secs)
-                    return self._load_from_url(url)
-            return get_result
-        except Exception as e:
-            print(e)
-            return None
-
-
-
-    def _find_function_name(self, diff_url):
-        #is it modifying go file??
-
-        def _modify_go_scan(s):
-            re_tmp = re.compile(util.modify_file_template)
-            result = re_tmp.findall(s)
-            return_filename = None
-            if len(result) != 0:
-                filename = s.split()[2][2:]
-                filetype = (filename.split('/')[-1]).split('.')[-1]
-                if filetype == 'go':
-                    return_filename = filename
-            return return_filename
-
-        #is it modifying function??
-        def _get_function_name(s):
-            re_tmp = re.compile(util.get_changed_part_template)
-            re_tmp2 = re.compile(util.get_function_name_template)
-            result = re_tmp.findall(s)
-            modi_function_name = None
-            if len(result) != 0:
-                change_part_name = s.split('@@')[-1]
-                re_temp = re_tmp2.findall(change_part_name)
-                if len(re_temp) != 0:
-                    modi_function_name= change_part_name[1:]
-            return modi_function_name
-
-        lines = self._get(diff_url)
-        result_list = []
-        temp_file_name = None
-        #diff line by line
-        for line in lines:
-            modify_file_nm = _modify_go_scan(line)
-            modify_function_nm = _get_function_name(line)
-            #check modifying .go
-            if modify_file_nm !=None:
-                temp_file_name = [modify_file_nm,False]
-            try:
-                # Remove filenmae doubling
-                if temp_file_name != None  and modify_function_nm !=None:
-                    if temp_file_name[-1] == False:
-                        result_list.append(temp_file_name[0])
-                        temp_file_name[-1] = True
-                    if result_list[-1].strip() != modify_function_nm.strip():
-                        result_list.append(modify_function_nm)
-
-            except Exception as e :
-                print(modify_file_nm)
-                print(temp_file_name)
-                print(result_list)
-                print("Make result list error")
-                print(e)
-                print(diff_url)
-                print(line)
+    def _backend(self, owner, repo):
+        b = self._backends.get((owner, repo))
+        if b is None:
+            b = repo_backend.open_backend(self.backend, self._scheduler, owner, repo,
+                                          git_repos_dir=self.git_repos_dir, offline=self.offline)
+            self._backends[(owner, repo)] = b
+        return b
+
+    def _close_backend(self, owner, repo):
+        b = self._backends.pop((owner, repo), None)
+        if b is not None:
+            b.close()
+        store = self._stores.pop((owner, repo), None)
+        if store is not None:
+            store.close()
+
+    def _store(self, owner, repo):
+        store = self._stores.get((owner, repo))
+        if store is None:
+            store = record_store.open_store(self.storage, self.dst_dir, owner, repo, readonly=True)
+            self._stores[(owner, repo)] = store
+        return store
+
+    def _fetch_source(self, owner, repo, sha, filename, blob_id=None):
+        # the raw file as a mapped blob_store.Blob, None when it is not there; safe to call
+        # from several threads
+        b = self._backend(owner, repo)
+        return self._blobs.open(sha, filename, lambda: b.file_content(sha, filename), blob_id)
+
+    def _fetch_clean_source(self, owner, repo, sha, filename, hunks, base_content):
+        # the file at the pull's head: applies the diff's hunks of the file to the base file
+        # (a future of it) and checks the result against the blob id of the diff's index line.
+        # Downloaded when there are no hunks, the patch does not apply or the check fails,
+        # unless the blob store already holds that blob id
+        new_blob = hunks[0].file.new_blob if hunks else None
+        if not hunks or self._blobs.lookup(sha, filename) is not None:
+            return self._fetch_source(owner, repo, sha, filename, new_blob)
+        base = base_content.result()
+        if base is None:
+            return self._fetch_source(owner, repo, sha, filename, new_blob)
+        try:
+            content = diff_parser.apply_hunks(base.data, hunks)
+        except diff_parser.PatchError as e:
+            logging.info('Patch of {} at {} does not apply: {}'.format(filename, sha, e))
+            metrics.inc('ghpr_patch_fallbacks_total', reason='apply')
+            return self._fetch_source(owner, repo, sha, filename, new_blob)
+        if not git_blob_id(content).startswith(new_blob):
+            logging.info('Patch of {} at {} gives another blob'.format(filename, sha))
+            metrics.inc('ghpr_patch_fallbacks_total', reason='blob_id')
+            return self._fetch_source(owner, repo, sha, filename, new_blob)
+        metrics.inc('ghpr_patched_files_total')
+        return self._blobs.open(sha, filename, lambda: content)
+
+    def _fetch_files(self, owner, repo, pull, result_list, hunks, submit):
+        # {(sha, path): future of the content} of the pull's go files at base and at head;
+        # submit(fn, *args) runs fn now or on an executor
+        base, head = pull['base']['sha'], pull['head']['sha']
+        files = {}
+        for result in result_list:
+            if result.split('.')[-1] != 'go' or (base, result) in files:
                 continue
+            file_hunks = hunks.get(result) if hunks is not None else None
+            base_content = submit(self._fetch_source, owner, repo, base, result,
+                                  file_hunks[0].file.old_blob if file_hunks else None)
+            files[(base, result)] = base_content
+            # queued after the base file, so the executor never waits on a task it has not started
+            files[(head, result)] = submit(self._fetch_clean_source, owner, repo, head, result, file_hunks, base_content)
+        return files
+
+    def _index_source(self, blob):
+        # (blob, function index) of a raw file; a blob seen before comes from the cache, its
+        # function index and line offsets are built once
+        if blob is None:
+            return None, None
+        cached = self._func_indexes.get(blob.blob_id)
+        if cached is None:
+            with metrics.timer('ghpr_function_index_seconds'):
+                cached = blob, GoFunctionIndex(blob.data)
+            self._func_indexes[blob.blob_id] = cached
+            if len(self._func_indexes) > self.func_index_cache_size:
+                self._func_indexes.popitem(last=False)
+        else:
+            self._func_indexes.move_to_end(blob.blob_id)
+        return cached
+
+    def _diff_lines(self, owner, repo, pull):
+        # the crawler saves the diff of every go changing pull, fetch only when it is missing
+        diff_path = util.diff_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo, pull_number=pull['number'])
+        if os.path.isfile(diff_path):
+            with open(diff_path, 'r', encoding='UTF-8', errors='replace') as f:
+                for line in f:
+                    yield line
+            return
+        for line in self._backend(owner, repo).diff_lines(pull, save_path=diff_path):
+            yield line
+
+    def _find_function_name(self, owner, repo, pull, hunks=None):
         # result_list = [filename, function name1, 2,  filename ]
-        return result_list
-
-    def _write_dataset(self, result_list,owner,repo,defective_code_sha,clean_code_sha,file,title):
-
-        def _getfunction_name(full_function_name):
-            sliced_name = full_function_name.split()
-            if sliced_name[1][0] != '(':
-                return sliced_name[1].split('(')[0]
-            else:
-                return sliced_name[3].split('(')[0]
-        def _find_modi_func_source(lines,function_name):
-            line_index = 0
-            start_index = 0
-            start_function_at_index=-1
-            end_index = 0
-
-            for line in lines:
-                funcname_start_index = line.find(function_name+"(")
-                func_start_index = line.find('func')
-
-                if func_start_index != -1 and funcname_start_index != -1 and func_start_index<funcname_start_index:
-                    start_index = line_index
-                    start_function_at_index=func_start_index
-                if start_function_at_index != -1 and start_function_at_index == line.find('}'):
-                    end_index = line_index
-                    break
-                line_index += 1
-            return start_index, end_index
-
+        # given a dict, hunks gets the hunks of every go file, lines included, for patching
+        # the timing includes fetching the diff when the crawler did not save it
+        with metrics.timer('ghpr_diff_parse_seconds', stage='write'):
+            events = diff_parser.iter_diff(self._diff_lines(owner, repo, pull), keep_lines=hunks is not None)
+            if hunks is not None:
+                events = diff_parser.go_file_hunks(events, hunks)
+            return diff_parser.modified_functions(events)
+
+    def _dataset_path(self, owner, repo):
+        if self.output_format == 'text':
+            return util.ghpr_path_template.format(owner=owner, repo=repo)
+        return util.ghpr_columnar_path_template.format(owner=owner, repo=repo, format=self.output_format)
+
+    def _open_dataset(self, path):
+        if self.output_format == 'text':
+            return open(path,'w',newline='',encoding='UTF-8')
+        return columnar.ColumnarWriter(path, self.row_group_size)
+
+    def _extract(self, result_list, owner, repo, defective_code_sha, clean_code_sha, files):
+        # (number of go files, [(defective url, clean url, function name, defective code, clean code)])
+        # for the changed functions, files as _fetch_files gives them
+        read_source = lambda sha, filename: self._index_source(files[(sha, filename)].result())
         num_go_file = 0
-        num_fun = 0
+        pairs = []
 
         for result in result_list:
             if result.split('.')[-1] == 'go':
@@ -167,81 +260,405 @@ class Writer(object):
                                                                    filename=filename)
                 clean_code_url = util.raw_file_url_template.format(owner=owner, repo=repo, sha=clean_code_sha,
                                                                filename=filename)
-                defective_code_lines = self._get(defective_code_url)
-                clean_code_lines = self._get(clean_code_url)
+                defective_blob, defective_index = read_source(defective_code_sha, result)
+                clean_blob, clean_index = read_source(clean_code_sha, result)
                 num_go_file += 1
             else :
-                try :
-                    function_name = _getfunction_name(result)
-                except Exception as e :
-                    print(e)
+                receiver, function_name = go_index.parse_signature(result)
+                if function_name is None:
+                    print("Function name error")
                     print(result)
-                    function_name = "Error_func_name"
-                def_start,def_end = _find_modi_func_source(defective_code_lines,function_name)
-                cln_start,cln_end = _find_modi_func_source(clean_code_lines,function_name)
-                if def_start>def_end or cln_start>cln_end:
-                    print("Search start and end point error")
+                    continue
+                def_span = defective_index.find(function_name, receiver) if defective_index else None
+                cln_span = clean_index.find(function_name, receiver) if clean_index else None
+                # added or removed functions only exist on one side
+                if def_span is None or cln_span is None:
+                    metrics.inc('ghpr_functions_not_found_total')
+                    print("Function not found")
                     print(defective_code_url)
-                    print(function_name)
-                    print(def_start,def_end)
                     print(clean_code_url)
                     print(function_name)
-                    print(cln_start,cln_end)
                     continue
-                dective_code = ''.join(
-                    "" if i.find('//') != -1 else i for i in defective_code_lines[def_start:def_end + 1])
-                cln_code = ''.join(
-                    "" if i.find('//') !=-1 else i for i in clean_code_lines[cln_start:cln_end + 1])
-
-
+                def_start,def_end = def_span
+                cln_start,cln_end = cln_span
+                # lines with a // comment are left out, read in place from the mapped blobs
+                dective_code = defective_blob.join_lines(def_start, def_end, skip=b'//')
+                cln_code = clean_blob.join_lines(cln_start, cln_end, skip=b'//')
                 if dective_code != cln_code:
-                    def_string ="1" + '<CODESPLIT>'+ defective_code_url +'<CODESPLIT>' + str(function_name) + '<CODESPLIT>' + title + '<CODESPLIT>'+dective_code
-                    cln_string ="0" + '<CODESPLIT>'+ clean_code_url +'<CODESPLIT>' + str(function_name) + '<CODESPLIT>' + title + '<CODESPLIT>'+cln_code
-                    try:
-                        file.write(def_string)
-                        file.write('\n')
-                        file.write(cln_string)
-                        file.write('\n')
-                        num_fun += 1
-                    except Exception as e:
-                        print("write error")
-                        print(e)
-                        print(def_string)
-                        print(cln_string)
-                else :
-                    continue
-        return num_go_file,num_fun
+                    pairs.append((defective_code_url, clean_code_url, function_name, dective_code, cln_code))
+        return num_go_file, pairs
 
-    def writer(self,src_dir):
-        repo_full_names = []
-        repo_num_rows = []
-        owner_repo_pairs = util.sorted_owner_repo_pairs(src_dir)
+    def _write_pairs(self, pairs, owner, repo, defective_code_sha, clean_code_sha, file, title, pull_number=None,
+                     sink=None):
+        # writes the pairs that are not near-duplicates of a written one, returns how many.
+        # sink(defective line, clean line) also gets the text lines of every written pair
+        num_fun = 0
+        for defective_code_url, clean_code_url, function_name, dective_code, cln_code in pairs:
+            if self._dedup is not None and \
+                    self._dedup.duplicate_of(dedup.pair_key(defective_code_url, function_name),
+                                             dective_code, cln_code) is not None:
+                metrics.inc('ghpr_pairs_deduplicated_total')
+                continue
+            if self.output_format != 'text':
+                for label, url, code in ((1, defective_code_url, dective_code), (0, clean_code_url, cln_code)):
+                    file.write_row(label=label, url=url, function_name=str(function_name), title=title,
+                                   code=code, owner=owner, repo=repo, pull_number=pull_number,
+                                   base_sha=defective_code_sha, head_sha=clean_code_sha)
+                metrics.inc('ghpr_rows_written_total', 2)
+                num_fun += 1
+                continue
+            def_string ="1" + '<CODESPLIT>'+ defective_code_url +'<CODESPLIT>' + str(function_name) + '<CODESPLIT>' + title + '<CODESPLIT>'+dective_code
+            cln_string ="0" + '<CODESPLIT>'+ clean_code_url +'<CODESPLIT>' + str(function_name) + '<CODESPLIT>' + title + '<CODESPLIT>'+cln_code
+            try:
+                file.write(def_string)
+                file.write('\n')
+                file.write(cln_string)
+                file.write('\n')
+                metrics.inc('ghpr_rows_written_total', 2)
+                num_fun += 1
+                if sink is not None:
+                    sink(def_string + '\n', cln_string + '\n')
+            except Exception as e:
+                print("write error")
+                print(e)
+                print(def_string)
+                print(cln_string)
+        return num_fun
+
+    def _load_pulls(self, owner, repo, pull_numbers):
+        store = self._store(owner, repo)
+        for pull_number in pull_numbers:
+            pull = store.get('pull', pull_number)
+            if pull is None:
+                # in the catalog but not in the store, e.g. after a crawl started over and stopped
+                logging.warning('Writer: pull {} of {}/{} is not in the store, skipped'.format(pull_number, owner, repo))
+                print('Pull {} of {}/{} is not in the store, skipped'.format(pull_number, owner, repo))
+                metrics.inc('ghpr_pulls_missing_total')
+                continue
+            yield pull
+
+    def _pipelined_pulls(self, owner, repo, pulls):
+        # (pull, number of go files, pairs) for the pulls, in order. Four stages run side by side:
+        # diffs are fetched and parsed up to pipeline_depth pulls ahead, the files of a pull are
+        # fetched at base and at head concurrently on fetch_workers threads, functions are
+        # extracted in a thread of their own, and the caller writes. The queues between the
+        # stages hold at most pipeline_depth pulls
+        # created here, the stages would race to open it
+        self._backend(owner, repo)
+        executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+
+        def fetch_diff(pull):
+            hunks = {} if self.patch_clean else None
+            return pull, self._find_function_name(owner, repo, pull, hunks), hunks
+
+        def fetch_files(diffs):
+            for pull, result_list, hunks in diffs:
+                yield pull, result_list, self._fetch_files(owner, repo, pull, result_list, hunks, executor.submit)
+
+        def extract(fetched):
+            for pull, result_list, files in fetched:
+                start = time.perf_counter()
+                num_go_file, pairs = self._extract(result_list, owner, repo, pull['base']['sha'], pull['head']['sha'],
+                                                   files)
+                # from the first file read, waiting for fetches still running included
+                metrics.observe('ghpr_extract_seconds', time.perf_counter() - start)
+                yield pull, num_go_file, pairs
+
+        diffs = pipeline.ordered_map(executor, fetch_diff, pulls, self.pipeline_depth)
+        fetched = pipeline.background(fetch_files(pipeline.background(diffs, self.pipeline_depth)), self.pipeline_depth)
+        try:
+            for item in pipeline.background(extract(fetched), self.pipeline_depth):
+                yield item
+        finally:
+            executor.shutdown(wait=False)
+
+    def _write_pulls(self, owner, repo, pulls, dataset_file, total=None, manifest=None, sink=None):
+        # writes the rows of the pulls (dicts, see _load_pulls), returns the counts of the last
+        # one and a (number, base sha, head sha, byte length, pairs written) entry per pull, the
+        # length is None for columnar output. Given a manifest, every pull is recorded in it
+        # once its rows are written; sink, see _write_pairs. A total shows a progress bar
+        counts = None
+        entries = []
+        text = self.output_format == 'text'
+        if self.pipeline_depth > 0:
+            written = self._pipelined_pulls(owner, repo, pulls)
+        else:
+            written = self._serial_pulls(owner, repo, pulls)
+        if total is not None:
+            from tqdm import tqdm
+            written = tqdm(written, total=total)
+        for pull, num_go_file, pairs in written:
+            start = dataset_file.tell() if text else 0
+            num_fun = self._write_pairs(pairs, owner, repo, pull['base']['sha'], pull['head']['sha'],
+                                        dataset_file, pull['title'], pull['number'], sink)
+            metrics.inc('ghpr_pulls_written_total')
+            counts = num_go_file, num_fun
+            entries.append((pull['number'], pull['base']['sha'], pull['head']['sha'],
+                            dataset_file.tell() - start if text else None, num_fun))
+            if manifest is not None:
+                dataset_file.flush()
+                manifest.record(pull['number'], pull['base']['sha'], pull['head']['sha'], EXTRACTOR_VERSION,
+                                start, dataset_file.tell())
+            if self._catalog is not None:
+                self._catalog.record_extraction(owner, repo, pull['number'], num_fun, EXTRACTOR_VERSION)
+        return counts, entries
+
+    def _serial_pulls(self, owner, repo, pulls):
+        # the same as _pipelined_pulls, a pull at a time
+        for pull in pulls:
+            hunks = {} if self.patch_clean else None
+            result_list = self._find_function_name(owner, repo, pull, hunks)
+            start = time.perf_counter()
+            files = self._fetch_files(owner, repo, pull, result_list, hunks, _Fetched)
+            num_go_file, pairs = self._extract(result_list, owner, repo, pull['base']['sha'], pull['head']['sha'],
+                                               files)
+            # raw file reads included, the blob store serves most of them
+            metrics.observe('ghpr_extract_seconds', time.perf_counter() - start)
+            yield pull, num_go_file, pairs
+
+    def _plan(self, owner, repo, incremental):
+        # (manifest, pulls to write) for a repo. The rows of pulls that are gone or changed
+        # are dropped from the text dataset first; parquet and arrow files cannot be appended
+        # to, they are written again from all pulls and have no manifest
+        if self._catalog is not None:
+            shas = self._catalog.pull_shas(owner, repo)
+        else:
+            store = self._store(owner, repo)
+            shas = OrderedDict()
+            for pull_number in store.keys('pull'):
+                pull = store.get('pull', pull_number)
+                shas[pull_number] = (pull['base']['sha'], pull['head']['sha'])
+        if self.output_format != 'text':
+            return None, list(shas)
+        dataset_path = self._dataset_path(owner, repo)
+        manifest_path = util.ghpr_manifest_path_template.format(owner=owner, repo=repo)
+        if not incremental:
+            for path in (dataset_path, manifest_path):
+                if os.path.isfile(path):
+                    os.remove(path)
+        manifest = WriteManifest(manifest_path)
+        manifest.compact(dataset_path, manifest.stale(shas, EXTRACTOR_VERSION))
+        if self._dedup is not None and manifest.entries:
+            # new pairs are compared with the ones already in the dataset
+            dedup.remember_file(dataset_path, self._dedup)
+        todo = [n for n, (base, head) in shas.items() if not manifest.is_current(n, base, head, EXTRACTOR_VERSION)]
+        print('{:,} of {:,} pulls new or changed'.format(len(todo), len(shas)))
+        return manifest, todo
+
+    def write_stream(self, owner, repo, pulls, sink=None):
+        # writes pulls as they come, e.g. from a running crawl (see ghpr.py pipeline), and
+        # appends their rows to the repo's text dataset; returns the number of pairs written.
+        # The rows already in the dataset go to sink first, so it sees the whole dataset. A
+        # pull already written from other shas is left for the next writer() run, which
+        # drops its old rows
+        if self.output_format != 'text':
+            raise ValueError('write_stream only writes the text format')
+        util.make_dir('./result')
+        dataset_path = self._dataset_path(owner, repo)
+        manifest = WriteManifest(util.ghpr_manifest_path_template.format(owner=owner, repo=repo))
+        manifest.compact(dataset_path, set())
+        if os.path.isfile(dataset_path) and (sink is not None or self._dedup is not None):
+            with open(dataset_path, 'r', newline='\n', encoding='UTF-8') as f:
+                for defective, clean, d, c in dedup.iter_pairs(f):
+                    if sink is not None:
+                        sink(defective, clean)
+                    if self._dedup is not None and d is not None:
+                        self._dedup.remember(dedup.pair_key(d[1], d[2]), d[-1], c[-1])
+
+        def new_pulls():
+            for pull in pulls:
+                if pull['number'] not in manifest.entries:
+                    yield pull
+
+        num_pairs = 0
+        with metrics.stage('write'):
+            try:
+                with open(dataset_path, 'a', newline='', encoding='UTF-8') as dataset_file:
+                    _, entries = self._write_pulls(owner, repo, new_pulls(), dataset_file, manifest=manifest,
+                                                   sink=sink)
+                num_pairs = sum(e[4] for e in entries)
+            finally:
+                manifest.close()
+                self._flush_catalog()
+                self._close_backend(owner, repo)
+        return num_pairs
+
+    def writer(self,src_dir,processes=1,shard_by='pull',incremental=True):
+        # processes > 1 spreads the work over a process pool, one task per pull (shard_by='pull')
+        # or per repo (shard_by='repo'); the output is the same as with processes=1.
+        # incremental=True only writes pulls that are new or changed since the last run (see
+        # write_manifest.py) and appends their rows, incremental=False writes every pull again
+        with metrics.stage('write'):
+            util.make_dir('./result')
+            if processes > 1:
+                return self._parallel_writer(src_dir, processes, shard_by, incremental)
+            return self._serial_writer(src_dir, incremental)
+
+    def _owner_repo_pairs(self, src_dir):
+        # the catalog only knows the Writer's dst_dir
+        if self._catalog is not None and os.path.normpath(src_dir) == os.path.normpath(self.dst_dir):
+            return self._catalog.repos()
+        return util.sorted_owner_repo_pairs(src_dir)
+
+    def _flush_catalog(self):
+        if self._catalog is not None:
+            self._catalog.flush()
+
+    def _serial_writer(self, src_dir, incremental):
+        num_go_file, num_fun = 0, 0
+        owner_repo_pairs = self._owner_repo_pairs(src_dir)
         num_repos = len(owner_repo_pairs)
         for i, (owner, repo) in enumerate(owner_repo_pairs):
             repo_full_name = '{}/{}'.format(owner, repo)
-            repo_full_names.append(repo_full_name)
-            repo_num_rows.append(0)
-            util.ensure_dir_exists('./result')
-            dataset_path = util.ghpr_path_template.format(owner= owner, repo= repo)
-            dataset_file =open(dataset_path,'w',newline='',encoding='UTF-8')
-
             print('{} ({:,}/{:,})'.format(repo_full_name, i + 1, num_repos))
-            for pull_number in tqdm(util.sorted_pull_numbers(src_dir, owner, repo)):
-                pull = util.read_json(util.pull_path_template.format(dst_dir=self.dst_dir, owner=owner, repo=repo,
-                                                                     pull_number=pull_number))
-                diff_url = pull['diff_url']
-                clean_code_sha = pull['head']['sha']
-                defective_code_sha = pull['base']['sha']
-                pull_title = pull['title']
-                modi_file_function_list = self._find_function_name(diff_url)
-                num_go_file,num_fun = self._write_dataset(modi_file_function_list,owner,repo,defective_code_sha,clean_code_sha,dataset_file,pull_title)
+            manifest, pull_numbers = self._plan(owner, repo, incremental)
+            dataset_path = self._dataset_path(owner, repo)
+            if manifest is None:
+                dataset_file = self._open_dataset(dataset_path)
+            else:
+                dataset_file = open(dataset_path, 'a', newline='', encoding='UTF-8')
+            try:
+                counts, _ = self._write_pulls(owner, repo, self._load_pulls(owner, repo, pull_numbers), dataset_file,
+                                              total=len(pull_numbers), manifest=manifest)
+            finally:
+                dataset_file.close()
+                if manifest is not None:
+                    manifest.close()
+            if counts is not None:
+                num_go_file, num_fun = counts
+            self._flush_catalog()
+            print('Blob store: {}'.format(self._blobs.summary()))
+            self._close_backend(owner, repo)
+        self._finish_dedup()
         return num_go_file,num_fun
 
+    def _finish_dedup(self):
+        if self._dedup is not None:
+            self._dedup.write_report(self.dedup_report)
+            print('Dedup: {}'.format(self._dedup.summary()))
+
+    def _keep_pair(self, defective, clean):
+        return self._dedup.duplicate_of(dedup.pair_key(defective['url'], defective['function_name']),
+                                        defective['code'], clean['code']) is None
+
+    def _parallel_writer(self, src_dir, processes, shard_by, incremental):
+        # every worker writes its own shard file, the shards are then appended in
+        # (owner, repo, pull number) order, the order the serial writer goes in. Workers do not
+        # deduplicate, the merge does, in that same order, so the same pairs are dropped
+        shard_dir = os.path.join('./result', 'shards')
+        util.ensure_dir_exists(shard_dir)
+        tasks = []
+        repo_shards = []
+        for owner, repo in self._owner_repo_pairs(src_dir):
+            manifest, pull_numbers = self._plan(owner, repo, incremental)
+            self._close_backend(owner, repo)
+            if shard_by == 'repo':
+                units = [pull_numbers]
+            else:
+                units = [[n] for n in pull_numbers]
+            shard_tasks = []
+            for j, unit in enumerate(units):
+                shard_path = os.path.join(shard_dir, '{}_{}_{}.{}'.format(
+                    owner, repo, j, 'txt' if self.output_format == 'text' else self.output_format))
+                shard_tasks.append(len(tasks))
+                tasks.append((owner, repo, unit, shard_path))
+            repo_shards.append((owner, repo, manifest, shard_tasks))
+
+        from tqdm import tqdm
+        num_go_file, num_fun = 0, 0
+        task_entries = []
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(self._worker_kwargs,)) as pool:
+            for counts, entries, snapshot in tqdm(pool.imap(_write_shard, tasks), total=len(tasks)):
+                metrics.merge(snapshot)
+                task_entries.append(entries)
+                if counts is not None:
+                    num_go_file, num_fun = counts
+
+        for owner, repo, manifest, shard_tasks in repo_shards:
+            dataset_path = self._dataset_path(owner, repo)
+            shard_paths = [tasks[t][3] for t in shard_tasks]
+            repo_entries = [task_entries[t] for t in shard_tasks]
+            if manifest is not None:
+                repo_entries = self._append_shards(dataset_path, manifest, shard_paths, repo_entries)
+                manifest.close()
+            else:
+                columnar.concat(shard_paths, dataset_path, self.row_group_size,
+                                self._keep_pair if self._dedup is not None else None)
+            if self._catalog is not None:
+                # the counts of the workers, before the merge dropped duplicates from columnar output
+                for entries in repo_entries:
+                    for pull_number, _, _, _, num_pairs in entries:
+                        self._catalog.record_extraction(owner, repo, pull_number, num_pairs, EXTRACTOR_VERSION)
+                self._catalog.flush()
+            for shard_path in shard_paths:
+                os.remove(shard_path)
+        os.rmdir(shard_dir)
+        self._finish_dedup()
+        return num_go_file, num_fun
+
+    def _append_shards(self, dataset_path, manifest, shard_paths, shard_entries):
+        # a pull at a time, so every pull gets its byte range in the manifest; returns the
+        # entries with the pairs that were kept
+        appended = []
+        with open(dataset_path, 'ab') as dataset_file:
+            for shard_path, entries in zip(shard_paths, shard_entries):
+                kept_entries = []
+                with open(shard_path, 'rb') as shard:
+                    for pull_number, base, head, length, num_pairs in entries:
+                        chunk = shard.read(length)
+                        if self._dedup is not None:
+                            lines = io.StringIO(chunk.decode('UTF-8'), newline='\n')
+                            kept = list(dedup.filter_pairs(lines, self._dedup))
+                            chunk = ''.join(kept).encode('UTF-8')
+                            num_pairs = len(kept) // 2
+                        start = dataset_file.tell()
+                        dataset_file.write(chunk)
+                        dataset_file.flush()
+                        manifest.record(pull_number, base, head, EXTRACTOR_VERSION, start, dataset_file.tell())
+                        kept_entries.append((pull_number, base, head, length, num_pairs))
+                appended.append(kept_entries)
+        return appended
+
+
+class _Fetched(object):
+    # runs fn right away, in place of a future of it
+    def __init__(self, fn, *args):
+        self._value = fn(*args)
+
+    def result(self):
+        return self._value
+
+
+_worker = None
+
+
+def _init_worker(kwargs):
+    global _worker
+    # a forked worker starts with a copy of the parent's counts, only its own are sent back
+    metrics.reset()
+    _worker = Writer(**kwargs)
+
+
+def _write_shard(task):
+    owner, repo, pull_numbers, shard_path = task
+    shard = _worker._open_dataset(shard_path)
+    try:
+        counts, entries = _worker._write_pulls(owner, repo, _worker._load_pulls(owner, repo, pull_numbers), shard)
+    finally:
+        shard.close()
+    if len(pull_numbers) > 1:
+        _worker._close_backend(owner, repo)
+    # the parent adds up the metrics of all tasks
+    snapshot = metrics.snapshot()
+    metrics.reset()
+    return counts, entries, snapshot
+
 
 def main():
     writer = Writer()
-    a,b=writer.writer(src_dir='./repos')
+    a,b=writer.writer(src_dir='./repos', processes=os.cpu_count() or 1)
     print(a,b)
+    metrics.save('./result/metrics-write')
 
 
 
@@ -0,0 +1,70 @@
+import collections
+import queue
+import threading
+
+
+# Building blocks for running the stages of a job side by side, joined by bounded queues:
+#   diffs = pipeline.ordered_map(executor, fetch_diff, pulls, window=16)
+#   extracted = pipeline.background((extract(d) for d in diffs), maxsize=8)
+# ordered_map runs a function over items on an executor, at most `window` at a time, and
+# yields the results in the order of the items. background iterates in a thread of its own
+# while the caller consumes, at most `maxsize` items ahead, so a slow consumer holds back the
+# producer instead of letting it fill memory. An error in a stage is raised in the consumer.
+
+_END = object()
+
+
+def ordered_map(executor, fn, items, window):
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # the consumer stopped early or a result raised
+        for future in pending:
+            future.cancel()
+
+
+def background(iterable, maxsize):
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        # gives up once the consumer is gone, a full queue would block forever
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except BaseException as e:
+            put((_END, e))
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = q.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
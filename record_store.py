@@ -0,0 +1,285 @@
+import gzip
+import json
+import os
+import threading
+import zlib
+import util
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Pulls pages, pulls and issues of one repo, appended to gzip compressed JSONL shards
+# instead of one pretty-printed file each:
+#   {dst_dir}/{owner}/{repo}/records/records-00000.jsonl.gz
+#   {dst_dir}/{owner}/{repo}/records/index.tsv
+# Records are compressed in blocks, every block a complete gzip member, so a shard is still
+# a valid .gz file (zcat works) and a record is read back by decompressing only its block.
+# index.tsv holds one "<kind>\t<key>\t<shard>\t<offset>\t<length>\t<line>" line per record;
+# a key written again is found at its latest position.
+
+store_dir_name = 'records'
+shard_name_template = 'records-{:05d}.jsonl.gz'
+index_name = 'index.tsv'
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('UTF-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _sort_key(key):
+    return (0, int(key), '') if key.isdigit() else (1, 0, key)
+
+
+class RecordStore(object):
+
+    def __init__(self, repo_dir, readonly=False, block_bytes=1024 * 1024, max_shard_bytes=256 * 1024 ** 2,
+                 compresslevel=6):
+        self.dir = os.path.join(repo_dir, store_dir_name)
+        self.readonly = readonly
+        self.block_bytes = block_bytes
+        self.max_shard_bytes = max_shard_bytes
+        self.compresslevel = compresslevel
+        self._lock = threading.Lock()
+        # (kind, key) -> (shard, offset, length, line)
+        self._index = {}
+        self._shard = 0
+        self._shard_end = 0
+        # records of the block being filled: (kind, key, line bytes)
+        self._block = []
+        self._block_size = 0
+        # the last block read, consecutive gets are mostly from the same one
+        self._cached_block = None
+        self._readers = {}
+        if not readonly:
+            os.makedirs(self.dir, exist_ok=True)
+        self._load()
+        self._out = None
+        self._index_file = None
+        if not readonly:
+            self._open_for_append()
+
+    @staticmethod
+    def exists(repo_dir):
+        return os.path.isfile(os.path.join(repo_dir, store_dir_name, index_name))
+
+    def _shard_path(self, shard):
+        return os.path.join(self.dir, shard_name_template.format(shard))
+
+    def _load(self):
+        path = os.path.join(self.dir, index_name)
+        if not os.path.isfile(path):
+            return
+        with open(path, 'r', encoding='UTF-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 6:
+                    continue
+                kind, key, shard, offset, length, n = parts
+                shard, offset, length = int(shard), int(offset), int(length)
+                self._index[(kind, key)] = (shard, offset, length, int(n))
+                if (shard, offset + length) > (self._shard, self._shard_end):
+                    self._shard, self._shard_end = shard, offset + length
+
+    def _open_for_append(self):
+        # a block written without its index lines (an interrupted run) is cut off
+        path = self._shard_path(self._shard)
+        self._out = open(path, 'ab')
+        if self._out.tell() > self._shard_end:
+            self._out.truncate(self._shard_end)
+            self._out.seek(self._shard_end)
+        self._index_file = open(os.path.join(self.dir, index_name), 'a', encoding='UTF-8')
+
+    def put(self, kind, key, obj):
+        line = dumps(obj) + b'\n'
+        with self._lock:
+            self._block.append((kind, str(key), line))
+            self._block_size += len(line)
+            if self._block_size >= self.block_bytes:
+                self._flush_block()
+
+    def flush(self):
+        # writes the records put so far; the crawler calls it before it journals a pull
+        with self._lock:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        if self._shard_end >= self.max_shard_bytes:
+            self._out.close()
+            self._shard += 1
+            self._shard_end = 0
+            self._out = open(self._shard_path(self._shard), 'ab')
+        data = gzip.compress(b''.join(line for _, _, line in self._block), self.compresslevel)
+        offset = self._shard_end
+        self._out.write(data)
+        self._out.flush()
+        entries = []
+        for n, (kind, key, _) in enumerate(self._block):
+            self._index[(kind, key)] = (self._shard, offset, len(data), n)
+            entries.append('{}\t{}\t{}\t{}\t{}\t{}\n'.format(kind, key, self._shard, offset, len(data), n))
+        self._index_file.write(''.join(entries))
+        self._index_file.flush()
+        self._shard_end = offset + len(data)
+        self._block = []
+        self._block_size = 0
+
+    def _read_block(self, shard, offset, length):
+        if self._cached_block is not None and self._cached_block[0] == (shard, offset):
+            return self._cached_block[1]
+        f = self._readers.get(shard)
+        if f is None:
+            f = open(self._shard_path(shard), 'rb')
+            self._readers[shard] = f
+        f.seek(offset)
+        lines = zlib.decompress(f.read(length), 16 + zlib.MAX_WBITS).split(b'\n')
+        self._cached_block = ((shard, offset), lines)
+        return lines
+
+    def get(self, kind, key, default=None):
+        key = str(key)
+        with self._lock:
+            for k, block_key, line in reversed(self._block):
+                if k == kind and block_key == key:
+                    return loads(line)
+            location = self._index.get((kind, key))
+            if location is None:
+                return default
+            shard, offset, length, n = location
+            return loads(self._read_block(shard, offset, length)[n])
+
+    def __contains__(self, kind_key):
+        kind, key = kind_key
+        key = str(key)
+        with self._lock:
+            return (kind, key) in self._index or any(k == kind and b == key for k, b, _ in self._block)
+
+    def keys(self, kind):
+        # numeric keys as sorted ints, others after them as strings
+        with self._lock:
+            keys = {key for k, key in self._index if k == kind}
+            keys.update(key for k, key, _ in self._block if k == kind)
+        return [int(k) if k.isdigit() else k for k in sorted(keys, key=_sort_key)]
+
+    def close(self):
+        with self._lock:
+            if not self.readonly:
+                self._flush_block()
+                self._out.close()
+                self._index_file.close()
+            for f in self._readers.values():
+                f.close()
+            self._readers = {}
+
+
+class FileStore(object):
+    # the one JSON file per record layout of util's path templates, same interface as RecordStore
+
+    def __init__(self, dst_dir, owner, repo):
+        self.dst_dir = dst_dir
+        self.owner = owner
+        self.repo = repo
+
+    def _path(self, kind, key):
+        f = dict(dst_dir=self.dst_dir, owner=self.owner, repo=self.repo)
+        if kind == 'pull':
+            return util.pull_path_template.format(pull_number=key, **f)
+        if kind == 'issue':
+            return util.issue_path_template.format(issue_number=key, **f)
+        if kind == 'pulls_page':
+            return util.pulls_path_template.format(page=key, **f)
+        if kind == 'pulls_since_page':
+            since, page = str(key).rsplit('-', 1)
+            return util.pulls_since_path_template.format(since=since, page=page, **f)
+        raise ValueError('unknown record kind {}'.format(kind))
+
+    def put(self, kind, key, obj):
+        util.save_json(obj, self._path(kind, key))
+
+    def get(self, kind, key, default=None):
+        path = self._path(kind, key)
+        return util.read_json(path) if os.path.isfile(path) else default
+
+    def __contains__(self, kind_key):
+        return os.path.isfile(self._path(*kind_key))
+
+    def keys(self, kind):
+        if kind != 'pull':
+            raise ValueError('FileStore only lists pulls')
+        return util.sorted_pull_numbers(self.dst_dir, self.owner, self.repo)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_store(storage, dst_dir, owner, repo, readonly=False):
+    # storage 'jsonl' (RecordStore), 'files' (FileStore) or 'auto', the store the repo has
+    repo_dir = util.repo_path_template.format(src_dir=dst_dir, owner=owner, repo=repo)
+    if storage == 'auto':
+        storage = 'jsonl' if RecordStore.exists(repo_dir) else 'files'
+    if storage == 'jsonl':
+        return RecordStore(repo_dir, readonly=readonly)
+    if storage == 'files':
+        return FileStore(dst_dir, owner, repo)
+    raise ValueError('unknown storage {}'.format(storage))
+
+
+def convert_repo(dst_dir, owner, repo, remove=False):
+    # moves the JSON files of a crawled repo into its record store; returns the record count
+    repo_dir = util.repo_path_template.format(src_dir=dst_dir, owner=owner, repo=repo)
+    store = RecordStore(repo_dir)
+    converted = []
+    try:
+        for name in sorted(os.listdir(repo_dir)):
+            if not name.endswith('.json'):
+                continue
+            stem = name[:-len('.json')]
+            if stem.startswith('pull-'):
+                kind, key = 'pull', stem[len('pull-'):]
+            elif stem.startswith('issue-'):
+                kind, key = 'issue', stem[len('issue-'):]
+            elif stem.startswith('pulls-page-'):
+                kind, key = 'pulls_page', stem[len('pulls-page-'):]
+            elif stem.startswith('pulls-since-'):
+                since, page = stem[len('pulls-since-'):].split('-page-')
+                kind, key = 'pulls_since_page', '{}-{}'.format(since, page)
+            else:
+                continue
+            path = os.path.join(repo_dir, name)
+            store.put(kind, key, util.read_json(path))
+            converted.append(path)
+    finally:
+        store.close()
+    if remove:
+        for path in converted:
+            os.remove(path)
+    return len(converted)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='convert a crawled repos/ tree to compressed record stores')
+    parser.add_argument('dst_dir', nargs='?', default='repos')
+    parser.add_argument('--remove', action='store_true', help='delete the JSON files once they are stored')
+    args = parser.parse_args()
+    for owner, repo in util.sorted_owner_repo_pairs(args.dst_dir):
+        n = convert_repo(args.dst_dir, owner, repo, remove=args.remove)
+        print('{}/{}: {:,} records'.format(owner, repo, n))
+
+
+if __name__ == '__main__':
+    main()
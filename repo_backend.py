@@ -0,0 +1,141 @@
+import io
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import util
+
+
+# Both backends give the Writer the same two things for a pull:
+#   diff_lines(pull, save_path=None)
+#                             an iterator over the lines of the pull's diff, like diff_url returns
+#                             them; a downloaded diff is kept at save_path for later runs
+#   file_content(sha, path)   the raw file at a commit as bytes, None when it is not there
+
+
+class HttpBackend(object):
+
+    def __init__(self, scheduler, owner, repo):
+        self._scheduler = scheduler
+        self.owner = owner
+        self.repo = repo
+
+    def diff_lines(self, pull, save_path=None):
+        # streamed to disk and read back line by line, large diffs are never held in memory
+        if save_path is not None:
+            path = save_path
+        else:
+            fd, path = tempfile.mkstemp(suffix='.diff')
+            os.close(fd)
+        try:
+            r = self._scheduler.download(pull['diff_url'], path)
+            if not r.ok:
+                return
+            with open(path, 'r', encoding='UTF-8', errors='replace') as f:
+                for line in f:
+                    yield line
+        finally:
+            if save_path is None and os.path.exists(path):
+                os.remove(path)
+
+    def file_content(self, sha, path):
+        url = util.raw_file_url_template.format(owner=self.owner, repo=self.repo, sha=sha,
+                                                filename=path.replace('/', '%2F'))
+        # the blob store keeps raw files, so they are not cached a second time
+        r = self._scheduler.get(url, immutable=True, use_cache=False)
+        return r.content if r.ok else None
+
+    def close(self):
+        pass
+
+
+class GitBackend(object):
+    # Reads a local bare clone. Pull heads are not fetched by a plain clone, so create it with
+    #   git clone --bare https://github.com/{owner}/{repo}.git {repo}.git
+    #   git -C {repo}.git fetch origin '+refs/pull/*/head:refs/pull/*/head'
+    # Blobs are read through one long-lived `git cat-file --batch` process.
+
+    def __init__(self, git_dir, fallback=None):
+        self.git_dir = git_dir
+        # used for objects missing from the clone, None to stay offline
+        self._fallback = fallback
+        self._lock = threading.Lock()
+        self._cat_file = None
+
+    def _git(self, *args):
+        return ['git', '--git-dir', self.git_dir] + list(args)
+
+    def _batch(self):
+        if self._cat_file is None or self._cat_file.poll() is not None:
+            self._cat_file = subprocess.Popen(self._git('cat-file', '--batch'),
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self._cat_file
+
+    def _read_object(self, spec):
+        with self._lock:
+            p = self._batch()
+            p.stdin.write(spec.encode('UTF-8') + b'\n')
+            p.stdin.flush()
+            header = p.stdout.readline().rstrip(b'\n')
+            # "<oid> <type> <size>", or "<spec> missing" / "<spec> ambiguous", the spec's path
+            # can hold spaces
+            if header.endswith((b' missing', b' ambiguous')):
+                return None
+            header = header.rsplit(b' ', 2)
+            size = int(header[2])
+            content = p.stdout.read(size)
+            p.stdout.read(1)
+            if header[1] != b'blob':
+                return None
+            return content
+
+    def diff_lines(self, pull, save_path=None):
+        # the three-dot diff is what GitHub serves as a pull's diff_url
+        base = pull['base']['sha']
+        head = pull['head']['sha']
+        # a failed diff prints nothing, so check first that both commits are in the clone
+        r = subprocess.run(self._git('cat-file', '-e', base + '^{commit}'), stderr=subprocess.DEVNULL)
+        if r.returncode == 0:
+            r = subprocess.run(self._git('cat-file', '-e', head + '^{commit}'), stderr=subprocess.DEVNULL)
+        if r.returncode != 0:
+            logging.error('GitBackend: missing commits: {} {}...{}'.format(self.git_dir, base, head))
+            if self._fallback is not None:
+                for line in self._fallback.diff_lines(pull, save_path):
+                    yield line
+            return
+        p = subprocess.Popen(self._git('diff', '--no-color', '--no-ext-diff', '{}...{}'.format(base, head)),
+                             stdout=subprocess.PIPE)
+        try:
+            for line in io.TextIOWrapper(p.stdout, encoding='UTF-8', errors='replace'):
+                yield line
+        finally:
+            p.stdout.close()
+            p.wait()
+
+    def file_content(self, sha, path):
+        content = self._read_object('{}:{}'.format(sha, path))
+        if content is None and self._fallback is not None:
+            return self._fallback.file_content(sha, path)
+        return content
+
+    def close(self):
+        with self._lock:
+            if self._cat_file is not None:
+                self._cat_file.stdin.close()
+                self._cat_file.wait()
+                self._cat_file = None
+        if self._fallback is not None:
+            self._fallback.close()
+
+
+def open_backend(kind, scheduler, owner, repo, git_repos_dir=None, offline=False):
+    http = HttpBackend(scheduler, owner, repo)
+    if kind == 'http':
+        return http
+    if kind == 'git':
+        git_dir = util.git_clone_path_template.format(git_repos_dir=git_repos_dir, owner=owner, repo=repo)
+        if not os.path.isdir(git_dir):
+            raise ValueError('no local clone of {}/{} at {}'.format(owner, repo, git_dir))
+        return GitBackend(git_dir, fallback=None if offline else http)
+    raise ValueError('unknown backend {}'.format(kind))
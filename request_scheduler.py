@@ -0,0 +1,295 @@
+import logging
+import os
+import random
+import threading
+import time
+import requests
+import util
+from urllib.parse import urlparse
+from http_cache import CachedResponse, HttpCache
+from metrics import registry as metrics
+
+
+def request_kind(url):
+    # the metrics label of a request
+    if '/graphql' in url:
+        return 'graphql'
+    if '/raw/' in url:
+        return 'raw_file'
+    if url.endswith('.diff'):
+        return 'diff'
+    if '/issues/' in url:
+        return 'issue'
+    if '/pulls?' in url:
+        return 'pulls_page'
+    if '/pulls/' in url:
+        return 'pull'
+    return 'other'
+
+
+class TokenState(object):
+
+    def __init__(self, token):
+        self.token = token
+        self.limit = None
+        self.remaining = None
+        self.reset = 0
+        # set after a rate limit response, the token is skipped until then
+        self.blocked_until = 0
+
+    def available_at(self, now):
+        if self.remaining == 0 and self.reset > now:
+            return max(self.reset, self.blocked_until)
+        return self.blocked_until
+
+    def score(self):
+        # unknown quota first, then the fullest token
+        return float('inf') if self.remaining is None else self.remaining
+
+
+class HostBreaker(object):
+    # closed -> open after `threshold` consecutive failures, one trial request after the cooldown
+
+    def __init__(self, threshold, cooldown_secs, max_cooldown_secs):
+        self.threshold = threshold
+        self.base_cooldown_secs = cooldown_secs
+        self.cooldown_secs = cooldown_secs
+        self.max_cooldown_secs = max_cooldown_secs
+        self.failures = 0
+        self.open_until = 0
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0
+        self.cooldown_secs = self.base_cooldown_secs
+
+    def record_failure(self, now):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.open_until:
+                # the trial request failed too
+                self.cooldown_secs = min(self.cooldown_secs * 2, self.max_cooldown_secs)
+            self.open_until = now + self.cooldown_secs
+            return True
+        return False
+
+
+class RequestScheduler(object):
+
+    def __init__(self,
+                 tokens=None,
+                 cache=None,
+                 max_request_tries=5000,
+                 request_retry_wait_secs=10,
+                 max_backoff_secs=600,
+                 reserve_fraction=0.1,
+                 breaker_threshold=5,
+                 breaker_cooldown_secs=60,
+                 max_breaker_cooldown_secs=1800):
+        if not tokens:
+            tokens = [None]
+        self._token_values = tokens
+        # GitHub keeps a separate quota per resource (core, graphql, search)
+        self._pools = {}
+        self.cache = cache if cache is not None else HttpCache()
+        self.max_request_tries = max_request_tries
+        self.request_retry_wait_secs = request_retry_wait_secs
+        self.max_backoff_secs = max_backoff_secs
+        # below this share of its limit a token is paced over the time left until reset
+        self.reserve_fraction = reserve_fraction
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown_secs = breaker_cooldown_secs
+        self.max_breaker_cooldown_secs = max_breaker_cooldown_secs
+        self._breakers = {}
+        self._lock = threading.Lock()
+        # requests sent over the network, retries included; crawl_queue spends its budget from it
+        self.num_sent = 0
+        self._headers = {
+            'Accept': 'application/vnd.github.v3+json',
+        }
+
+    def _backoff_secs(self, failures):
+        # exponential backoff with full jitter
+        cap = min(self.max_backoff_secs, self.request_retry_wait_secs * 2 ** (failures - 1))
+        return random.uniform(0, cap)
+
+    def _pool(self, resource):
+        pool = self._pools.get(resource)
+        if pool is None:
+            pool = [TokenState(t) for t in self._token_values]
+            self._pools[resource] = pool
+        return pool
+
+    def _acquire_token(self, resource):
+        # the token that can send soonest, fullest first; a token near its reserve is paced
+        # over the time left until its reset, an exhausted one waits for the reset
+        with self._lock:
+            now = time.time()
+            t = min(self._pool(resource), key=lambda s: (self._next_slot(s, now), -s.score()))
+            wait = self._next_slot(t, now) - now
+            if t.remaining is not None and t.remaining > 0:
+                # reserve the request so concurrent callers spread over the pool
+                t.remaining -= 1
+        if wait > 0:
+            if wait > 60:
+                logging.info('Scheduler: rate limit, waiting {} secs'.format(int(wait)))
+                print('Rate limit reached on all tokens, waiting {} secs for reset'.format(int(wait)))
+            time.sleep(wait)
+            metrics.inc('ghpr_rate_limit_sleep_seconds_total', wait, resource=resource)
+        return t
+
+    def _next_slot(self, t, now):
+        start = max(t.available_at(now), now)
+        if t.limit is None or t.remaining is None or t.reset <= start:
+            return start
+        if t.remaining > t.limit * self.reserve_fraction:
+            return start
+        return start + (t.reset - start) / max(t.remaining, 1)
+
+    def _update_quota(self, t, headers):
+        if 'X-Ratelimit-Remaining' not in headers:
+            return
+        with self._lock:
+            try:
+                t.remaining = int(headers['X-Ratelimit-Remaining'])
+                t.limit = int(headers.get('X-Ratelimit-Limit', t.limit or 0)) or None
+                t.reset = int(headers.get('X-Ratelimit-Reset', t.reset))
+            except ValueError:
+                pass
+
+    def _breaker(self, host):
+        with self._lock:
+            b = self._breakers.get(host)
+            if b is None:
+                b = HostBreaker(self.breaker_threshold, self.breaker_cooldown_secs, self.max_breaker_cooldown_secs)
+                self._breakers[host] = b
+            return b
+
+    def _wait_breaker(self, breaker, host):
+        wait = breaker.open_until - time.time()
+        if wait > 0:
+            logging.info('Scheduler: {} is down, waiting {} secs'.format(host, int(wait)))
+            print('Host {} is failing, retrying in {} secs'.format(host, int(wait)))
+            time.sleep(wait)
+            metrics.inc('ghpr_breaker_sleep_seconds_total', wait, host=host)
+
+    def _is_rate_limited(self, t, r, now):
+        if r.status_code not in (403, 429):
+            return False
+        retry_after = r.headers.get('Retry-After')
+        if retry_after is not None or b'secondary rate limit' in r.content:
+            # secondary (abuse) limit, GitHub asks for at least a minute when no Retry-After is sent
+            wait = int(retry_after) if retry_after and retry_after.isdigit() else 60
+            with self._lock:
+                t.blocked_until = now + wait
+            logging.info('Scheduler: secondary rate limit, token paused {} secs'.format(wait))
+            return True
+        if r.headers.get('X-Ratelimit-Remaining') == '0':
+            with self._lock:
+                t.remaining = 0
+                t.blocked_until = t.reset
+            logging.info('Scheduler: token exhausted until {}'.format(t.reset))
+            return True
+        return False
+
+    def _send(self, method, url, t, immutable, json_body, use_cache, stream_to):
+        headers = dict(self._headers)
+        if t.token is not None:
+            headers['Authorization'] = 'token ' + t.token
+        if stream_to is not None:
+            return self._download(url, headers, stream_to)
+        if method == 'GET' and use_cache:
+            return self.cache.get(url, headers=headers, immutable=immutable)
+        r = self.cache.session.request(method, url, headers=headers, json=json_body)
+        return CachedResponse(url, r.status_code, r.headers, r.content)
+
+    def _download(self, url, headers, path):
+        r = self.cache.session.get(url, headers=headers, stream=True)
+        if r.status_code != 200:
+            return CachedResponse(url, r.status_code, r.headers, r.content)
+        tmp = path + '.part'
+        with open(tmp, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+        os.replace(tmp, path)
+        return CachedResponse(url, r.status_code, r.headers, b'')
+
+    def request(self, method, url, immutable=None, json_body=None, resource='core', use_cache=True, stream_to=None):
+        # returns the response, retrying rate limits, connection errors and 5xx;
+        # other client errors are returned to the caller.
+        # with stream_to the body is written to that path instead of being kept in memory
+        kind = request_kind(url)
+        if method == 'GET' and use_cache and stream_to is None:
+            # immutable hits cost no quota and need no token
+            r = self.cache.cached(url, immutable)
+            if r is not None:
+                metrics.inc('ghpr_requests_total', kind=kind, status='cached')
+                return r
+        host = urlparse(url).netloc
+        breaker = self._breaker(host)
+        failures = 0
+        while True:
+            self._wait_breaker(breaker, host)
+            t = self._acquire_token(resource)
+            with self._lock:
+                self.num_sent += 1
+            start = time.perf_counter()
+            try:
+                r = self._send(method, url, t, immutable, json_body, use_cache, stream_to)
+            except requests.RequestException as e:
+                logging.error('Get: exception: {} {}'.format(url, e))
+                r = None
+            metrics.observe('ghpr_request_seconds', time.perf_counter() - start, kind=kind)
+            now = time.time()
+            if r is not None:
+                metrics.inc('ghpr_requests_total', kind=kind, status=str(r.status_code))
+                self._update_quota(t, r.headers)
+                if r.ok:
+                    breaker.record_success()
+                    if stream_to is not None:
+                        metrics.inc('ghpr_bytes_received_total', os.path.getsize(stream_to), kind=kind)
+                    elif not getattr(r, 'from_cache', False):
+                        metrics.inc('ghpr_bytes_received_total', len(r.content), kind=kind)
+                    return r
+                if self._is_rate_limited(t, r, now):
+                    metrics.inc('ghpr_rate_limited_total', kind=kind)
+                    continue
+                logging.error('Get: not ok: {} {}'.format(url, r.status_code))
+                if r.status_code < 500:
+                    breaker.record_success()
+                    return r
+            else:
+                metrics.inc('ghpr_requests_total', kind=kind, status='error')
+
+            failures += 1
+            if breaker.record_failure(now):
+                logging.error('Scheduler: circuit open for {} after {} failures'.format(host, breaker.failures))
+            if failures >= self.max_request_tries:
+                print('Request failed {} times, aborting'.format(failures))
+                raise util.TooManyRequestFailures('{} request failures for {}'.format(failures, url))
+            wait = self._backoff_secs(failures)
+            print('Request failed {} times, retrying in {:.1f} seconds'.format(failures, wait))
+            time.sleep(wait)
+            metrics.inc('ghpr_request_retries_total', kind=kind)
+            metrics.inc('ghpr_backoff_sleep_seconds_total', wait, kind=kind)
+
+    def get(self, url, immutable=None, use_cache=True):
+        return self.request('GET', url, immutable=immutable, use_cache=use_cache)
+
+    def download(self, url, path):
+        return self.request('GET', url, use_cache=False, stream_to=path)
+
+    def get_json(self, url):
+        return self._json(self.get(url), url)
+
+    def post_json(self, url, body, resource='core'):
+        return self._json(self.request('POST', url, json_body=body, resource=resource), url)
+
+    def _json(self, r, url):
+        if not r.ok:
+            raise util.RequestFailed('{} {}'.format(r.status_code, url))
+        rj = r.json()
+        if isinstance(rj, dict) and 'message' in rj:
+            raise util.RequestFailed('{} {}'.format(rj['message'], url))
+        return rj
+
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# A tiny stand-in for api.github.com and github.com used by the tests: it serves whatever
+# is put in routes (path with query -> body) and answers If-None-Match with a 304
+
+
+class FakeGitHub(object):
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests.append(self.path)
+                    body = fake.routes.get(self.path)
+                if body is None:
+                    return self._send(404, b'{"message": "Not Found"}', {})
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('UTF-8') if not isinstance(body, str) else body.encode('UTF-8')
+                etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, b'', {'ETag': etag})
+                self._send(200, body, {'ETag': etag})
+
+            def _send(self, status, body, headers):
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/'.format(self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def point_util_at(module, url):
+    # rewrites every github url template of module to url, returns a function that undoes it
+    saved = {}
+    for name in dir(module):
+        value = getattr(module, name)
+        if isinstance(value, str) and value.startswith(('https://api.github.com/', 'https://github.com/')):
+            saved[name] = value
+            prefix = 'https://api.github.com/' if value.startswith('https://api.github.com/') else 'https://github.com/'
+            setattr(module, name, url + ('api/' if prefix.startswith('https://api') else 'web/') + value[len(prefix):])
+
+    def restore():
+        for name, value in saved.items():
+            setattr(module, name, value)
+    return restore
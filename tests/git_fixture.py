@@ -0,0 +1,49 @@
+import os
+import subprocess
+
+
+# A throwaway go repository for the writer tests: a base commit and one commit per pull,
+# each changing one line of one function, cloned bare to {dir}/clones/{owner}/{repo}.git
+
+
+def git(cwd, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME='t', GIT_AUTHOR_EMAIL='t@t', GIT_COMMITTER_NAME='t',
+               GIT_COMMITTER_EMAIL='t@t')
+    return subprocess.run(['git'] + list(args), cwd=cwd, env=env, check=True, stdout=subprocess.PIPE).stdout
+
+
+def go_source(values):
+    lines = ['package p', '']
+    for i, v in enumerate(values):
+        lines += ['func F{}(x int) int {{'.format(i), '\ta := x + {}'.format(i), '\tb := a * 2',
+                  '\tc := b - 1', '\treturn a + {}'.format(v), '}', '']
+    return '\n'.join(lines)
+
+
+def make_repo(root, owner='o', repo='r', num_pulls=4, num_functions=6):
+    # returns the pulls as the crawler saves them, with their base and head shas
+    work = os.path.join(root, 'work')
+    os.makedirs(work)
+    git(work, 'init', '-q')
+    os.mkdir(os.path.join(work, 'pkg'))
+    values = list(range(num_functions))
+
+    def commit(message):
+        with open(os.path.join(work, 'pkg', 'a.go'), 'w') as f:
+            f.write(go_source(values))
+        git(work, 'add', '-A')
+        git(work, 'commit', '-q', '-m', message)
+        return git(work, 'rev-parse', 'HEAD').decode().strip()
+
+    sha = commit('base')
+    pulls = []
+    for n in range(1, num_pulls + 1):
+        values[(n * 5) % num_functions] += 100
+        head = commit('fix {}'.format(n))
+        pulls.append({'number': n, 'title': 'fix {}'.format(n), 'state': 'closed',
+                      'merged_at': '2021-01-01T00:00:00Z', 'base': {'sha': sha}, 'head': {'sha': head}})
+        sha = head
+    git_dir = os.path.join(root, 'clones', owner, repo + '.git')
+    os.makedirs(os.path.dirname(git_dir))
+    git(root, 'clone', '-q', '--bare', work, git_dir)
+    return pulls
@@ -0,0 +1,52 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark
+import util
+
+
+def _without_urls(dataset):
+    # raw file urls carry the stand-in's port
+    return [line.split(b'<CODESPLIT>')[2:] for line in dataset.split(b'\n')]
+
+
+class BenchmarkTest(unittest.TestCase):
+    # small crawl -> write -> split runs against the stand-in
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-bench-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_benchmark(self, name, **kwargs):
+        work_dir = os.path.join(self.tmp, name)
+        os.mkdir(work_dir)
+        report = benchmark.run(num_pulls=80, per_page=20, concurrency=4, work_dir=work_dir, **kwargs)
+        with open(os.path.join(work_dir, util.ghpr_path_template.format(owner='bench', repo='repo')), 'rb') as f:
+            return report, f.read()
+
+    def test_run(self):
+        report, dataset = self.run_benchmark('clean')
+        repo = benchmark.FakeRepo(num_pulls=80)
+        num_go = sum(1 for p in repo.pulls if p['is_go'])
+        self.assertEqual(report['defect_go_pulls'], num_go)
+        self.assertEqual(report['function_pairs'], num_go)
+        self.assertEqual(dataset.count(b'\n'), 2 * num_go)
+        self.assertEqual(report['injected_errors'], 0)
+        # the host is restored after the run
+        self.assertEqual(util.base_url, 'https://api.github.com/')
+
+    def test_injected_errors_do_not_change_the_output(self):
+        _, dataset = self.run_benchmark('clean')
+        report, with_errors = self.run_benchmark('errors', error_rate=0.1)
+        self.assertGreater(report['injected_errors'], 0)
+        self.assertEqual(_without_urls(dataset), _without_urls(with_errors))
+
+
+if __name__ == '__main__':
+    unittest.main()
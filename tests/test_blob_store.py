@@ -0,0 +1,95 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from blob_store import Blob, BlobStore, git_blob_id
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fetches = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def fetch(self, content):
+        def f():
+            self.fetches.append(content)
+            return content
+        return f
+
+    def test_blob_id_matches_git(self):
+        content = b'package a\n\nfunc A() {}\n'
+        path = os.path.join(self.tmp, 'a.go')
+        with open(path, 'wb') as f:
+            f.write(content)
+        out = subprocess.check_output(['git', 'hash-object', path]).decode().strip()
+        self.assertEqual(git_blob_id(content), out)
+
+    def test_same_content_is_stored_once(self):
+        store = BlobStore(self.tmp)
+        self.assertEqual(store.get('1' * 40, 'a.go', self.fetch(b'x\n')), b'x\n')
+        self.assertEqual(store.get('2' * 40, 'b.go', self.fetch(b'x\n')), b'x\n')
+        self.assertEqual(store.get('1' * 40, 'a.go', self.fetch(b'other')), b'x\n')
+        self.assertEqual(self.fetches, [b'x\n', b'x\n'])
+        self.assertEqual((store.num_hits, store.num_misses, store.num_deduplicated), (1, 2, 1))
+        objects = [f for _, _, files in os.walk(os.path.join(self.tmp, 'objects')) for f in files]
+        self.assertEqual(len(objects), 1)
+
+    def test_reopened_store_and_abbreviated_blob_id(self):
+        store = BlobStore(self.tmp)
+        store.get('1' * 40, 'a.go', self.fetch(b'x\n'))
+        store.close()
+
+        store = BlobStore(self.tmp)
+        self.assertEqual(store.get('1' * 40, 'a.go', self.fetch(b'other')), b'x\n')
+        # an unknown sha is found by the blob id from a diff "index" line
+        blob_id = git_blob_id(b'x\n')
+        self.assertEqual(store.get('3' * 40, 'c.go', self.fetch(b'other'), blob_id=blob_id[:7]), b'x\n')
+        self.assertEqual(self.fetches, [b'x\n'])
+        self.assertIsNone(store.find(blob_id[:6]))
+
+    def test_failed_fetch_is_not_stored(self):
+        store = BlobStore(self.tmp)
+        self.assertIsNone(store.get('1' * 40, 'a.go', self.fetch(None)))
+        self.assertEqual(store.get('1' * 40, 'a.go', self.fetch(b'x\n')), b'x\n')
+        self.assertEqual(store.num_misses, 2)
+
+    def test_open_maps_the_stored_blob(self):
+        store = BlobStore(self.tmp)
+        content = b'package a\n\nfunc A() { // x\n\treturn\n}\n'
+        blob = store.open('1' * 40, 'a.go', self.fetch(content))
+        self.assertEqual(bytes(blob.data), content)
+        self.assertEqual(blob.blob_id, git_blob_id(content))
+        self.assertEqual(store.open('1' * 40, 'a.go', self.fetch(b'other')).blob_id, blob.blob_id)
+        self.assertEqual(self.fetches, [content])
+        self.assertIsNone(store.open('2' * 40, 'b.go', self.fetch(None)))
+        # an empty file cannot be mapped but still opens
+        self.assertEqual(store.open('3' * 40, 'c.go', self.fetch(b'')).num_lines(), 1)
+
+
+class BlobTest(unittest.TestCase):
+
+    def test_lines_are_those_of_split(self):
+        for content in (b'', b'a', b'a\n', b'a\n\nb', b'\n\n', b'x\r\ny\r\n'):
+            blob = Blob(content)
+            lines = content.split(b'\n')
+            self.assertEqual(blob.num_lines(), len(lines))
+            self.assertEqual([bytes(blob.line(i)) for i in range(blob.num_lines())], lines)
+
+    def test_join_lines(self):
+        blob = Blob('func F() {\n\t// note\n\tx := "\u00e9"\n}\n'.encode('UTF-8'))
+        self.assertEqual(blob.join_lines(0, 3), 'func F() {\t// note\tx := "\u00e9"}')
+        self.assertEqual(blob.join_lines(0, 3, skip=b'//'), 'func F() {\tx := "\u00e9"}')
+        # past the last line
+        self.assertEqual(blob.join_lines(3, 10), '}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import record_store
+from catalog import Catalog, catalog_path
+from my_writer import Writer
+
+
+def _pull(number):
+    return {'number': number, 'title': 'fix {}'.format(number), 'merged_at': '2022-01-01T00:00:00Z',
+            'base': {'sha': 'b{}'.format(number)}, 'head': {'sha': 'h{}'.format(number)},
+            'labels': [{'name': 'bug'}], 'linked_issue_numbers': [number], 'num_modi_go': 1}
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='ghpr-test-catalog-')
+        self.catalog = Catalog(os.path.join(self.dir, 'c.sqlite3'), batch_size=2)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.dir)
+
+    def test_crawled_again_from_other_shas_is_written_again(self):
+        for n in (1, 2):
+            self.catalog.put('o', 'r', _pull(n))
+        self.catalog.record_extraction('o', 'r', 1, 3, 1)
+        self.catalog.record_extraction('o', 'r', 2, 0, 1)
+        self.assertEqual(self.catalog.written_repos(), [('o', 'r')])
+
+        self.catalog.put('o', 'r', _pull(1))
+        moved = _pull(2)
+        moved['head']['sha'] = 'h2-rebased'
+        self.catalog.put('o', 'r', moved)
+        status = {p['number']: p['status'] for p in self.catalog.query_pulls(owner='o', repo='r')}
+        self.assertEqual(status, {1: 'written', 2: 'crawled'})
+        self.assertEqual(self.catalog.pull_shas('o', 'r'), {1: ('b1', 'h1'), 2: ('b2', 'h2-rebased')})
+
+    def test_query_pulls(self):
+        p = _pull(1)
+        p['labels'] = [{'name': 'docs'}]
+        self.catalog.put('o', 'r', p)
+        p = _pull(2)
+        p['merged_at'] = '2021-06-01T00:00:00Z'
+        self.catalog.put('o', 'r', p)
+        self.catalog.put('a', 'b', _pull(3))
+        self.catalog.flush()
+
+        numbers = lambda **kw: [p['number'] for p in self.catalog.query_pulls(**kw)]
+        self.assertEqual(numbers(), [3, 1, 2])
+        self.assertEqual(numbers(label='bug'), [3, 2])
+        self.assertEqual(numbers(merged_from='2022-01-01', owner='o'), [1])
+        self.assertEqual(numbers(merged_to='2022-01-01'), [2])
+        self.assertEqual(self.catalog.repos(), [('a', 'b'), ('o', 'r')])
+        row = self.catalog.query_pulls(repo='b')[0]
+        self.assertEqual((row['linked_issues'], row['num_go_files'], row['status']), ('3', 1, 'crawled'))
+
+    def test_sync_repo(self):
+        store = record_store.open_store('jsonl', self.dir, 'o', 'r')
+        for n in (1, 2, 3):
+            store.put('pull', n, _pull(n))
+        store.flush()
+        self.catalog.put('o', 'r', _pull(2))
+        self.assertEqual(self.catalog.sync_repo('o', 'r', store), 2)
+        self.assertEqual(self.catalog.pull_numbers('o', 'r'), [1, 2, 3])
+        store.close()
+
+
+    def test_path_is_next_to_the_crawl_directory(self):
+        self.assertEqual(catalog_path(os.path.join(self.dir, 'repos') + os.sep),
+                         os.path.join(self.dir, 'repos.catalog.sqlite3'))
+
+    def test_forget_repo(self):
+        for n in (1, 2):
+            self.catalog.put('o', 'r', _pull(n))
+        self.catalog.put('o', 's', _pull(3))
+        self.catalog.forget_repo('o', 'r')
+        self.assertEqual(self.catalog.pull_numbers('o', 'r'), [])
+        self.assertEqual([p['number'] for p in self.catalog.query_pulls(label='bug')], [3])
+
+    def test_writer_skips_pulls_missing_from_the_store(self):
+        dst_dir = os.path.join(self.dir, 'repos')
+        store = record_store.open_store('jsonl', dst_dir, 'o', 'r')
+        store.put('pull', 1, _pull(1))
+        store.close()
+        writer = Writer(tokens=[], dst_dir=dst_dir, cache_dir=os.path.join(self.dir, 'cache'),
+                        blob_dir=os.path.join(self.dir, 'blobs'))
+        self.assertIsNone(writer._catalog)
+        self.assertEqual([p['number'] for p in writer._load_pulls('o', 'r', [1, 2])], [1])
+        writer._close_backend('o', 'r')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import columnar
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def _row(i):
+    return dict(label=i % 2, url='u{}'.format(i), function_name='F{}'.format(i), title='fix\n{}'.format(i),
+                code='x := {}'.format(i), owner='o', repo='r', pull_number=i // 2, base_sha='b', head_sha='h')
+
+
+@unittest.skipIf(pyarrow is None, 'needs pyarrow')
+class ColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-columnar-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, rows):
+        path = os.path.join(self.tmp, name)
+        w = columnar.ColumnarWriter(path, row_group_size=4)
+        for row in rows:
+            w.write_row(**row)
+        w.close()
+        return path
+
+    def test_round_trip(self):
+        rows = [_row(i) for i in range(10)]
+        for fmt in columnar.formats:
+            path = self.write('d.' + fmt, rows)
+            self.assertEqual(columnar.read_dataset(path).to_pylist(), rows)
+            self.assertEqual(columnar.read_dataset(path, columns=['code']).column_names, ['code'])
+            batches = list(columnar.iter_batches(path, columns=['label', 'code'], batch_size=4))
+            self.assertEqual([b.num_rows for b in batches], [4, 4, 2])
+
+    def test_concat_keeps_order(self):
+        first = self.write('a.parquet', [_row(i) for i in range(3)])
+        second = self.write('b.parquet', [_row(i) for i in range(3, 7)])
+        out = os.path.join(self.tmp, 'all.arrow')
+        self.assertEqual(columnar.concat([first, second], out), 7)
+        self.assertEqual(columnar.read_dataset(out).column('url').to_pylist(), ['u{}'.format(i) for i in range(7)])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            columnar.format_of('d.csv')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import record_store
+import util
+from benchmark import FakeRepo, StandIn
+from crawl_queue import MultiRepoCrawler, read_repo_list
+from http_cache import HttpCache
+from my_crawler import Crawler
+from request_scheduler import RequestScheduler
+
+
+class MultiRepoCrawlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-queue-')
+        self.repos = [FakeRepo('a', 'x', num_pulls=35, seed=1), FakeRepo('b', 'y', num_pulls=52, seed=2)]
+        self.stand_in = StandIn(self.repos).start()
+        util.use_github_host(self.stand_in.api_url, self.stand_in.web_url)
+
+    def tearDown(self):
+        util.use_github_host('https://api.github.com/', 'https://github.com/')
+        self.stand_in.stop()
+        shutil.rmtree(self.tmp)
+
+    def crawler(self, name):
+        scheduler = RequestScheduler(['t'], HttpCache(os.path.join(self.tmp, name + '.cache')),
+                                     request_retry_wait_secs=0.01, max_backoff_secs=0.1)
+        return Crawler(dst_dir=os.path.join(self.tmp, name), per_page=10, concurrency=4, scheduler=scheduler,
+                       catalog_path=os.path.join(self.tmp, name + '.sqlite3'))
+
+    def records(self, name):
+        out = {}
+        for r in self.repos:
+            store = record_store.open_store('auto', os.path.join(self.tmp, name), r.owner, r.repo, readonly=True)
+            for kind in ('pull', 'issue'):
+                out.update(((r.repo, kind, k), store.get(kind, k)) for k in store.keys(kind))
+            store.close()
+        return out
+
+    def test_same_records_as_one_crawl_per_repo(self):
+        serial = self.crawler('serial')
+        for r in self.repos:
+            serial.crawl(r.owner, r.repo)
+        status = MultiRepoCrawler(self.crawler('queue'), workers=6).run(['a/x', 'b/y'])
+        self.assertEqual(status, {'a/x': 'finished', 'b/y': 'finished'})
+        records = self.records('serial')
+        self.assertEqual(len([k for k in records if k[1] == 'pull']),
+                         sum(1 for r in self.repos for p in r.pulls if p['is_go']))
+        self.assertEqual(records, self.records('queue'))
+
+    def test_budget_stops_and_the_journal_resumes(self):
+        status = MultiRepoCrawler(self.crawler('queue'), workers=2, budget=8).run(['a/x', 'b/y'])
+        self.assertEqual(status, {'a/x': 'stopped', 'b/y': 'stopped'})
+        status = MultiRepoCrawler(self.crawler('queue'), workers=2).run(['a/x', 'b/y'])
+        self.assertEqual(status, {'a/x': 'finished', 'b/y': 'finished'})
+
+        serial = self.crawler('serial')
+        for r in self.repos:
+            serial.crawl(r.owner, r.repo)
+        self.assertEqual(self.records('serial'), self.records('queue'))
+
+    def test_read_repo_list(self):
+        path = os.path.join(self.tmp, 'repos.txt')
+        with open(path, 'w') as f:
+            f.write('# go repos\na/x\n\n  b/y  # the big one\n')
+        self.assertEqual(read_repo_list(path), ['a/x', 'b/y'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import record_store
+import util
+from fake_github import FakeGitHub, point_util_at
+from my_crawler import Crawler
+
+
+def _pull(url, n, is_defect):
+    return {
+        'number': n,
+        'state': 'closed',
+        'merged_at': '2021-06-01T00:00:00Z' if n != 4 else None,
+        'labels': [],
+        'title': 'change {}'.format(n),
+        'body': 'fixes #{}'.format(n) if is_defect else 'refactor',
+        'closed_at': '2021-06-01T00:00:00Z',
+        'updated_at': '2021-06-01T00:00:00Z',
+        'base': {'sha': 'b{}'.format(n)},
+        'head': {'sha': 'h{}'.format(n)},
+        'diff_url': url + 'web/o/r/pull/{}.diff'.format(n),
+        'issue_url': url + 'api/repos/o/r/issues/{}'.format(n),
+    }
+
+
+def _diff(n, is_go):
+    name = 'pkg/f{}.go'.format(n) if is_go else 'docs/f{}.md'.format(n)
+    return 'diff --git a/{0} b/{0}\n--- a/{0}\n+++ b/{0}\n@@ -1 +1 @@\n-a\n+b\n'.format(name)
+
+
+class CrawlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGitHub().start()
+        self.restore = point_util_at(util, self.server.url)
+        self.tmp = tempfile.mkdtemp()
+        url = self.server.url
+        pulls = [_pull(url, n, n % 3 != 0) for n in range(1, 8)]
+        for page in range(1, 5):
+            self.server.routes[self._page_path(page)] = pulls[(page - 1) * 2:page * 2]
+        for p in pulls:
+            n = p['number']
+            self.server.routes['/web/o/r/pull/{}.diff'.format(n)] = _diff(n, n % 2 == 1)
+            self.server.routes['/api/repos/o/r/issues/{}'.format(n)] = {'number': n, 'title': 'bug {}'.format(n)}
+
+    def tearDown(self):
+        self.restore()
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def _page_path(self, page, order='sort=created&direction=asc'):
+        return '/api/repos/o/r/pulls?state=closed&{}&per_page=2&page={}'.format(order, page)
+
+    def _crawler(self, dst_dir):
+        return Crawler(token=None, dst_dir=dst_dir, per_page=2, max_request_tries=1, concurrency=4,
+                       cache_dir=dst_dir + '.cache', catalog_path=dst_dir + '.sqlite3')
+
+    def _files(self, dst_dir):
+        files = {}
+        repo_dir = os.path.join(dst_dir, 'o', 'r')
+        for name in sorted(os.listdir(repo_dir)):
+            # the journal holds run times
+            if name in ('crawl-journal.log', record_store.store_dir_name):
+                continue
+            with open(os.path.join(repo_dir, name)) as f:
+                files[name] = f.read()
+        # records under the names the files layout gives them
+        store = record_store.open_store('auto', dst_dir, 'o', 'r', readonly=True)
+        if isinstance(store, record_store.RecordStore):
+            for kind, name in (('pull', 'pull-{}.json'), ('issue', 'issue-{}.json'),
+                               ('pulls_page', 'pulls-page-{}.json'), ('pulls_since_page', 'pulls-since-{}.json')):
+                for key in store.keys(kind):
+                    files[name.format(key)] = store.get(kind, key)
+        store.close()
+        return dict(sorted(files.items()))
+
+    def _crawl(self, use_async):
+        dst_dir = os.path.join(self.tmp, 'async' if use_async else 'serial')
+        crawler = self._crawler(dst_dir)
+        if use_async:
+            crawler.crawl_async('o', 'r')
+        else:
+            crawler.crawl('o', 'r')
+        return self._files(dst_dir)
+
+    def test_async_crawl_writes_the_same_files(self):
+        serial = self._crawl(False)
+        self.assertIn('pulls-page-4.json', serial)
+        # defect pulls that change a go file: 1, 5 and 7 (4 is not merged)
+        self.assertEqual(['issue-1.json', 'issue-5.json', 'issue-7.json'],
+                         [name for name in serial if name.startswith('issue-')])
+        self.assertEqual(['pull-1.json', 'pull-5.json', 'pull-7.json'],
+                         [name for name in serial if name.startswith('pull-')])
+        self.assertEqual(serial, self._crawl(True))
+
+    def test_summary_counts_the_changed_go_files(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self._crawl(False)
+        self.assertIn('Modi_go_PR : 3 , Total_modi_go_file : 3', out.getvalue())
+
+    def test_resumes_from_the_journal(self):
+        dst_dir = os.path.join(self.tmp, 'resumed')
+        page_3 = self.server.routes.pop(self._page_path(3))
+        with self.assertRaises(util.RequestFailed):
+            self._crawler(dst_dir).crawl('o', 'r')
+
+        self.server.routes[self._page_path(3)] = page_3
+        del self.server.requests[:]
+        self._crawler(dst_dir).crawl('o', 'r')
+        # pages 1 and 2 and their pulls are not visited again
+        self.assertEqual(self._page_path(3), self.server.requests[0])
+        self.assertNotIn('/web/o/r/pull/1.diff', self.server.requests)
+        self.assertEqual(self._crawl(False), self._files(dst_dir))
+
+    def test_incremental_crawl_only_visits_new_pulls(self):
+        dst_dir = os.path.join(self.tmp, 'incremental')
+        self._crawler(dst_dir).crawl('o', 'r')
+        self.assertNotIn('pull-8.json', self._files(dst_dir))
+
+        new = _pull(self.server.url, 8, True)
+        new['closed_at'] = new['updated_at'] = '2999-01-01T00:00:00Z'
+        old = self.server.routes[self._page_path(1)][0]
+        self.server.routes[self._page_path(1, 'sort=updated&direction=desc')] = [new, old]
+        self.server.routes['/web/o/r/pull/8.diff'] = _diff(8, True)
+        self.server.routes['/api/repos/o/r/issues/8'] = {'number': 8}
+        del self.server.requests[:]
+        self._crawler(dst_dir).crawl('o', 'r', incremental=True)
+        self.assertIn('pull-8.json', self._files(dst_dir))
+        self.assertEqual([self._page_path(1, 'sort=updated&direction=desc'), '/web/o/r/pull/8.diff',
+                          '/api/repos/o/r/issues/8'], self.server.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
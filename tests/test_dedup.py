@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dedup import PairDeduplicator, dedup_file, pair_key
+
+
+def _code(i, change):
+    body = ''.join('\tv{0} := a * {0} + {1}'.format(k, i) for k in range(12))
+    return 'func F{}(a int) int {{{}\treturn a {}}}'.format(i, body, change)
+
+
+class PairDeduplicatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-dedup-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_near_duplicates_are_dropped(self):
+        d = PairDeduplicator()
+        self.assertIsNone(d.duplicate_of('a', _code(1, '- 1'), _code(1, '+ 1')))
+        # the same fix cherry-picked with other whitespace
+        self.assertEqual(d.duplicate_of('b', _code(1, '- 1').replace('\t', '  '), _code(1, '+ 1')), 'a')
+        self.assertIsNone(d.duplicate_of('c', _code(2, '- 1'), _code(2, '+ 1')))
+        self.assertEqual([(dropped, kept) for dropped, kept, _ in d.dropped], [('b', 'a')])
+        self.assertEqual(d.num_seen, 3)
+
+    def test_dedup_file(self):
+        src = os.path.join(self.tmp, 'o_r_GHPR.txt')
+        pairs = [(1, '- 1', '+ 1'), (2, '- 1', '+ 1'), (1, '- 1', '+ 1'), (3, '- 2', '+ 2')]
+        with open(src, 'w', newline='', encoding='UTF-8') as f:
+            for n, (i, old, new) in enumerate(pairs):
+                f.write('1<CODESPLIT>u{0}<CODESPLIT>F{1}<CODESPLIT>t<CODESPLIT>{2}\n'.format(n, i, _code(i, old)))
+                f.write('0<CODESPLIT>v{0}<CODESPLIT>F{1}<CODESPLIT>t<CODESPLIT>{2}\n'.format(n, i, _code(i, new)))
+        d = PairDeduplicator()
+        dst = os.path.join(self.tmp, 'out.txt')
+        self.assertEqual(dedup_file(src, dst, d), (3, 1))
+        with open(dst, encoding='UTF-8') as f:
+            self.assertEqual([line.split('<CODESPLIT>')[1] for line in f], ['u0', 'v0', 'u1', 'v1', 'u3', 'v3'])
+
+        report = os.path.join(self.tmp, 'report.jsonl')
+        d.write_report(report)
+        with open(report, encoding='UTF-8') as f:
+            entry = json.loads(f.readline())
+        self.assertEqual((entry['dropped'], entry['kept']), (pair_key('u2', 'F1'), pair_key('u0', 'F1')))
+
+        # a later run adds its own drops to the report, the earlier ones are kept and not repeated
+        self.assertEqual(dedup_file(src, dst, d), (0, 4))
+        d.write_report(report)
+        d.write_report(report)
+        with open(report, encoding='UTF-8') as f:
+            self.assertEqual(len(f.readlines()), 1 + 4)
+
+    def test_pair_keys_of_different_fields_differ(self):
+        self.assertNotEqual(pair_key('https://github.com/o/r/raw/s/a.go#x', 'F'),
+                            pair_key('https://github.com/o/r/raw/s/a.go', 'x#F'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from my_devider import Devider
+
+
+class StreamDevideTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-split-')
+        os.chdir(self.tmp)
+        os.mkdir('result')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def write_pairs(self, pairs):
+        with open('result/o_r_GHPR.txt', 'w', newline='', encoding='UTF-8') as f:
+            for defective, clean in pairs:
+                f.write(defective + clean)
+
+    def read_splits(self):
+        splits = []
+        for name in ('train', 'val', 'test'):
+            with open('result/r_{}.txt'.format(name), 'r', newline='\n', encoding='UTF-8') as f:
+                lines = f.readlines()
+            splits.append(list(zip(lines[::2], lines[1::2])))
+        return splits
+
+    def test_pairs_stay_whole_in_proportion(self):
+        pairs = [('1<CODESPLIT>u{0}<CODESPLIT>F{0}<CODESPLIT>t<CODESPLIT>x := 1\n'.format(i),
+                  '0<CODESPLIT>v{0}<CODESPLIT>F{0}<CODESPLIT>t<CODESPLIT>x := 2\n'.format(i)) for i in range(100)]
+        self.write_pairs(pairs)
+        self.assertEqual(Devider(file_path='./result/o_r_GHPR.txt').stream_devide(), (80, 10, 10))
+        splits = self.read_splits()
+        self.assertEqual(sorted(sum(splits, [])), sorted(pairs))
+        for split in splits:
+            self.assertTrue(all(d.startswith('1') and c.startswith('0') for d, c in split))
+
+    def test_seed_gives_the_same_split(self):
+        self.write_pairs([('1 {}\n'.format(i), '0 {}\n'.format(i)) for i in range(30)])
+        Devider(file_path='./result/o_r_GHPR.txt').stream_devide(seed=3)
+        first = self.read_splits()
+        Devider(file_path='./result/o_r_GHPR.txt').stream_devide(seed=3)
+        self.assertEqual(first, self.read_splits())
+        Devider(file_path='./result/o_r_GHPR.txt').stream_devide(seed=4)
+        self.assertNotEqual(first, self.read_splits())
+
+    def test_code_with_carriage_returns_keeps_pairs_whole(self):
+        # cut from a CRLF go file
+        pairs = [('1<CODESPLIT>u{0}<CODESPLIT>F{0}<CODESPLIT>t<CODESPLIT>func F{0}() {{\r\tx := 1\r}}\r\n'.format(i),
+                  '0<CODESPLIT>v{0}<CODESPLIT>F{0}<CODESPLIT>t<CODESPLIT>func F{0}() {{\r\tx := 2\r}}\r\n'.format(i))
+                 for i in range(20)]
+        self.write_pairs(pairs)
+        self.assertEqual(sum(Devider(file_path='./result/o_r_GHPR.txt').stream_devide()), 20)
+        self.assertEqual(sorted(sum(self.read_splits(), [])), sorted(pairs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diff_parser import DiffFile, DiffHunk, PatchError, apply_hunks, count_go_files, iter_diff, modified_functions
+
+
+diff_text = '''diff --git a/pkg/a.go b/pkg/a.go
+index 1234567..89abcde 100644
+--- a/pkg/a.go
++++ b/pkg/a.go
+@@ -10,7 +10,7 @@ func (s *Server) Serve() error {
+ \tx := 1
+-\ty := 2
++\ty := 3
+ \treturn nil
+@@ -40 +40 @@ func Close() {
+-\ta()
++\tb()
+diff --git a/README.md b/README.md
+index 1111111..2222222 100644
+--- a/README.md
++++ b/README.md
+@@ -1 +1,2 @@
+ # r
++more
+diff --git a/img.png b/img.png
+index 3333333..4444444 100644
+Binary files a/img.png and b/img.png differ
+diff --git a/pkg/b.go b/pkg/b.go
+new file mode 100644
+index 0000000..5555555
+--- /dev/null
++++ b/pkg/b.go
+@@ -0,0 +1,3 @@
++package pkg
++
++var B = 1
+'''
+
+
+class DiffParserTest(unittest.TestCase):
+
+    def test_events(self):
+        events = list(iter_diff(diff_text.split('\n'), keep_lines=True))
+        kinds = [(type(e).__name__, e.path if isinstance(e, DiffFile) else e.file.path) for e in events]
+        self.assertEqual(kinds, [
+            ('DiffFile', 'pkg/a.go'), ('DiffHunk', 'pkg/a.go'), ('DiffHunk', 'pkg/a.go'),
+            ('DiffFile', 'README.md'), ('DiffHunk', 'README.md'),
+            ('DiffFile', 'img.png'),
+            ('DiffFile', 'pkg/b.go'), ('DiffHunk', 'pkg/b.go'),
+        ])
+        a, first, second = events[:3]
+        self.assertEqual((a.old_blob, a.new_blob), ('1234567', '89abcde'))
+        self.assertEqual((first.old_start, first.old_count, first.new_start, first.new_count), (10, 7, 10, 7))
+        self.assertEqual(first.function, 'func (s *Server) Serve() error {')
+        self.assertEqual(first.lines, [' \tx := 1', '-\ty := 2', '+\ty := 3', ' \treturn nil'])
+        self.assertEqual((second.old_count, second.new_count), (1, 1))
+        self.assertIsNone(events[4].function)
+        self.assertEqual((events[6].old_blob, events[6].new_blob), ('0000000', '5555555'))
+
+    def test_lines_are_dropped_unless_kept(self):
+        hunks = [e for e in iter_diff(diff_text.split('\n')) if isinstance(e, DiffHunk)]
+        self.assertEqual([h.lines for h in hunks], [[], [], [], []])
+
+    def test_count_go_files(self):
+        self.assertEqual(count_go_files(diff_text.split('\n')), 2)
+        self.assertEqual(count_go_files([]), 0)
+
+    def test_modified_functions(self):
+        self.assertEqual(modified_functions(iter_diff(diff_text.split('\n'))),
+                         ['pkg/a.go', 'func (s *Server) Serve() error {', 'func Close() {'])
+
+    def test_paths_with_spaces(self):
+        # as git writes them, with a tab after a path that holds a space
+        text = ('diff --git a/my dir/a b.go b/my dir/a b.go\n'
+                'index 6f79a5b..8e4f808 100644\n'
+                '--- a/my dir/a b.go\t\n'
+                '+++ b/my dir/a b.go\t\n'
+                '@@ -1,2 +1,2 @@\n'
+                ' package a\n'
+                '-var A = 1\n'
+                '+var A = 2\n'
+                'diff --git a/old name.go b/new b/x.go\n'
+                'similarity index 100%\n'
+                'rename from old name.go\n'
+                'rename to new b/x.go\n')
+        files = [e for e in iter_diff(text.split('\n')) if isinstance(e, DiffFile)]
+        self.assertEqual([(f.path, f.new_path) for f in files],
+                         [('my dir/a b.go', 'my dir/a b.go'), ('old name.go', 'new b/x.go')])
+        self.assertTrue(files[0].is_go and files[0].changed_in_place())
+        self.assertEqual(count_go_files(text.split('\n')), 2)
+
+
+def _edit(rng, lines):
+    lines = list(lines)
+    for _ in range(rng.randint(1, 4)):
+        i = rng.randrange(len(lines) + 1)
+        op = rng.random()
+        if op < 0.4 and i < len(lines):
+            lines[i] = 'changed {}'.format(rng.random())
+        elif op < 0.7:
+            lines.insert(i, 'added {}'.format(rng.random()))
+        elif i < len(lines):
+            del lines[i]
+    return lines
+
+
+@unittest.skipIf(shutil.which('git') is None, 'needs git')
+class ApplyHunksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-patch-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def git_diff(self, old, new):
+        paths = []
+        for name, content in (('a.go', old), ('b.go', new)):
+            paths.append(os.path.join(self.tmp, name))
+            with open(paths[-1], 'wb') as f:
+                f.write(content)
+        r = subprocess.run(['git', 'diff', '--no-index', '--no-color', '-U2'] + paths, stdout=subprocess.PIPE)
+        return [e for e in iter_diff(r.stdout.decode('UTF-8').splitlines(True), keep_lines=True)
+                if isinstance(e, DiffHunk)]
+
+    def test_matches_git(self):
+        rng = random.Random(7)
+        for n in range(60):
+            old = ['line {}'.format(i) for i in range(rng.randint(1, 30))]
+            new = _edit(rng, old)
+            old_eol, new_eol = rng.random() < 0.8, rng.random() < 0.8
+            old_content = ('\n'.join(old) + ('\n' if old_eol else '')).encode('UTF-8')
+            new_content = ('\n'.join(new) + ('\n' if new_eol and new else '')).encode('UTF-8')
+            hunks = self.git_diff(old_content, new_content)
+            if old_content != new_content:
+                self.assertEqual(apply_hunks(old_content, hunks), new_content, n)
+
+    def test_other_base_does_not_apply(self):
+        hunks = self.git_diff(b'a\nb\nc\n', b'a\nB\nc\n')
+        with self.assertRaises(PatchError):
+            apply_hunks(b'a\nx\nc\n', hunks)
+        with self.assertRaises(PatchError):
+            apply_hunks(b'a\r\nb\r\nc\r\n', hunks)
+        with self.assertRaises(PatchError):
+            apply_hunks(b'\xff\n', hunks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ghpr
+import util
+from benchmark import FakeRepo, StandIn
+from http_cache import HttpCache
+from my_crawler import Crawler
+from my_devider import Devider, PairSplitter
+from my_writer import Writer
+from request_scheduler import RequestScheduler
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-pipeline-')
+        self.repos = [FakeRepo('a', 'x', num_pulls=30, seed=1), FakeRepo('b', 'y', num_pulls=45, seed=2)]
+        self.stand_in = StandIn(self.repos).start()
+        util.use_github_host(self.stand_in.api_url, self.stand_in.web_url)
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        util.use_github_host('https://api.github.com/', 'https://github.com/')
+        self.stand_in.stop()
+        shutil.rmtree(self.tmp)
+
+    def stages(self, name):
+        work_dir = os.path.join(self.tmp, name)
+        os.mkdir(work_dir)
+        os.chdir(work_dir)
+        scheduler = RequestScheduler(['t'], HttpCache('.http_cache'), request_retry_wait_secs=0.01,
+                                     max_backoff_secs=0.1)
+        crawler = Crawler(dst_dir='repos', per_page=10, concurrency=4, scheduler=scheduler,
+                          catalog_path='catalog.sqlite3')
+        writer = Writer(tokens=['t'], dst_dir='repos', request_retry_wait_secs=0.01, scheduler=scheduler,
+                        catalog=crawler._catalog)
+        return crawler, writer
+
+    def outputs(self, name):
+        out = {}
+        for r in self.repos:
+            for path in [util.ghpr_path_template.format(owner=r.owner, repo=r.repo)] + \
+                    [util.devided_file_template.format(pro_name=r.repo, type=t) for t in ('train', 'val', 'test')]:
+                with open(os.path.join(self.tmp, name, path), 'rb') as f:
+                    out[path] = f.read()
+        return out
+
+    def test_same_files_as_the_staged_run(self):
+        crawler, writer = self.stages('staged')
+        for r in self.repos:
+            crawler.crawl_async(r.owner, r.repo)
+        writer.writer('repos')
+        split = {}
+        for r in self.repos:
+            path = util.ghpr_path_template.format(owner=r.owner, repo=r.repo)
+            split['{}/{}'.format(r.owner, r.repo)] = Devider(file_path=path).stream_devide()
+
+        crawler, writer = self.stages('pipeline')
+        results = ghpr.run_pipeline(crawler, writer, [(r.owner, r.repo) for r in self.repos], depth=4)
+        self.assertEqual({k: v[1] for k, v in results.items()}, split)
+        self.assertEqual({k: v[0] for k, v in results.items()}, {k: sum(v) for k, v in split.items()})
+        self.assertGreater(sum(v[0] for v in results.values()), 0)
+        os.chdir(self.cwd)
+        self.assertEqual(self.outputs('staged'), self.outputs('pipeline'))
+
+
+class PairSplitterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-splitter-')
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp)
+        os.mkdir('result')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_pairs_stay_together_in_ratio(self):
+        splitter = PairSplitter('p', seed=3)
+        for i in range(25):
+            splitter.add('1<CODESPLIT>d{}\n'.format(i), '0<CODESPLIT>c{}\n'.format(i))
+        splitter.close()
+        # the two full blocks of 10 are dealt 8, 1, 1 each
+        self.assertEqual(sum(splitter.counts), 25)
+        self.assertGreaterEqual(min(splitter.counts[1:]), 2)
+        for t, n in zip(('train', 'val', 'test'), splitter.counts):
+            with open(util.devided_file_template.format(pro_name='p', type=t)) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 2 * n)
+            self.assertEqual([l.split('d')[-1] for l in lines[::2]], [l.split('c')[-1] for l in lines[1::2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
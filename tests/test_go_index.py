@@ -0,0 +1,84 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from blob_store import Blob
+from go_index import GoFunctionIndex, parse_signature
+
+
+source = '''package p
+
+// func Commented() {
+func Raw() string {
+\treturn `{ not
+a brace }`
+}
+
+func Runes() (rune, string) {
+\t/* } */
+\treturn '}', "{\\"}"
+}
+
+type Server[T any] struct{ v T }
+
+func (s *Server[T]) Serve(opts struct{ n int }, f func() interface{}) error {
+\tif true {
+\t\treturn nil
+\t}
+\treturn nil
+}
+
+func Map[K comparable, V any](m map[K]V) []K {
+\treturn nil
+}
+
+func Asm(x int) int
+
+func Close() {}
+'''
+
+
+class GoFunctionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = GoFunctionIndex(source)
+        self.lines = source.split('\n')
+
+    def test_spans(self):
+        self.assertEqual(self.index.find('Raw'), (3, 6))
+        self.assertEqual(self.index.find('Runes'), (8, 11))
+        self.assertEqual(self.index.find('Serve', 'Server'), (15, 20))
+        self.assertEqual(self.index.find('Map'), (22, 24))
+        self.assertEqual(self.index.find('Close'), (28, 28))
+        self.assertEqual(self.lines[20], '}')
+
+    def test_mapped_blob(self):
+        path = os.path.join(tempfile.mkdtemp(prefix='ghpr-test-index-'), 'p.go')
+        try:
+            with open(path, 'wb') as f:
+                f.write(source.encode('UTF-8'))
+            blob = Blob.map(path)
+            index = GoFunctionIndex(blob.data)
+            self.assertEqual(sorted((n, index.find(n)) for n in index.names()),
+                             sorted((n, self.index.find(n)) for n in self.index.names()))
+            start, end = index.find('Raw')
+            self.assertEqual(blob.join_lines(start, end), 'func Raw() string {\treturn `{ nota brace }`}')
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_comments_and_bodiless_declarations_are_skipped(self):
+        self.assertIsNone(self.index.find('Commented'))
+        self.assertIsNone(self.index.find('Asm'))
+        self.assertEqual(sorted(self.index.names()), ['Close', 'Map', 'Raw', 'Runes', 'Serve', 'Server.Serve'])
+
+    def test_parse_signature(self):
+        self.assertEqual(parse_signature('func (s *Server[T]) Serve(opts Options) error {'), ('Server', 'Serve'))
+        self.assertEqual(parse_signature(' func Map[K comparable](m map[K]int) {'), (None, 'Map'))
+        self.assertEqual(parse_signature('type T struct {'), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
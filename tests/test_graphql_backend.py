@@ -0,0 +1,94 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import util
+from graphql_backend import GraphQLPulls
+
+
+def _labels(*names):
+    return {'nodes': [{'databaseId': i, 'name': n} for i, n in enumerate(names)]}
+
+
+def _node(number, issues=()):
+    return {
+        'number': number,
+        'title': 'fix {}'.format(number),
+        'body': 'fixes #{}'.format(number + 100),
+        'url': 'https://github.com/o/r/pull/{}'.format(number),
+        'createdAt': '2021-01-01T00:00:00Z',
+        'updatedAt': '2021-01-02T00:00:00Z',
+        'closedAt': '2021-01-03T00:00:00Z',
+        'mergedAt': '2021-01-03T00:00:00Z',
+        'baseRefName': 'main',
+        'baseRefOid': 'b' * 40,
+        'headRefName': 'fix',
+        'headRefOid': 'h' * 40,
+        'labels': _labels('bug'),
+        'closingIssuesReferences': {'nodes': list(issues)},
+    }
+
+
+def _issue(number):
+    return {
+        'number': number,
+        'databaseId': 7000 + number,
+        'title': 'crash {}'.format(number),
+        'body': None,
+        'url': 'https://github.com/o/r/issues/{}'.format(number),
+        'state': 'CLOSED',
+        'createdAt': '2020-12-01T00:00:00Z',
+        'closedAt': '2021-01-03T00:00:00Z',
+        'authorAssociation': 'NONE',
+        'author': None,
+        'labels': _labels(),
+    }
+
+
+class _Scheduler(object):
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.posts = []
+
+    def post_json(self, url, body, resource='core'):
+        self.posts.append((url, body, resource))
+        return self.answer
+
+
+class GraphQLPullsTest(unittest.TestCase):
+
+    def test_pulls_are_shaped_like_rest(self):
+        scheduler = _Scheduler({'data': {'repository': {
+            'databaseId': 42,
+            'pullRequests': {
+                'pageInfo': {'hasNextPage': False, 'endCursor': 'c2'},
+                'nodes': [_node(1, [_issue(101)]), _node(2)],
+            },
+        }}})
+        pulls, cursor = GraphQLPulls(scheduler).fetch_page('o', 'r', 2, cursor='c1', by_update=True)
+        self.assertEqual(cursor, 'c2')
+        url, body, resource = scheduler.posts[0]
+        self.assertEqual((url, resource), (util.graphql_url, 'graphql'))
+        self.assertEqual(body['variables']['cursor'], 'c1')
+        self.assertEqual((body['variables']['order'], body['variables']['direction']), ('UPDATED_AT', 'DESC'))
+
+        p = pulls[0]
+        self.assertTrue(util.is_related_with_defect(p))
+        self.assertEqual(p['diff_url'], 'https://github.com/o/r/pull/1.diff')
+        self.assertEqual(p['base'], {'ref': 'main', 'sha': 'b' * 40, 'repo': {'id': 42}})
+        self.assertEqual(p['labels'], [{'id': 0, 'name': 'bug'}])
+        issue = p['closing_issues'][0]
+        self.assertEqual((issue['number'], issue['id'], issue['state']), (101, 7101, 'closed'))
+        self.assertEqual(issue['user'], {'login': None})
+        self.assertEqual(pulls[1]['closing_issues'], [])
+
+    def test_errors_raise(self):
+        scheduler = _Scheduler({'errors': [{'message': 'Could not resolve to a Repository'}], 'data': None})
+        with self.assertRaises(util.RequestFailed):
+            GraphQLPulls(scheduler).fetch_page('o', 'missing', 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_github import FakeGitHub
+from http_cache import HttpCache
+
+
+class HttpCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGitHub().start()
+        self.server.routes['/api/pulls'] = [{'number': 1}]
+        self.server.routes['/web/raw/a.go'] = 'package a\n'
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_revalidates_with_etag(self):
+        cache = HttpCache(self.tmp)
+        url = self.server.url + 'api/pulls'
+        first = cache.get(url)
+        self.assertEqual([{'number': 1}], first.json())
+        self.assertFalse(first.from_cache)
+
+        # a new cache over the same directory sends the stored ETag and gets a 304
+        cache = HttpCache(self.tmp)
+        second = cache.get(url)
+        self.assertTrue(second.from_cache)
+        self.assertEqual(200, second.status_code)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual((0, 1, 0), (cache.num_hits, cache.num_revalidated, cache.num_misses))
+        self.assertEqual(2, len(self.server.requests))
+
+        self.server.routes['/api/pulls'] = [{'number': 2}]
+        self.assertEqual([{'number': 2}], cache.get(url).json())
+        self.assertEqual(1, cache.num_misses)
+
+    def test_immutable_hit_makes_no_request(self):
+        cache = HttpCache(self.tmp)
+        url = self.server.url + 'web/raw/a.go'
+        cache.get(url, immutable=True)
+        r = cache.get(url)
+        self.assertEqual('package a\n', r.text)
+        self.assertEqual(1, cache.num_hits)
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_counts_hits_of_concurrent_workers(self):
+        cache = HttpCache(self.tmp)
+        url = self.server.url + 'web/raw/a.go'
+        cache.get(url, immutable=True)
+
+        def hit():
+            for _ in range(200):
+                cache.cached(url, immutable=True)
+        threads = [threading.Thread(target=hit) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual((8 * 200, 1), (cache.num_hits, cache.num_misses))
+
+    def test_evicts_least_recently_used(self):
+        cache = HttpCache(self.tmp, max_bytes=20)
+        cache.get(self.server.url + 'web/raw/a.go', immutable=True)
+        cache.get(self.server.url + 'api/pulls')
+        self.assertEqual(404, cache.get(self.server.url + 'api/missing').status_code)
+        self.assertEqual(15, cache._total_bytes)
+        self.assertEqual(1, len(cache._entries))
+        # a.go was evicted so it is fetched again
+        self.assertFalse(cache.get(self.server.url + 'web/raw/a.go').from_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import Metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counters_and_histograms(self):
+        m = Metrics()
+        m.inc('ghpr_requests_total', kind='diff', status='200')
+        m.inc('ghpr_requests_total', 2, kind='diff', status='200')
+        m.inc('ghpr_requests_total', kind='issue', status='404')
+        for v in (0.003, 0.02, 0.02, 100):
+            m.observe('ghpr_request_seconds', v, kind='diff')
+        self.assertEqual(m.counter('ghpr_requests_total', status='200', kind='diff'), 3)
+        self.assertEqual(m.counter('ghpr_requests_total', kind='pulls_page', status='200'), 0)
+
+        h = m.summary()['histograms']['ghpr_request_seconds'][0]
+        self.assertEqual((h['kind'], h['count']), ('diff', 4))
+        buckets = dict((str(le), n) for le, n in h['buckets'])
+        self.assertEqual((buckets['0.005'], buckets['0.025'], buckets['60'], buckets['+Inf']), (1, 3, 3, 4))
+
+        text = m.prometheus()
+        self.assertIn('# TYPE ghpr_requests_total counter\n', text)
+        self.assertIn('ghpr_requests_total{kind="diff",status="200"} 3\n', text)
+        self.assertIn('ghpr_request_seconds_bucket{kind="diff",le="+Inf"} 4\n', text)
+        self.assertIn('ghpr_request_seconds_count{kind="diff"} 4\n', text)
+
+    def test_merge_worker_snapshot(self):
+        parent, worker = Metrics(), Metrics()
+        parent.inc('ghpr_rows_written_total', 2)
+        worker.inc('ghpr_rows_written_total', 4)
+        worker.observe('ghpr_extract_seconds', 0.5)
+        parent.merge(pickle.loads(pickle.dumps(worker.snapshot())))
+        self.assertEqual(parent.counter('ghpr_rows_written_total'), 6)
+        self.assertEqual(parent.summary()['histograms']['ghpr_extract_seconds'][0]['sum'], 0.5)
+        parent.reset()
+        self.assertEqual(parent.summary(), {'counters': {}, 'histograms': {}})
+
+    def test_profiled_stage(self):
+        tmp = tempfile.mkdtemp(prefix='ghpr-test-metrics-')
+        try:
+            m = Metrics()
+            m.enable_profiling(['write'], tmp)
+            with m.stage('crawl'):
+                pass
+            with m.stage('write'):
+                sum(range(1000))
+            self.assertEqual(os.listdir(tmp), ['write-{}.prof'.format(os.getpid())])
+            self.assertEqual(sorted(c['stage'] for c in m.summary()['counters']['ghpr_stage_seconds_total']),
+                             ['crawl', 'write'])
+            m.save(os.path.join(tmp, 'metrics'))
+            self.assertTrue(os.path.isfile(os.path.join(tmp, 'metrics.prom')))
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_ordered_map_keeps_order_within_the_window(self):
+        running = []
+        most = [0]
+        lock = threading.Lock()
+
+        def slow(i):
+            with lock:
+                running.append(i)
+                most[0] = max(most[0], len(running))
+            # later items finish first
+            time.sleep(0.02 * (5 - i % 5))
+            with lock:
+                running.remove(i)
+            return i * i
+
+        with ThreadPoolExecutor(8) as executor:
+            self.assertEqual(list(pipeline.ordered_map(executor, slow, range(12), window=3)),
+                             [i * i for i in range(12)])
+        self.assertLessEqual(most[0], 3)
+
+    def test_background_raises_in_the_consumer(self):
+        def produce():
+            yield 1
+            yield 2
+            raise ValueError('bad diff')
+
+        out = []
+        with self.assertRaises(ValueError):
+            for item in pipeline.background(produce(), maxsize=1):
+                out.append(item)
+        self.assertEqual(out, [1, 2])
+
+    def test_background_is_bounded_and_stops_with_the_consumer(self):
+        produced = []
+        closed = threading.Event()
+
+        def produce():
+            try:
+                for i in range(1000):
+                    produced.append(i)
+                    yield i
+            finally:
+                closed.set()
+
+        items = pipeline.background(produce(), maxsize=2)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.1)
+        # one taken, two queued and one waiting to be put
+        self.assertLessEqual(len(produced), 4)
+        items.close()
+        self.assertTrue(closed.wait(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import record_store
+import util
+from record_store import RecordStore
+
+
+class RecordStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-records-')
+        self.repo_dir = os.path.join(self.tmp, 'o', 'r')
+        os.makedirs(self.repo_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_put_get_and_reopen(self):
+        store = RecordStore(self.repo_dir, block_bytes=64, max_shard_bytes=200)
+        for n in range(1, 31):
+            store.put('pull', n, {'number': n, 'title': 'fix {}'.format(n)})
+        store.put('issue', 'abc', {'number': 0})
+        # read back from the unflushed block and from written ones
+        self.assertEqual(store.get('pull', 30)['title'], 'fix 30')
+        self.assertEqual(store.get('pull', 2)['title'], 'fix 2')
+        self.assertIn(('issue', 'abc'), store)
+        store.put('pull', 2, {'number': 2, 'title': 'again'})
+        store.close()
+
+        self.assertGreater(len([n for n in os.listdir(os.path.join(self.repo_dir, 'records')) if n.endswith('.gz')]), 1)
+        store = RecordStore(self.repo_dir, readonly=True)
+        self.assertEqual(store.keys('pull'), list(range(1, 31)))
+        self.assertEqual(store.keys('issue'), ['abc'])
+        self.assertEqual(store.get('pull', 2)['title'], 'again')
+        self.assertEqual(store.get('pull', 17), {'number': 17, 'title': 'fix 17'})
+        self.assertIsNone(store.get('pull', 31))
+        store.close()
+
+    def test_shards_are_gzip_files(self):
+        store = RecordStore(self.repo_dir, block_bytes=10)
+        store.put('pull', 1, {'number': 1})
+        store.put('pull', 2, {'number': 2})
+        store.close()
+        with gzip.open(os.path.join(self.repo_dir, 'records', 'records-00000.jsonl.gz'), 'rb') as f:
+            self.assertEqual([record_store.loads(line) for line in f], [{'number': 1}, {'number': 2}])
+
+    def test_block_without_index_lines_is_cut_off(self):
+        store = RecordStore(self.repo_dir)
+        store.put('pull', 1, {'number': 1})
+        store.close()
+        with open(os.path.join(self.repo_dir, 'records', 'records-00000.jsonl.gz'), 'ab') as f:
+            f.write(gzip.compress(b'{"number": 2}\n'))
+        store = RecordStore(self.repo_dir)
+        store.put('pull', 3, {'number': 3})
+        store.close()
+        store = RecordStore(self.repo_dir, readonly=True)
+        self.assertEqual(store.keys('pull'), [1, 3])
+        self.assertEqual(store.get('pull', 3), {'number': 3})
+        store.close()
+
+    def test_convert_repo(self):
+        util.save_json({'number': 4}, os.path.join(self.repo_dir, 'pull-4.json'))
+        util.save_json({'number': 9}, os.path.join(self.repo_dir, 'issue-9.json'))
+        util.save_json([{'number': 4}], os.path.join(self.repo_dir, 'pulls-page-1.json'))
+        self.assertIsInstance(record_store.open_store('auto', self.tmp, 'o', 'r'), record_store.FileStore)
+        self.assertEqual(record_store.convert_repo(self.tmp, 'o', 'r', remove=True), 3)
+        self.assertEqual(os.listdir(self.repo_dir), ['records'])
+        store = record_store.open_store('auto', self.tmp, 'o', 'r', readonly=True)
+        self.assertEqual((store.get('pull', 4), store.get('issue', 9), store.get('pulls_page', 1)),
+                         ({'number': 4}, {'number': 9}, [{'number': 4}]))
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
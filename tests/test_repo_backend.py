@@ -0,0 +1,135 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from repo_backend import GitBackend, HttpBackend
+
+
+def _git(cwd, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME='t', GIT_AUTHOR_EMAIL='t@t', GIT_COMMITTER_NAME='t',
+               GIT_COMMITTER_EMAIL='t@t')
+    return subprocess.run(['git'] + list(args), cwd=cwd, env=env, check=True, stdout=subprocess.PIPE).stdout
+
+
+@unittest.skipIf(shutil.which('git') is None, 'needs git')
+class GitBackendTest(unittest.TestCase):
+    # a throwaway repository with a base commit and a head commit on a branch, cloned bare
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp(prefix='ghpr-test-git-')
+        work = os.path.join(cls.dir, 'work')
+        os.mkdir(work)
+        _git(work, 'init', '-q')
+        os.mkdir(os.path.join(work, 'my dir'))
+        with open(os.path.join(work, 'my dir', 'a.go'), 'w') as f:
+            f.write('package a\n\nfunc F() int {\n\treturn 1\n}\n')
+        _git(work, 'add', '-A')
+        _git(work, 'commit', '-q', '-m', 'base')
+        cls.base = _git(work, 'rev-parse', 'HEAD').decode().strip()
+        _git(work, 'checkout', '-q', '-b', 'fix')
+        with open(os.path.join(work, 'my dir', 'a.go'), 'w') as f:
+            f.write('package a\n\nfunc F() int {\n\treturn 2\n}\n')
+        _git(work, 'commit', '-q', '-a', '-m', 'fix')
+        cls.head = _git(work, 'rev-parse', 'HEAD').decode().strip()
+        cls.git_dir = os.path.join(cls.dir, 'r.git')
+        _git(cls.dir, 'clone', '-q', '--bare', work, cls.git_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def setUp(self):
+        self.backend = GitBackend(self.git_dir)
+
+    def tearDown(self):
+        self.backend.close()
+
+    def test_file_content(self):
+        self.assertEqual(self.backend.file_content(self.head, 'my dir/a.go'),
+                         b'package a\n\nfunc F() int {\n\treturn 2\n}\n')
+
+    def test_missing_file(self):
+        self.assertIsNone(self.backend.file_content(self.head, 'b.go'))
+        self.assertIsNone(self.backend.file_content(self.head, 'my dir/b.go'))
+        self.assertIsNone(self.backend.file_content('0' * 40, 'a.go'))
+        # the process still answers after a missing object
+        self.assertIsNotNone(self.backend.file_content(self.base, 'my dir/a.go'))
+
+    def test_tree_is_not_a_file(self):
+        self.assertIsNone(self.backend.file_content(self.head, 'my dir'))
+
+    def test_diff_lines(self):
+        lines = list(self.backend.diff_lines({'base': {'sha': self.base}, 'head': {'sha': self.head}}))
+        self.assertTrue(lines[0].startswith('diff --git'))
+        self.assertIn('-\treturn 1\n', lines)
+        self.assertIn('+\treturn 2\n', lines)
+
+    def test_diff_of_missing_commits_is_empty_offline(self):
+        self.assertEqual(list(self.backend.diff_lines({'base': {'sha': '0' * 40}, 'head': {'sha': self.head}})), [])
+
+    def test_missing_objects_go_to_the_fallback(self):
+        fallback = _Fallback()
+        backend = GitBackend(self.git_dir, fallback=fallback)
+        try:
+            self.assertEqual(backend.file_content(self.head, 'b.go'), b'from fallback')
+            self.assertEqual(list(backend.diff_lines({'base': {'sha': '0' * 40}, 'head': {'sha': self.head}})),
+                             ['fallback'])
+            self.assertEqual(backend.file_content(self.head, 'my dir/a.go')[:9], b'package a')
+        finally:
+            backend.close()
+        self.assertEqual(fallback.calls, ['file_content', 'diff_lines', 'close'])
+
+
+class _Fallback(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def diff_lines(self, pull, save_path=None):
+        self.calls.append('diff_lines')
+        return ['fallback']
+
+    def file_content(self, sha, path):
+        self.calls.append('file_content')
+        return b'from fallback'
+
+    def close(self):
+        self.calls.append('close')
+
+
+class HttpBackendTest(unittest.TestCase):
+
+    def test_temporary_diff_is_closed_and_removed(self):
+        scheduler = _Downloads()
+        backend = HttpBackend(scheduler, 'o', 'r')
+        num_fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+        for _ in range(3):
+            self.assertEqual(list(backend.diff_lines({'diff_url': 'u'})), ['diff --git a/a.go b/a.go\n'])
+        self.assertFalse(any(os.path.exists(p) for p in scheduler.paths))
+        if num_fds is not None:
+            self.assertEqual(len(os.listdir('/proc/self/fd')), num_fds)
+
+
+class _Downloads(object):
+
+    def __init__(self):
+        self.paths = []
+
+    def download(self, url, path):
+        self.paths.append(path)
+        with open(path, 'w') as f:
+            f.write('diff --git a/a.go b/a.go\n')
+        return _Ok()
+
+
+class _Ok(object):
+    ok = True
+
+
+if __name__ == '__main__':
+    unittest.main()
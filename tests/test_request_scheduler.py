@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import util
+from http_cache import HttpCache
+from metrics import registry as metrics
+from request_scheduler import RequestScheduler
+
+
+class _Response(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = b''
+
+
+class _Session(object):
+    # answers every request with the next of `answers`, an exception is raised
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.num_requests = 0
+        self.tokens = []
+
+    def request(self, method, url, headers=None, json=None):
+        self.num_requests += 1
+        self.tokens.append((headers or {}).get('Authorization'))
+        answer = self.answers[min(self.num_requests, len(self.answers)) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        if isinstance(answer, tuple):
+            return _Response(*answer)
+        return _Response(answer)
+
+    def get(self, url, headers=None):
+        return self.request('GET', url, headers=headers)
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    url = 'https://api.github.com/repos/o/r/issues/1'
+
+    def scheduler(self, answers, tokens=('test',), max_request_tries=3):
+        self.session = _Session(answers)
+        cache = HttpCache(tempfile.mkdtemp(prefix='ghpr-test-cache-'), session=self.session)
+        return RequestScheduler(list(tokens), cache, max_request_tries=max_request_tries, request_retry_wait_secs=0,
+                                max_backoff_secs=0, breaker_threshold=100)
+
+    def test_exhausted_token_is_skipped(self):
+        reset = str(int(time.time()) + 3600)
+        exhausted = (403, {'X-Ratelimit-Remaining': '0', 'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Reset': reset})
+        ok = (200, {'X-Ratelimit-Remaining': '4999', 'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Reset': reset})
+        scheduler = self.scheduler([exhausted, ok, ok], tokens=('a', 'b'))
+        self.assertEqual(scheduler.request('POST', self.url).status_code, 200)
+        self.assertEqual(scheduler.request('POST', self.url).status_code, 200)
+        # the first token waits for its reset, the rest goes to the second one
+        self.assertEqual(self.session.tokens, ['token a', 'token b', 'token b'])
+
+    def test_secondary_rate_limit_pauses_the_token(self):
+        scheduler = self.scheduler([(403, {'Retry-After': '3600'}), 200], tokens=('a', 'b'))
+        self.assertEqual(scheduler.request('POST', self.url).status_code, 200)
+        self.assertEqual(self.session.tokens, ['token a', 'token b'])
+
+    def test_client_error_is_returned(self):
+        scheduler = self.scheduler([404])
+        r = scheduler.request('GET', self.url, use_cache=False)
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(self.session.num_requests, 1)
+
+    def test_server_error_is_retried(self):
+        scheduler = self.scheduler([502, 200])
+        r = scheduler.request('POST', self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.session.num_requests, 2)
+
+    def test_connection_error_is_retried(self):
+        scheduler = self.scheduler([requests.ConnectionError('reset')])
+        with self.assertRaises(util.TooManyRequestFailures):
+            scheduler.request('GET', self.url, use_cache=False)
+        self.assertEqual(self.session.num_requests, 3)
+
+    def test_requests_are_counted(self):
+        metrics.reset()
+        scheduler = self.scheduler([502, 200])
+        scheduler.request('GET', self.url, use_cache=False)
+        self.assertEqual(metrics.counter('ghpr_requests_total', kind='issue', status='502'), 1)
+        self.assertEqual(metrics.counter('ghpr_requests_total', kind='issue', status='200'), 1)
+
+    def test_gives_up_after_max_tries(self):
+        scheduler = self.scheduler([503])
+        with self.assertRaises(util.TooManyRequestFailures):
+            scheduler.request('POST', self.url)
+        self.assertEqual(self.session.num_requests, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
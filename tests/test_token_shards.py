@@ -0,0 +1,65 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import token_shards
+from token_shards import TokenShards, WordPieceTokenizer
+
+_vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', 'func', 'return', 'fix', 'nil', 'err', 'get', '##Name',
+          '(', ')', '{', '}', '!', '=', 'if']
+
+
+def _line(label, n, code):
+    return '<CODESPLIT>'.join([str(label), 'https://github.com/o/r/raw/s{}/a.go'.format(n), 'getName',
+                               'fix nil err', code]) + '\n'
+
+
+class TokenShardsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-shards-')
+        self.vocab_path = os.path.join(self.tmp, 'vocab.txt')
+        with open(self.vocab_path, 'w', encoding='UTF-8') as f:
+            f.write('\n'.join(_vocab) + '\n')
+        self.tokenizer = WordPieceTokenizer(self.vocab_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_word_pieces(self):
+        ids = self.tokenizer.encode('func getName() { return nil } zzz')
+        self.assertEqual([_vocab[i] for i in ids],
+                         ['func', 'get', '##Name', '(', ')', '{', 'return', 'nil', '}', '[UNK]'])
+
+    def test_round_trip(self):
+        src = os.path.join(self.tmp, 'p_train.txt')
+        with open(src, 'w', newline='', encoding='UTF-8') as f:
+            f.write(_line(1, 1, 'func getName() { return err }'))
+            f.write(_line(0, 1, 'func getName() { if err != nil { return err } }'))
+            f.write('not a row\n')
+            f.write('not a row either\n')
+            f.write(_line(1, 2, 'func ok() {}'))
+            f.write(_line(0, 2, 'func ok() { return }'))
+        self.assertEqual(token_shards.export_file(src, self.tokenizer, max_length=8), 4)
+
+        shards = TokenShards(token_shards.shard_dir(src))
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(list(shards.labels), [1, 0, 1, 0])
+        row = shards[1]
+        self.assertEqual(row['url'], 'https://github.com/o/r/raw/s1/a.go')
+        self.assertEqual(row['function_name'], 'getName')
+        self.assertEqual([_vocab[i] for i in row['title']], ['fix', 'nil', 'err'])
+        self.assertEqual(list(row['code']), self.tokenizer.encode('func getName() { if err != nil')[:8])
+        self.assertEqual(len(shards.lengths('code')), 4)
+        self.assertEqual(shards[-1]['url'], shards[3]['url'])
+        self.assertEqual(shards.meta['token_dtype'], 'uint16')
+        self.assertGreater(shards.meta['num_unknown_tokens'], 0)
+        with self.assertRaises(IndexError):
+            shards[4]
+
+
+if __name__ == '__main__':
+    unittest.main()
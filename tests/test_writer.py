@@ -0,0 +1,156 @@
+import json
+import os
+from concurrent.futures import Future
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import columnar
+import util
+from blob_store import git_blob_id
+from diff_parser import DiffHunk, iter_diff
+from git_fixture import make_repo
+from metrics import registry as metrics
+from my_writer import Writer
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+@unittest.skipIf(shutil.which('git') is None, 'needs git')
+class WriterTest(unittest.TestCase):
+    # the writer on the git backend, offline, over pulls saved like the crawler saves them
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ghpr-test-writer-')
+        self.cwd = os.getcwd()
+        self.pulls = make_repo(self.tmp)
+        repo_dir = os.path.join(self.tmp, 'repos', 'o', 'r')
+        os.makedirs(repo_dir)
+        for p in self.pulls:
+            util.save_json(p, util.pull_path_template.format(dst_dir=os.path.join(self.tmp, 'repos'), owner='o',
+                                                             repo='r', pull_number=p['number']))
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def write(self, processes=1, output_format='text', incremental=False, pipeline_depth=16, patch_clean=True):
+        writer = Writer(token=None, dst_dir='repos', backend='git', git_repos_dir='clones', offline=True,
+                        output_format=output_format, pipeline_depth=pipeline_depth, patch_clean=patch_clean)
+        writer.writer('repos', processes=processes, incremental=incremental)
+        if output_format != 'text':
+            return columnar.read_dataset(util.ghpr_columnar_path_template.format(owner='o', repo='r',
+                                                                                 format=output_format))
+        with open(util.ghpr_path_template.format(owner='o', repo='r'), 'r', encoding='UTF-8') as f:
+            return f.read()
+
+    def test_pairs(self):
+        rows = self.write().split('\n')
+        self.assertEqual(len(rows), 2 * len(self.pulls) + 1)
+        label, url, name, title, code = rows[0].split('<CODESPLIT>')
+        self.assertEqual((label, name, title), ('1', 'F5', 'fix 1'))
+        self.assertEqual(url, util.raw_file_url_template.format(owner='o', repo='r', sha=self.pulls[0]['base']['sha'],
+                                                                filename='pkg%2Fa.go'))
+        self.assertIn('return a + 5', code)
+        self.assertIn('return a + 105', rows[1])
+
+    def test_processes_give_the_same_output(self):
+        serial = self.write()
+        self.assertEqual(serial, self.write(processes=2))
+
+    def test_pipelined_write_gives_the_same_output(self):
+        self.assertEqual(self.write(pipeline_depth=0), self.write(pipeline_depth=3))
+
+    @unittest.skipIf(pyarrow is None, 'needs pyarrow')
+    def test_columnar_output_matches_text(self):
+        rows = [row.split('<CODESPLIT>') for row in self.write().split('\n')[:-1]]
+        for output_format in columnar.formats:
+            for processes in (1, 2):
+                table = self.write(processes, output_format).to_pylist()
+                self.assertEqual([[str(r['label']), r['url'], r['function_name'], r['title'], r['code']] for r in table],
+                                 rows)
+                self.assertEqual([r['pull_number'] for r in table], [1, 1, 2, 2, 3, 3, 4, 4])
+
+    def test_patched_clean_files_give_the_same_output(self):
+        downloaded = self.write(patch_clean=False)
+        shutil.rmtree('.blob_store')
+        metrics.reset()
+        self.assertEqual(self.write(), downloaded)
+        # every head file is rebuilt from its base file and the diff
+        self.assertEqual(metrics.counter('ghpr_patched_files_total'), len(self.pulls))
+        self.assertEqual(metrics.counter('ghpr_patch_fallbacks_total', reason='apply'), 0)
+
+    def test_incremental_write_drops_and_adds_pulls(self):
+        full = self.write()
+        pull_path = util.pull_path_template.format(dst_dir='repos', owner='o', repo='r', pull_number=2)
+        with open(pull_path) as f:
+            pull = f.read()
+        for processes in (1, 2):
+            os.remove(pull_path)
+            rows = self.write(processes, incremental=True).split('\n')
+            self.assertEqual(rows, [row for row in full.split('\n') if '<CODESPLIT>fix 2<CODESPLIT>' not in row])
+
+            with open(pull_path, 'w') as f:
+                f.write(pull)
+            rows = self.write(processes, incremental=True).split('\n')[:-1]
+            # the pull is written again, after the others
+            self.assertEqual(sorted(rows), sorted(full.split('\n')[:-1]))
+            self.assertEqual([row.split('<CODESPLIT>')[3] for row in rows[-2:]], ['fix 2', 'fix 2'])
+
+    def test_changed_shas_are_written_again(self):
+        self.write(incremental=True)
+        pull_path = util.pull_path_template.format(dst_dir='repos', owner='o', repo='r', pull_number=1)
+        pull = util.read_json(pull_path)
+        # the same change, now against the head of pull 3
+        pull['base'], pull['head'] = self.pulls[2]['base'], self.pulls[2]['head']
+        util.save_json(pull, pull_path)
+        rows = self.write(incremental=True).split('\n')[:-1]
+        self.assertEqual(len(rows), 2 * len(self.pulls))
+        self.assertEqual([row.split('<CODESPLIT>')[2:4] for row in rows[-2:]], [['F3', 'fix 1'], ['F3', 'fix 1']])
+
+    def test_stored_blob_is_not_downloaded_when_the_patch_fails(self):
+        writer = Writer(token=None, dst_dir='repos', backend='git', git_repos_dir='clones', offline=True)
+        backend = _NoDownloads()
+        writer._backends[('o', 'r')] = backend
+        head = b'package a\n\nvar A = 2\n'
+        # stored for another commit, only its blob id is known for this one
+        writer._blobs.put('other', 'a.go', head)
+        diff = ('diff --git a/a.go b/a.go\n'
+                'index {}..{} 100644\n'
+                '--- a/a.go\n'
+                '+++ b/a.go\n'
+                '@@ -3 +3 @@\n'
+                '-var A = 1\n'
+                '+var A = 2\n').format(git_blob_id(b'x')[:7], git_blob_id(head)[:7])
+        hunks = [e for e in iter_diff(diff.split('\n'), keep_lines=True) if isinstance(e, DiffHunk)]
+        base = Future()
+        # a carriage return never patches
+        base.set_result(writer._blobs.open('b', 'a.go', lambda: b'package a\r\n\r\nvar A = 1\r\n'))
+        metrics.reset()
+        blob = writer._fetch_clean_source('o', 'r', 'h', 'a.go', hunks, base)
+        self.assertEqual(bytes(blob.data), head)
+        self.assertEqual(metrics.counter('ghpr_patch_fallbacks_total', reason='apply'), 1)
+        self.assertEqual(backend.calls, [])
+
+
+class _NoDownloads(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def file_content(self, sha, path):
+        self.calls.append((sha, path))
+        return None
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,328 @@
+import hashlib
+import json
+import os
+import shutil
+from array import array
+from functools import lru_cache
+import numpy as np
+import dedup
+import util
+from metrics import registry as metrics
+
+
+# The train, val and test files of a split, tokenized once when the dataset is built and
+# stored as NumPy arrays, so a training job maps them instead of splitting <CODESPLIT> lines
+# and tokenizing every epoch:
+#   python token_shards.py --vocab vocab.txt ./result/yomo_train.txt ./result/yomo_val.txt
+#   shards = TokenShards('./result/yomo_train.tokens')
+#   row = shards[i]     # {'label': 1, 'title': array([...]), 'code': array([...]), ...}
+# A split's directory holds a .npy file per column. Ragged columns keep the values of all
+# rows back to back in {column}.npy with row i at values[offsets[i]:offsets[i + 1]] of
+# {column}.offsets.npy: title and code as token ids, url and function_name as UTF-8 bytes.
+# labels.npy has a label per row. Rows 2k and 2k + 1 are the defective and the clean side of
+# a pair, as in the text files. meta.json names the vocabulary and its special token ids.
+
+FORMAT_VERSION = 1
+token_columns = ('title', 'code')
+text_columns = ('url', 'function_name')
+_special_tokens = {
+    'unk': ('[UNK]', '<unk>'),
+    'cls': ('[CLS]', '<s>'),
+    'sep': ('[SEP]', '</s>'),
+    'pad': ('[PAD]', '<pad>'),
+}
+
+
+def _tokenizers():
+    # only needed for a tokenizer.json, vocab.txt files are read without it
+    try:
+        import tokenizers
+    except ImportError:
+        raise ImportError('tokenizer.json vocabularies need the tokenizers package (pip install tokenizers)')
+    return tokenizers
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class WordPieceTokenizer(object):
+    # a vocab.txt with a token per line, its line number the id, as BERT style models ship
+    # it. Text is split into words and punctuation like dedup.shingles does, words into the
+    # longest vocabulary pieces from the left, '##' marking a piece that continues a word
+
+    def __init__(self, vocab_path, lowercase=False, max_word_chars=100, cache_size=1 << 16):
+        self.vocab_path = vocab_path
+        self.lowercase = lowercase
+        self.max_word_chars = max_word_chars
+        with open(vocab_path, 'r', encoding='UTF-8') as f:
+            self.vocab = {line.rstrip('\n'): i for i, line in enumerate(f)}
+        self.vocab_size = len(self.vocab)
+        self.special_ids = {name: next((self.vocab[t] for t in tokens if t in self.vocab), None)
+                            for name, tokens in _special_tokens.items()}
+        if self.special_ids['unk'] is None:
+            raise ValueError('{} has no unknown token, one of {}'.format(vocab_path, _special_tokens['unk']))
+        # identifiers repeat all over the code, a word is split once
+        self._word_ids = lru_cache(maxsize=cache_size)(self._split_word)
+
+    def _split_word(self, word):
+        unk = (self.special_ids['unk'],)
+        if len(word) > self.max_word_chars:
+            return unk
+        ids = []
+        start = 0
+        while start < len(word):
+            end = len(word)
+            while end > start:
+                piece = word[start:end] if start == 0 else '##' + word[start:end]
+                i = self.vocab.get(piece)
+                if i is not None:
+                    ids.append(i)
+                    break
+                end -= 1
+            else:
+                return unk
+            start = end
+        return tuple(ids)
+
+    def encode(self, text):
+        if self.lowercase:
+            text = text.lower()
+        ids = []
+        for word in dedup.token_re.findall(text):
+            ids.extend(self._word_ids(word))
+        return ids
+
+    def encode_batch(self, texts):
+        return [self.encode(t) for t in texts]
+
+
+class HuggingFaceTokenizer(object):
+    # a tokenizer.json of the tokenizers package, e.g. the BPE of a RoBERTa style model,
+    # encoding a batch at a time in its native threads
+
+    def __init__(self, path):
+        self.vocab_path = path
+        self._tokenizer = _tokenizers().Tokenizer.from_file(path)
+        self.vocab_size = self._tokenizer.get_vocab_size()
+        self.special_ids = {name: next((self._tokenizer.token_to_id(t) for t in tokens
+                                        if self._tokenizer.token_to_id(t) is not None), None)
+                            for name, tokens in _special_tokens.items()}
+
+    def encode_batch(self, texts):
+        return [e.ids for e in self._tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+def load_tokenizer(path, lowercase=False):
+    if path.endswith('.json'):
+        return HuggingFaceTokenizer(path)
+    return WordPieceTokenizer(path, lowercase)
+
+
+def token_dtype(vocab_size):
+    return np.dtype(np.uint16) if vocab_size <= 1 << 16 else np.dtype(np.int32)
+
+
+class _RaggedColumn(object):
+    # values are streamed to a raw file and moved into the .npy once their number is known
+
+    def __init__(self, dir_path, name, dtype):
+        self.path = os.path.join(dir_path, name + '.npy')
+        self.dtype = dtype
+        self._raw_path = os.path.join(dir_path, name + '.raw')
+        self._raw = open(self._raw_path, 'wb')
+        self.offsets = array('q', [0])
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        self._raw.write(values.tobytes())
+        self.offsets.append(self.offsets[-1] + len(values))
+
+    def close(self, chunk=1 << 22):
+        self._raw.close()
+        n = self.offsets[-1]
+        if n == 0:
+            # an empty file cannot be mapped
+            np.save(self.path, np.zeros(0, dtype=self.dtype))
+        else:
+            values = np.lib.format.open_memmap(self.path, mode='w+', dtype=self.dtype, shape=(n,))
+            with open(self._raw_path, 'rb') as f:
+                pos = 0
+                while pos < n:
+                    part = np.fromfile(f, dtype=self.dtype, count=min(chunk, n - pos))
+                    values[pos:pos + len(part)] = part
+                    pos += len(part)
+            values.flush()
+            del values
+        os.remove(self._raw_path)
+        np.save(self.path[:-len('.npy')] + '.offsets.npy', np.frombuffer(self.offsets, dtype=np.int64))
+        return n
+
+
+class ShardWriter(object):
+    # writes the rows of one split into dst_dir, which only appears once close() is done
+
+    def __init__(self, dst_dir, tokenizer, max_length=None):
+        self.dst_dir = dst_dir
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.dtype = token_dtype(tokenizer.vocab_size)
+        self._tmp_dir = dst_dir + '.tmp'
+        if os.path.isdir(self._tmp_dir):
+            shutil.rmtree(self._tmp_dir)
+        util.make_dir(self._tmp_dir)
+        self._columns = {name: _RaggedColumn(self._tmp_dir, name, self.dtype) for name in token_columns}
+        self._columns.update((name, _RaggedColumn(self._tmp_dir, name, np.uint8)) for name in text_columns)
+        self._labels = array('b')
+        self.num_unknown = 0
+
+    def _ids(self, ids):
+        ids = np.asarray(ids, dtype=self.dtype)
+        if self.max_length is not None:
+            ids = ids[:self.max_length]
+        unk = self.tokenizer.special_ids['unk']
+        if unk is not None:
+            self.num_unknown += int(np.count_nonzero(ids == unk))
+        return ids
+
+    def write_pairs(self, pairs):
+        # pairs of (defective fields, clean fields), the five <CODESPLIT> fields of each side;
+        # a title is tokenized once for both sides
+        titles = self.tokenizer.encode_batch([d[3] for d, _ in pairs])
+        codes = self.tokenizer.encode_batch([fields[4] for pair in pairs for fields in pair])
+        for k, (pair, title) in enumerate(zip(pairs, titles)):
+            title = self._ids(title)
+            for side, fields in enumerate(pair):
+                self._labels.append(int(fields[0]))
+                self._columns['title'].append(title)
+                self._columns['code'].append(self._ids(codes[2 * k + side]))
+                self._columns['url'].append(np.frombuffer(fields[1].encode('UTF-8'), dtype=np.uint8))
+                self._columns['function_name'].append(np.frombuffer(fields[2].encode('UTF-8'), dtype=np.uint8))
+
+    def close(self):
+        # returns the number of rows
+        num_tokens = {name: self._columns[name].close() for name in token_columns}
+        for name in text_columns:
+            self._columns[name].close()
+        np.save(os.path.join(self._tmp_dir, 'labels.npy'), np.frombuffer(self._labels, dtype=np.int8))
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'num_rows': len(self._labels),
+            'token_dtype': self.dtype.name,
+            'token_columns': list(token_columns),
+            'text_columns': list(text_columns),
+            'num_tokens': num_tokens,
+            'num_unknown_tokens': self.num_unknown,
+            'max_length': self.max_length,
+            'vocab': os.path.basename(self.tokenizer.vocab_path),
+            'vocab_sha256': _file_sha256(self.tokenizer.vocab_path),
+            'vocab_size': self.tokenizer.vocab_size,
+            'special_ids': self.tokenizer.special_ids,
+        }
+        util.save_json(meta, os.path.join(self._tmp_dir, 'meta.json'))
+        if os.path.isdir(self.dst_dir):
+            shutil.rmtree(self.dst_dir)
+        os.replace(self._tmp_dir, self.dst_dir)
+        for name, n in num_tokens.items():
+            metrics.inc('ghpr_export_tokens_total', n, column=name)
+        metrics.inc('ghpr_export_rows_total', len(self._labels))
+        metrics.inc('ghpr_export_unknown_tokens_total', self.num_unknown)
+        return len(self._labels)
+
+
+def shard_dir(path):
+    # ./result/yomo_train.txt -> ./result/yomo_train.tokens
+    return os.path.splitext(path)[0] + '.tokens'
+
+
+def export_file(src_path, tokenizer, dst_dir=None, max_length=None, batch_size=256):
+    # tokenizes a split's text file, returns the number of rows written. Pairs whose lines do
+    # not split into five fields are left out, like dedup leaves them alone
+    writer = ShardWriter(dst_dir or shard_dir(src_path), tokenizer, max_length)
+    batch = []
+    with metrics.stage('export'), open(src_path, 'r', newline='\n', encoding='UTF-8') as f:
+        for defective, clean, d, c in dedup.iter_pairs(f):
+            if d is None:
+                metrics.inc('ghpr_export_skipped_pairs_total')
+                continue
+            # the code keeps any <CODESPLIT> it contains
+            batch.append((defective.rstrip('\n').split('<CODESPLIT>', 4), clean.rstrip('\n').split('<CODESPLIT>', 4)))
+            if len(batch) >= batch_size:
+                writer.write_pairs(batch)
+                batch = []
+        if batch:
+            writer.write_pairs(batch)
+        return writer.close()
+
+
+def export_splits(pro_name, tokenizer, max_length=None):
+    # the train, val and test files Devider wrote for a repo; returns their row counts
+    return tuple(export_file(util.devided_file_template.format(pro_name=pro_name, type=name), tokenizer,
+                             util.token_shard_dir_template.format(pro_name=pro_name, type=name), max_length)
+                 for name in ('train', 'val', 'test'))
+
+
+class TokenShards(object):
+    # random access to an exported split, every array is memory mapped and nothing is parsed
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['format_version'] != FORMAT_VERSION:
+            raise ValueError('{} has format version {}, expected {}'.format(
+                path, self.meta['format_version'], FORMAT_VERSION))
+        self.labels = self._load('labels')
+        self._values = {}
+        self._offsets = {}
+        for name in self.meta['token_columns'] + self.meta['text_columns']:
+            self._values[name] = self._load(name)
+            self._offsets[name] = self._load(name + '.offsets')
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.labels)
+
+    def tokens(self, column, i):
+        # the token ids (or UTF-8 bytes) of row i, a view of the mapped file
+        offsets = self._offsets[column]
+        return self._values[column][offsets[i]:offsets[i + 1]]
+
+    def lengths(self, column):
+        # tokens per row, e.g. to bucket rows by length
+        return np.diff(self._offsets[column])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        row = {'label': int(self.labels[i])}
+        for name in self.meta['token_columns']:
+            row[name] = self.tokens(name, i)
+        for name in self.meta['text_columns']:
+            row[name] = self.tokens(name, i).tobytes().decode('UTF-8')
+        return row
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='tokenize split files into NumPy token shards')
+    parser.add_argument('paths', nargs='+', help='train, val or test files of a split')
+    parser.add_argument('--vocab', required=True, help='a vocab.txt with a token per line, or a tokenizer.json')
+    parser.add_argument('--lowercase', action='store_true', help='for uncased vocab.txt vocabularies')
+    parser.add_argument('--max-length', type=int, default=None, help='tokens kept of a title or code')
+    args = parser.parse_args()
+    tokenizer = load_tokenizer(args.vocab, args.lowercase)
+    for path in args.paths:
+        print(path, export_file(path, tokenizer, max_length=args.max_length))
+
+
+if __name__ == '__main__':
+    main()
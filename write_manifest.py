@@ -0,0 +1,83 @@
+import os
+
+
+class ManifestEntry(object):
+
+    def __init__(self, base, head, version, start, end):
+        self.base = base
+        self.head = head
+        self.version = version
+        # byte range of the pull's rows in the dataset file, empty for a pull without rows
+        self.start = start
+        self.end = end
+
+
+class WriteManifest(object):
+    # which pulls a _GHPR.txt file holds rows of, one line per written pull:
+    #   pull <number> <base sha> <head sha> <extractor version> <start> <end>
+    # A later line for the same pull replaces the earlier one. A pull is written again when
+    # its shas or the extractor version change, and its old rows are dropped by compact().
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._load()
+        self._f = open(path, 'a')
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 7 or parts[0] != 'pull':
+                    continue
+                self.entries[int(parts[1])] = ManifestEntry(parts[2], parts[3], int(parts[4]),
+                                                            int(parts[5]), int(parts[6]))
+
+    def data_end(self):
+        return max((e.end for e in self.entries.values()), default=0)
+
+    def is_current(self, number, base, head, version):
+        e = self.entries.get(number)
+        return e is not None and (e.base, e.head, e.version) == (base, head, version)
+
+    def stale(self, shas, version):
+        # pulls with rows that are gone from the crawl or were written from other shas or
+        # by another extractor version; shas is {number: (base sha, head sha)}
+        return {n for n, e in self.entries.items()
+                if n not in shas or (e.base, e.head, e.version) != (shas[n][0], shas[n][1], version)}
+
+    def record(self, number, base, head, version, start, end):
+        self.entries[number] = ManifestEntry(base, head, version, start, end)
+        self._f.write('pull {} {} {} {} {} {}\n'.format(number, base, head, version, start, end))
+        self._f.flush()
+
+    def compact(self, dataset_path, drop):
+        # rewrites the dataset without the rows of the dropped pulls, and without rows past the
+        # last recorded pull (written by an interrupted run), then rewrites the manifest
+        if not os.path.isfile(dataset_path):
+            self.entries = {}
+            drop = set()
+        elif not drop and os.path.getsize(dataset_path) == self.data_end():
+            return
+        kept = sorted(((n, e) for n, e in self.entries.items() if n not in drop), key=lambda ne: ne[1].start)
+        if os.path.isfile(dataset_path):
+            tmp = dataset_path + '.compact'
+            with open(dataset_path, 'rb') as src, open(tmp, 'wb') as dst:
+                for n, e in kept:
+                    src.seek(e.start)
+                    start = dst.tell()
+                    dst.write(src.read(e.end - e.start))
+                    e.start, e.end = start, dst.tell()
+            os.replace(tmp, dataset_path)
+        self.entries = dict(kept)
+        self._f.close()
+        with open(self.path + '.tmp', 'w') as f:
+            for n, e in kept:
+                f.write('pull {} {} {} {} {} {}\n'.format(n, e.base, e.head, e.version, e.start, e.end))
+        os.replace(self.path + '.tmp', self.path)
+        self._f = open(self.path, 'a')
+
+    def close(self):
+        self._f.close()